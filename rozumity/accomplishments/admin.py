@@ -1,12 +1,31 @@
 from django.contrib import admin
 
-from .models import University, Test
+from rozumity.admin import ScalableModelAdmin
+from .models import Education, Speciality, University, Test
 
 
 @admin.register(University)
-class UniversityAdmin(admin.ModelAdmin):
-    pass
+class UniversityAdmin(ScalableModelAdmin):
+    list_display = ('title', 'country')
+    list_select_related = ('country',)
+    search_fields = ('^title',)
+    autocomplete_fields = ('country',)
 
 @admin.register(Test)
-class TestAdmin(admin.ModelAdmin):
-    pass
+class TestAdmin(ScalableModelAdmin):
+    list_display = ('title', 'city')
+    list_select_related = ('city',)
+    search_fields = ('^title',)
+    autocomplete_fields = ('country', 'city')
+
+@admin.register(Speciality)
+class SpecialityAdmin(ScalableModelAdmin):
+    list_display = ('title', 'code_ua')
+    search_fields = ('^title',)
+
+@admin.register(Education)
+class EducationAdmin(ScalableModelAdmin):
+    list_display = ('university', 'speciality', 'university_degree', 'date_start', 'date_end')
+    list_select_related = ('university', 'speciality')
+    search_fields = ('^university__title',)
+    autocomplete_fields = ('university', 'speciality')
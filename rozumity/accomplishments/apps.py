@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AccomplishmentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accomplishments'
+
+    def ready(self):
+        from . import jobs, signals
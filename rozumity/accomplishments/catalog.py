@@ -0,0 +1,187 @@
+"""
+The catalog of specialities, served from memory. A snapshot holds the
+rendered JSON:API documents of every language, a change of a speciality
+builds a new snapshot and swaps it in one assignment, so a request sees
+either the old catalog or the new one, never a mix.
+"""
+import csv
+import json
+import logging
+from asyncio import create_task, sleep
+from bisect import bisect_left
+from contextvars import Context
+from functools import lru_cache
+from hashlib import blake2b
+from pathlib import Path
+from threading import Lock
+from django.conf import settings
+from django.db import router
+from django.urls import reverse
+from django.utils.translation.trans_real import parse_accept_lang_header
+from asgiref.sync import sync_to_async
+
+from rozumity.lifespan import on_startup
+
+from .models import Speciality
+
+# The first language is the default one
+LANGUAGES = ('en', 'ua')
+# Ukrainian is `uk` in HTTP and `ua` in the fixtures
+LANGUAGE_TAGS = {'en': 'en', 'uk': 'ua', 'ua': 'ua'}
+CONTENT_LANGUAGES = {'en': 'en', 'ua': 'uk'}
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+
+logger = logging.getLogger('accomplishments.catalog')
+
+
+def get_code(code_ua):
+    return f'{code_ua:03d}'
+
+
+@lru_cache
+def get_translations():
+    translations = {}
+    for language in LANGUAGES:
+        with open(FIXTURES / f'specialities_of_ukraine_{language}.csv', encoding='utf-8') as file:
+            translations[language] = {code: title for code, title in csv.reader(file)}
+    return translations
+
+
+def get_language(accept_language):
+    for tag, quality in parse_accept_lang_header(accept_language or ''):
+        if tag == '*':
+            break
+        language = LANGUAGE_TAGS.get(tag.split('-')[0])
+        if language is not None and quality > 0:
+            return language
+    return LANGUAGES[0]
+
+
+def get_etag(content):
+    return f'"{blake2b(content, digest_size=16).hexdigest()}"'
+
+
+def render(document):
+    return json.dumps(document, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+class CatalogDocument:
+    """A rendered response body with its strong ETag."""
+    __slots__ = ('content', 'etag')
+
+    def __init__(self, content):
+        self.content = content
+        self.etag = get_etag(content)
+
+
+class SpecialityCatalog:
+    """
+    An immutable snapshot of the specialities. The titles of a code come
+    from the translated fixtures, the title stored in the database is
+    the fallback of a code without a translation.
+    """
+    __slots__ = ('codes', 'resources', 'lists', 'details')
+
+    def __init__(self, specialities, url):
+        translations = get_translations()
+        titles = {}
+        for code_ua, title in specialities:
+            code = get_code(code_ua)
+            titles[code] = {language: translations[language].get(code, title)
+                            for language in LANGUAGES}
+        self.codes = sorted(titles)
+        self.resources = {}
+        self.lists = {}
+        self.details = {}
+        for language in LANGUAGES:
+            resources = [render({
+                'type': 'speciality', 'id': code,
+                'attributes': {'code': code, 'title': titles[code][language]},
+                'links': {'self': f'{url}{code}/'}
+            }) for code in self.codes]
+            self.resources[language] = dict(zip(self.codes, resources))
+            self.lists[language] = CatalogDocument(self.join(resources))
+            self.details[language] = {code: CatalogDocument(b'{"data":%s}' % resource)
+                                      for code, resource in zip(self.codes, resources)}
+
+    @classmethod
+    def build(cls):
+        specialities = Speciality.objects.using(router.db_for_write(Speciality)) \
+            .order_by('code_ua', 'id').values_list('code_ua', 'title')
+        return cls(list(specialities), reverse('specialities'))
+
+    @staticmethod
+    def join(resources):
+        return b'{"data":[%s]}' % b','.join(resources)
+
+    def get(self, language, code):
+        return self.details[language].get(code)
+
+    def filter(self, language, codes=None, prefix=None):
+        """
+        The document of the specialities with one of `codes`
+        and with a code starting with `prefix`.
+        """
+        if codes is None and prefix is None:
+            return self.lists[language]
+        resources = self.resources[language]
+        if codes is not None:
+            selected = [code for code in dict.fromkeys(codes) if code in resources]
+            if prefix is not None:
+                selected = [code for code in selected if code.startswith(prefix)]
+        else:
+            start = bisect_left(self.codes, prefix)
+            end = bisect_left(self.codes, prefix + '\uffff', start)
+            selected = self.codes[start:end]
+        return CatalogDocument(self.join([resources[code] for code in selected]))
+
+
+class CatalogHolder:
+    """
+    Holds the current snapshot, built at the startup of the server. Changes
+    in this process rebuild it after the commit, and a task rebuilds it every
+    `interval` seconds off the requests for the changes of the other worker
+    processes. A request only builds the snapshot when there was no startup.
+    """
+    def __init__(self, interval=300):
+        self.interval = interval
+        self._catalog = None
+        self._lock = Lock()
+        self._refreshing = None
+
+    def get(self):
+        if self._catalog is None:
+            with self._lock:
+                if self._catalog is None:
+                    self._catalog = SpecialityCatalog.build()
+        return self._catalog
+
+    async def aget(self):
+        catalog = self._catalog
+        if catalog is not None:
+            return catalog
+        return await sync_to_async(self.get)()
+
+    def rebuild(self):
+        with self._lock:
+            self._catalog = SpecialityCatalog.build()
+
+    async def start(self):
+        await sync_to_async(self.rebuild, thread_sensitive=False)()
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = create_task(self.refresh(), context=Context())
+
+    async def refresh(self):
+        while True:
+            await sleep(self.interval)
+            try:
+                await sync_to_async(self.rebuild, thread_sensitive=False)()
+            except Exception:
+                logger.exception('The speciality catalog could not be rebuilt')
+
+    def clear(self):
+        self._catalog = None
+
+
+speciality_catalog = CatalogHolder(getattr(settings, 'SPECIALITY_CATALOG_INTERVAL', 300))
+on_startup(speciality_catalog.start)
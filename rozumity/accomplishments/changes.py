@@ -0,0 +1,239 @@
+"""
+The change feed of the tests and universities. A change of a resource is
+published after its commit as an event with the resource identifier, the
+action and a version, the hub fans the events out to the subscribed
+streams and keeps the latest ones for the clients resuming after their
+Last-Event-ID. The feed lives in this process by default, with
+
+    CHANGE_FEED_DATABASE = 'default'
+
+the events are sent with NOTIFY and every worker process LISTENs to them.
+"""
+import json
+import re
+from asyncio import Queue, get_running_loop
+from collections import deque
+from itertools import count
+from secrets import token_hex
+from threading import Lock
+from django.conf import settings
+from django.db import connections, transaction
+from asgiref.sync import sync_to_async
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+CHANNEL = 'accomplishments_changes'
+# Created by the migration 0006
+VERSION_SEQUENCE = 'accomplishments_change_version'
+# The ids given to the events, `<epoch>-<version>` or `<version>`
+EVENT_ID = re.compile(r'[0-9a-f]+-[0-9]+|[0-9]+')
+
+
+def get_event(event_id, type, id, action, version):
+    return {'id': event_id, 'type': type, 'resource_id': id,
+            'action': action, 'version': version}
+
+
+def render_event(event):
+    document = {'data': {'type': event['type'], 'id': event['resource_id'],
+                         'meta': {'action': event['action'], 'version': event['version']}}}
+    return (f"id: {event['id']}\nevent: {event['action']}\n"
+            f"data: {json.dumps(document, separators=(',', ':'))}\n\n").encode()
+
+
+def render_reset(last_event_id):
+    """
+    The events after the client's last one are not kept anymore,
+    the client reloads the resources it follows. The client's id is
+    echoed only when it is one of ours, any other one could carry fields.
+    """
+    valid = last_event_id is not None and EVENT_ID.fullmatch(last_event_id)
+    event_id = f'id: {last_event_id}\n' if valid else ''
+    return f'{event_id}event: reset\ndata: {{"meta":{{"action":"reset"}}}}\n\n'.encode()
+
+
+class Subscription:
+    """
+    The queue of a stream, filled from any thread. A subscriber too slow
+    for `max_size` pending events is closed, it reconnects and resumes.
+    """
+    def __init__(self, types, max_size):
+        self.types = types
+        self.max_size = max_size
+        self.loop = get_running_loop()
+        self.queue = Queue()
+        self.overflowed = False
+
+    def put(self, event):
+        if self.overflowed:
+            return
+        if self.queue.qsize() >= self.max_size:
+            # None closes the stream once the pending events are sent
+            self.overflowed = True
+            event = None
+        self.queue.put_nowait(event)
+
+    def dispatch(self, event):
+        if event['type'] in self.types:
+            try:
+                self.loop.call_soon_threadsafe(self.put, event)
+            except RuntimeError:
+                # The loop of a finished stream is closed
+                pass
+
+
+class ChangeHub:
+    """
+    The subscriptions and the `size` latest events, in the order of
+    their commits.
+    """
+    def __init__(self, size=1000):
+        self.size = size
+        self._events = deque(maxlen=size)
+        self._subscriptions = set()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def dispatch(self, event):
+        with self._lock:
+            self._events.append(event)
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.dispatch(event)
+
+    def subscribe(self, types, last_event_id=None):
+        """
+        A new subscription and the kept events after `last_event_id`,
+        None when they are not kept anymore.
+        """
+        subscription = Subscription(types, self.size)
+        with self._lock:
+            self._subscriptions.add(subscription)
+            events = list(self._events)
+        if last_event_id is None:
+            return subscription, []
+        for index in range(len(events) - 1, -1, -1):
+            if events[index]['id'] == last_event_id:
+                return subscription, [event for event in events[index + 1:]
+                                      if event['type'] in types]
+        return subscription, None
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+
+class LocalChangeFeed:
+    """
+    The events of this process, versioned by a counter. The ids carry the
+    epoch of the process, an id of a previous process is never resumed.
+    """
+    def __init__(self, hub):
+        self.hub = hub
+        self.epoch = token_hex(4)
+        self._versions = count(1)
+        self._lock = Lock()
+
+    def publish(self, type, id, action, using):
+        self.publish_many(type, [id], action, using)
+
+    def publish_many(self, type, ids, action, using):
+        def dispatch():
+            for id in ids:
+                with self._lock:
+                    version = next(self._versions)
+                self.hub.dispatch(get_event(f'{self.epoch}-{version}', type, id, action, version))
+        transaction.on_commit(dispatch, using=using)
+
+    async def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class PostgresChangeFeed:
+    """
+    The events of all the processes, sent with NOTIFY in the transaction
+    of the change, so they are delivered in the order of the commits and
+    never for a rolled back change. The versions come from a sequence.
+    Each process LISTENs on a connection of its own outside of the pool.
+    """
+    def __init__(self, hub, alias):
+        self.hub = hub
+        self.alias = alias
+        self._listener = None
+        self._loop = None
+
+    def publish(self, type, id, action, using):
+        self.publish_many(type, [id], action, using)
+
+    def publish_many(self, type, ids, action, using):
+        # A notification per id sent by a single statement
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_notify(%s, json_build_object("
+                "'type', %s::text, 'id', id, 'action', %s::text, 'version', nextval(%s)"
+                ")::text) FROM unnest(%s::bigint[]) WITH ORDINALITY AS ids(id, position) "
+                "ORDER BY position", [CHANNEL, type, action, VERSION_SEQUENCE, list(ids)]
+            )
+
+    def receive(self):
+        listener = self._listener
+        listener.poll()
+        while listener.notifies:
+            payload = json.loads(listener.notifies.pop(0).payload)
+            self.hub.dispatch(get_event(
+                str(payload['version']), payload['type'], payload['id'],
+                payload['action'], payload['version']
+            ))
+
+    def is_listening(self, loop):
+        return self._listener is not None and not self._listener.closed and \
+            self._loop is loop
+
+    def listen(self):
+        listener = psycopg2.connect(**connections[self.alias].get_connection_params())
+        listener.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with listener.cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANNEL}')
+        return listener
+
+    async def start(self):
+        loop = get_running_loop()
+        if self.is_listening(loop):
+            return
+        listener = await sync_to_async(self.listen)()
+        # Another stream may have started listening meanwhile
+        if self.is_listening(loop):
+            listener.close()
+            return
+        self.stop()
+        self._listener, self._loop = listener, loop
+        loop.add_reader(listener.fileno(), self.receive)
+
+    def stop(self):
+        if self._listener is None:
+            return
+        if not self._loop.is_closed():
+            self._loop.remove_reader(self._listener.fileno())
+        self._listener.close()
+        self._listener = self._loop = None
+
+
+change_hub = ChangeHub(getattr(settings, 'CHANGE_FEED_BUFFER', 1000))
+
+
+def get_change_feed(alias=None):
+    if alias is None:
+        return LocalChangeFeed(change_hub)
+    return PostgresChangeFeed(change_hub, alias)
+
+
+change_feed = get_change_feed(getattr(settings, 'CHANGE_FEED_DATABASE', None))
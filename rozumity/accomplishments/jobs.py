@@ -0,0 +1,97 @@
+from django.db import router, transaction
+from asgiref.sync import sync_to_async
+from aiofiles import open
+from cities_light.models import Country
+
+from rozumity.bulk import BulkError
+from rozumity.jobs import JobFailed, job_type
+from rozumity.viewsets import filter_by_params
+
+from .catalog import FIXTURES
+from .changes import change_feed
+from .models import Education, Test, University
+
+
+async def read_university_titles(alpha2):
+    async with open(FIXTURES / f'universities_{alpha2.lower()}.txt',
+                    mode='r', encoding='utf-8') as data:
+        return list(dict.fromkeys([
+            line.split(';')[0].strip() async for line in data if line.strip()
+        ]))
+
+
+def create_universities(objects):
+    using = router.db_for_write(University)
+    with transaction.atomic(using=using):
+        objects = University.objects.using(using).bulk_create(objects)
+        change_feed.publish_many('university', [obj.id for obj in objects], 'created', using)
+    return objects
+
+
+@job_type('universities.import')
+async def import_universities(context, alpha2, batch_size=100):
+    """Creates the universities of a country missing from the database."""
+    country = await Country.objects.aget(code2=alpha2.upper())
+    titles = await read_university_titles(alpha2)
+    context.progress(0, len(titles))
+    existing = {title async for title in University.objects.filter(
+        country=country, title__in=titles
+    ).values_list('title', flat=True)}
+    context.count('existing', len(existing))
+    objects = [University(title=title, country=country)
+               for title in titles if title not in existing]
+    created = []
+    for start in range(0, len(objects), batch_size):
+        batch = await sync_to_async(create_universities)(objects[start:start + batch_size])
+        created.extend(obj.id for obj in batch)
+        context.count('created', len(batch))
+        context.progress(len(existing) + len(created))
+    context.progress(len(titles))
+    return {'data': [{'type': 'university', 'id': id} for id in created]}
+
+
+@job_type('universities.delete')
+async def delete_universities(context, alpha2):
+    """
+    Deletes the universities of the titles of a country, except the ones
+    with educations.
+    """
+    titles = await read_university_titles(alpha2)
+    context.progress(0, len(titles))
+    universities = {id: title async for id, title in University.objects.filter(
+        title__in=titles
+    ).values_list('id', 'title')}
+    protected = {id async for id in Education.objects.filter(
+        university_id__in=universities
+    ).values_list('university_id', flat=True).distinct()}
+    for id in protected:
+        context.error(f"The university '{universities[id]}' has educations.",
+                      f'/data/{id}')
+    deleted = [id for id in universities if id not in protected]
+    await University.objects.filter(id__in=deleted).adelete()
+    context.count('deleted', len(deleted))
+    context.count('protected', len(protected))
+    context.count('missing', len(titles) - len(set(universities.values())))
+    context.progress(len(titles))
+    return {'data': [{'type': 'university', 'id': id} for id in deleted]}
+
+
+@job_type('test.bulk-delete')
+async def delete_tests(context, filters=None, ids=None):
+    """Deletes the tests of a bulk DELETE request."""
+    from .views import TestViewSet
+    queryset = Test.objects.all()
+    if ids is not None:
+        queryset = queryset.filter(id__in=ids)
+    try:
+        meta = await TestViewSet.bulk_changes.delete(
+            filter_by_params(queryset, filters or {}, TestViewSet.location_field)
+        )
+    except BulkError as exc:
+        for error in exc.errors:
+            context.error(error['detail'], error['source']['pointer'])
+        raise JobFailed
+    context.count('matched', meta['matched'])
+    context.count('deleted', meta['deleted'])
+    context.progress(meta['matched'], meta['matched'])
+    return {'meta': meta}
@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-19 02:39
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cities_light', '0011_alter_city_country_alter_city_region_and_more'),
+        ('accomplishments', '0004_alter_test_options_test_city'),
+    ]
+
+    # The admin autocompletes the locations by a prefix of their name
+    location_indexes = [
+        (f'{table}_name_prefix', f'cities_light_{table}')
+        for table in ('country', 'region', 'city')
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='test',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('title'), name='text_pattern_ops'), name='test_title_prefix'),
+        ),
+        migrations.AddIndex(
+            model_name='university',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('title'), name='text_pattern_ops'), name='university_title_prefix'),
+        ),
+    ] + [
+        migrations.RunSQL(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} '
+            '(UPPER(name::text) text_pattern_ops)',
+            f'DROP INDEX IF EXISTS {name}'
+        ) for name, table in location_indexes
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accomplishments', '0005_prefix_search_indexes'),
+    ]
+
+    # The versions of the change feed sent with NOTIFY
+    operations = [
+        migrations.RunSQL(
+            'CREATE SEQUENCE IF NOT EXISTS accomplishments_change_version',
+            'DROP SEQUENCE IF EXISTS accomplishments_change_version'
+        ),
+    ]
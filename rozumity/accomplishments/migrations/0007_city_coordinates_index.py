@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cities_light', '0011_alter_city_country_alter_city_region_and_more'),
+        ('accomplishments', '0006_change_version_sequence'),
+    ]
+
+    # The bounding box of filter[near] is a range scan of the coordinates
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS city_coordinates '
+            'ON cities_light_city (latitude, longitude)',
+            'DROP INDEX IF EXISTS city_coordinates'
+        ),
+    ]
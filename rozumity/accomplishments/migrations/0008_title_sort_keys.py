@@ -0,0 +1,53 @@
+# Generated by Django 4.2 on 2026-10-19 03:13
+
+from itertools import islice
+from django.db import migrations, models
+import rozumity.collation
+
+
+def fill_sort_keys(apps, schema_editor):
+    for name in ('Speciality', 'Test', 'University'):
+        model = apps.get_model('accomplishments', name)
+        objects = model.objects.only('id', 'title').order_by('id').iterator(chunk_size=1000)
+        while batch := list(islice(objects, 1000)):
+            for obj in batch:
+                obj.title_key = rozumity.collation.get_sort_key(obj.title)
+            model.objects.bulk_update(batch, ['title_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accomplishments', '0007_city_coordinates_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='speciality',
+            name='title_key',
+            field=rozumity.collation.CollationKeyField(default=b'', source='title'),
+        ),
+        migrations.AddField(
+            model_name='test',
+            name='title_key',
+            field=rozumity.collation.CollationKeyField(default=b'', source='title'),
+        ),
+        migrations.AddField(
+            model_name='university',
+            name='title_key',
+            field=rozumity.collation.CollationKeyField(default=b'', source='title'),
+        ),
+        migrations.RunPython(fill_sort_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='speciality',
+            index=models.Index(fields=['title_key', 'id'], name='speciality_title_key'),
+        ),
+        migrations.AddIndex(
+            model_name='test',
+            index=models.Index(fields=['title_key', 'id'], name='test_title_key'),
+        ),
+        migrations.AddIndex(
+            model_name='university',
+            index=models.Index(fields=['title_key', 'id'], name='university_title_key'),
+        ),
+    ]
@@ -1,14 +1,22 @@
+from django.contrib.postgres.indexes import OpClass
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils.translation import gettext_lazy as _
 
+from rozumity.collation import CollationKeyField
+
 
 class University(models.Model):
     title = models.CharField(max_length=128)
+    title_key = CollationKeyField(source='title')
     country = models.ForeignKey('cities_light.Country', on_delete=models.SET_NULL, null=True, blank=True)
     
     class Meta:
         verbose_name = _('University')
         verbose_name_plural = _('Universities')
+        indexes = [models.Index(OpClass(Upper('title'), name='text_pattern_ops'),
+                                name='university_title_prefix'),
+                   models.Index(fields=['title_key', 'id'], name='university_title_key')]
     
     def __str__(self):
         return self.title
@@ -16,12 +24,16 @@ class University(models.Model):
 
 class Test(models.Model):
     title = models.CharField(max_length=128)
+    title_key = CollationKeyField(source='title')
     country = models.ManyToManyField('cities_light.Country', null=True, blank=True)
     city = models.ForeignKey('cities_light.City', on_delete=models.SET_NULL, null=True, blank=True)
     
     class Meta:
         verbose_name = _('Test')
         verbose_name_plural = _('Tests')
+        indexes = [models.Index(OpClass(Upper('title'), name='text_pattern_ops'),
+                                name='test_title_prefix'),
+                   models.Index(fields=['title_key', 'id'], name='test_title_key')]
     
     def __str__(self):
         return self.title
@@ -29,11 +41,13 @@ class Test(models.Model):
 
 class Speciality(models.Model):
     title = models.CharField(max_length=128)
+    title_key = CollationKeyField(source='title')
     code_ua = models.SmallIntegerField()
     
     class Meta:
         verbose_name = _('Speciality')
         verbose_name_plural = _('Specialities')
+        indexes = [models.Index(fields=['title_key', 'id'], name='speciality_title_key')]
     
     def __str__(self):
         return self.title
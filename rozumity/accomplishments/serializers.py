@@ -13,6 +13,9 @@ class UniversitySerializer(JSONAPISerializer):
         country = JSONAPISerializer.ObjectId(
             view_name='cities-light-api-country-detail'
         )
+    
+    class Meta:
+        model_type = 'university'
 
 
 class TestSerializer(JSONAPISerializer):
@@ -31,6 +34,7 @@ class TestSerializer(JSONAPISerializer):
     
     class Meta:
         model_type = 'test'
+        linkage_limit = {'country': 10}
         #model = Test
         #validators = {
         #    'id': MaxValueValidator(0),
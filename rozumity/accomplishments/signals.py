@@ -0,0 +1,45 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+
+from .catalog import speciality_catalog
+from .changes import change_feed
+from .models import Speciality, Test, University
+
+
+# The new snapshot is built from the committed rows
+@receiver(post_save, sender=Speciality)
+@receiver(post_delete, sender=Speciality)
+def rebuild_speciality_catalog(sender, instance, using, **kwargs):
+    transaction.on_commit(speciality_catalog.rebuild, using=using)
+
+
+@receiver(post_save, sender=Test)
+@receiver(post_save, sender=University)
+def publish_saved(sender, instance, created, using, raw=False, **kwargs):
+    if not raw:
+        change_feed.publish(sender.__name__.lower(), instance.pk,
+                            'created' if created else 'updated', using)
+
+
+@receiver(post_delete, sender=Test)
+@receiver(post_delete, sender=University)
+def publish_deleted(sender, instance, using, **kwargs):
+    change_feed.publish(sender.__name__.lower(), instance.pk, 'deleted', using)
+
+
+@receiver(m2m_changed, sender=Test.country.through)
+def publish_countries_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if reverse and action == 'pre_clear':
+        # Django gives no pk_set on clear, the cleared tests are read before
+        instance._cleared_tests = list(
+            instance.test_set.using(using).values_list('pk', flat=True)
+        )
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse and action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_tests', ())
+    # Changed from the side of a country, the tests are the related objects
+    for pk in (pk_set or ()) if reverse else (instance.pk,):
+        change_feed.publish('test', pk, 'updated', using)
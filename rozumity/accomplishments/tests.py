@@ -1,3 +1,814 @@
-from django.test import TestCase
+# python manage.py test
+# python ../manage.py test accomplishments
+import json
+from asyncio import sleep, wait_for
+from io import StringIO
+from unittest.mock import patch
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from asgiref.sync import sync_to_async
+from cities_light.models import City, Country
 
-# Create your tests here.
+from rozumity import compact
+from rozumity.collation import get_sort_key
+from rozumity.exports import Export, read_chunks
+from rozumity.jobs import job_runner
+from rozumity.models import Job
+
+from .catalog import CatalogHolder, SpecialityCatalog, get_language, speciality_catalog
+from .changes import ChangeHub, PostgresChangeFeed, change_hub, get_event, render_reset
+from .jobs import read_university_titles
+from .models import Education, Speciality, University, Test
+from .serializers import TestSerializer
+from .views import ChangeFeedView
+
+
+class AtomicOperationsTests(TestCase):
+    url = '/api/accomplishments/operations/'
+    content_type = 'application/vnd.api+json; ext="https://jsonapi.org/ext/atomic"'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser(
+            email="super@user.com", password="foo"
+        )
+        cls.countries = [Country.objects.create(id=id, name=f'test_country_{id}')
+                         for id in (2, 27)]
+        cls.city = City.objects.create(id=1334, name='test_city', country=cls.countries[0])
+        cls.university = University.objects.create(title='university', country=cls.countries[0])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post(self, operations):
+        return self.client.post(
+            self.url, {'atomic:operations': operations}, content_type=self.content_type
+        )
+
+    def test_operations(self):
+        removed = Test.objects.create(title='removed')
+        response = self.post([
+            {'op': 'add', 'data': {
+                'type': 'test', 'lid': 'new', 'attributes': {'title': 'test1'},
+                'relationships': {'city': {'data': {'type': 'city', 'id': 1334}}}
+            }},
+            {'op': 'add', 'ref': {'type': 'test', 'lid': 'new', 'relationship': 'country'},
+             'data': [{'type': 'country', 'id': 2}, {'type': 'country', 'id': '27'}]},
+            {'op': 'update', 'data': {
+                'type': 'university', 'id': str(self.university.id),
+                'attributes': {'title': 'renamed'}
+            }},
+            {'op': 'remove', 'ref': {'type': 'test', 'id': str(removed.id)}}
+        ])
+        assert response.status_code == 200, response.json()
+        results = response.json()['atomic:results']
+        assert len(results) == 4 and results[1] == {} and results[3] == {}
+        test = Test.objects.get(title='test1')
+        assert results[0]['data']['id'] == test.id
+        assert results[0]['data']['relationships']['city']['data'] == {'type': 'city', 'id': 1334}
+        assert results[2]['data']['attributes'] == {'title': 'renamed'}
+        self.university.refresh_from_db()
+        assert bytes(self.university.title_key) == get_sort_key('renamed')
+        assert sorted(test.country.values_list('id', flat=True)) == [2, 27]
+        assert not Test.objects.filter(id=removed.id).exists()
+
+    def test_change_events(self):
+        change_hub.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post([
+                {'op': 'add', 'data': {'type': 'test', 'attributes': {'title': 'test1'}}},
+                {'op': 'update', 'data': {
+                    'type': 'university', 'id': str(self.university.id),
+                    'attributes': {'title': 'renamed'}
+                }}
+            ])
+        assert response.status_code == 200
+        test = Test.objects.get(title='test1')
+        assert [(event['type'], event['resource_id'], event['action'])
+                for event in change_hub._events] == [
+            ('test', test.id, 'created'), ('university', self.university.id, 'updated')
+        ]
+
+    def test_failed_operation_rolls_back(self):
+        response = self.post([
+            {'op': 'add', 'data': {'type': 'test', 'attributes': {'title': 'test1'}}},
+            {'op': 'remove', 'ref': {'type': 'test', 'id': '0'}}
+        ])
+        assert response.status_code == 404
+        assert response.json()['errors'][0]['source'] == {'pointer': '/atomic:operations/1'}
+        assert not Test.objects.exists()
+
+    def test_invalid_operations_are_reported_together(self):
+        response = self.post([
+            {'op': 'add', 'data': {'type': 'test', 'attributes': {'title': 't' * 129}}},
+            {'op': 'update', 'ref': {'type': 'test', 'lid': 'unknown', 'relationship': 'country'},
+             'data': []},
+            {'op': 'add', 'data': {'type': 'speciality', 'attributes': {}}}
+        ])
+        assert response.status_code == 400
+        pointers = [error['source']['pointer'] for error in response.json()['errors']]
+        assert pointers == ['/atomic:operations/0/data/attributes/title',
+                            '/atomic:operations/1', '/atomic:operations/2']
+
+
+class RelatedResourcesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email="normal@user.com", password="foo")
+        cls.countries = [Country.objects.create(id=id, name=f'test_country_{id}')
+                         for id in range(1, 6)]
+        cls.city = City.objects.create(id=1334, name='test_city', country=cls.countries[0])
+        cls.test = Test.objects.create(title='test1', city=cls.city)
+        cls.test.country.set(cls.countries[:4])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_related_collection(self):
+        url = f'/api/accomplishments/test/{self.test.id}/country/'
+        response = self.client.get(url, {'page[limit]': 2, 'page[offset]': 2})
+        assert response.status_code == 200
+        data = response.json()
+        assert [obj['id'] for obj in data['data']] == [3, 4]
+        assert data['data'][0]['attributes']['name'] == 'test_country_3'
+        assert data['data'][0]['links']['self'].endswith('/api/locations/countries/3/')
+        assert data['links']['prev'].endswith(f'{url}?page[limit]=2')
+        assert 'next' not in data['links']
+        response = self.client.get(url, {'filter[id]': '2,5'})
+        assert [obj['id'] for obj in response.json()['data']] == [2]
+
+    def test_related_object(self):
+        response = self.client.get(f'/api/accomplishments/test/{self.test.id}/city/')
+        data = response.json()['data']
+        assert (data['type'], data['id']) == ('city', 1334)
+        assert data['relationships']['country']['data'] == {'type': 'country', 'id': 1}
+
+    def test_related_not_found(self):
+        assert self.client.get('/api/accomplishments/test/0/country/').status_code == 404
+        assert self.client.get(f'/api/accomplishments/test/{self.test.id}/title/').status_code == 404
+
+    def test_relationship_linkage(self):
+        url = f'/api/accomplishments/test/{self.test.id}/relationships/country/'
+        self.client.get(url)
+        # exists, count and the page of ids, the session user is cached
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {'page[limit]': 3})
+        data = response.json()
+        assert [obj['id'] for obj in data['data']] == [1, 2, 3]
+        assert data['data'][0] == {
+            'type': 'country', 'id': 1,
+            'links': {'self': 'http://testserver/api/locations/countries/1/'}
+        }
+        assert data['links']['next'].endswith(f'{url}?page[limit]=3&page[offset]=3')
+        response = self.client.get(f'/api/accomplishments/test/{self.test.id}/relationships/city/')
+        assert response.json()['data']['id'] == 1334
+
+
+class LinkageLimitTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email="normal@user.com", password="foo")
+        countries = [Country.objects.create(id=id, name=f'test_country_{id}')
+                     for id in range(1, 13)]
+        city = City.objects.create(id=1334, name='test_city', country=countries[0])
+        cls.test = Test.objects.create(title='test1', city=city)
+        cls.test.country.set(countries)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_linkage_is_truncated(self):
+        self.client.get('/api/accomplishments/test/')
+        empty = Test.objects.create(title='test2')
+        # session is cached: count, page with annotated counts, sliced prefetch
+        with self.assertNumQueries(3) as queries:
+            response = self.client.get('/api/accomplishments/test/')
+        # The counts of the linkage are left out of the count of the page
+        assert queries.captured_queries[0]['sql'] == \
+            'SELECT COUNT(*) AS "__count" FROM "accomplishments_test"'
+        assert 'GROUP BY "accomplishments_test"' not in queries.captured_queries[1]['sql']
+        data = response.json()
+        country = data['data'][0]['relationships']['country']
+        assert [obj['id'] for obj in country['data']] == list(range(1, 11))
+        assert country['meta'] == {'count': 12}
+        assert data['data'][1]['id'] == empty.id
+        assert data['data'][1]['relationships']['country']['meta'] == {'count': 0}
+        assert country['links']['related'].endswith(f'/test/{self.test.id}/country/')
+        assert len([obj for obj in data['included'] if obj['type'] == 'country']) == 10
+
+    async def test_linkage_without_annotation(self):
+        test = await Test.objects.select_related('city').aget(id=self.test.id)
+        data = await TestSerializer(test).data
+        assert data['data']['relationships']['country']['meta'] == {'count': 12}
+        assert len(data['data']['relationships']['country']['data']) == 10
+
+
+class SpecialityCatalogTests(TestCase):
+    url = '/api/accomplishments/specialities/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='user@user.com', password='foo')
+        Speciality.objects.bulk_create([
+            Speciality(title='Preschool Education', code_ua=12),
+            Speciality(title='Primary Education', code_ua=13),
+            Speciality(title='Untranslated', code_ua=201)
+        ])
+
+    def setUp(self):
+        speciality_catalog.clear()
+        self.client.force_login(self.user)
+
+    def test_language(self):
+        assert get_language('uk-UA,uk;q=0.9,en;q=0.8') == 'ua'
+        assert get_language('de, en-GB;q=0.5') == 'en'
+        assert get_language('uk;q=0, en;q=0.1') == 'en'
+        assert get_language(None) == get_language('*') == 'en'
+
+    def test_list(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_LANGUAGE='uk')
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/vnd.api+json'
+        assert response['Content-Language'] == 'uk'
+        assert 'Accept-Language' in response['Vary']
+        assert response.json()['data'] == [
+            {'type': 'speciality', 'id': '012',
+             'attributes': {'code': '012', 'title': 'Дошкільна освіта'},
+             'links': {'self': f'{self.url}012/'}},
+            {'type': 'speciality', 'id': '013',
+             'attributes': {'code': '013', 'title': 'Початкова освіта'},
+             'links': {'self': f'{self.url}013/'}},
+            {'type': 'speciality', 'id': '201',
+             'attributes': {'code': '201', 'title': 'Untranslated'},
+             'links': {'self': f'{self.url}201/'}}
+        ]
+        english = self.client.get(self.url)
+        assert english.json()['data'][0]['attributes']['title'] == 'Preschool Education'
+        assert english['ETag'] != response['ETag']
+
+    def test_lookups_without_queries(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url + '013/')
+            assert response.json()['data']['attributes']['title'] == 'Primary Education'
+            response = self.client.get(self.url, {'filter[code__startswith]': '01'})
+            assert [item['id'] for item in response.json()['data']] == ['012', '013']
+            response = self.client.get(self.url, {'filter[code]': '201,999,012'})
+            assert [item['id'] for item in response.json()['data']] == ['201', '012']
+            response = self.client.get(self.url + '999/')
+            assert response.status_code == 404
+
+    def test_code_filters(self):
+        response = self.client.get(self.url, {'filter[code]': '12,201'})
+        assert [item['id'] for item in response.json()['data']] == ['012', '201']
+        response = self.client.get(self.url, {'filter[code]': '12,13,201',
+                                              'filter[code__startswith]': '01'})
+        assert [item['id'] for item in response.json()['data']] == ['012', '013']
+        response = self.client.get(self.url, {'filter[code]': '12,a'})
+        assert response.status_code == 400
+        assert response.json()['errors'][0]['code'] == 400
+
+    def test_etag(self):
+        response = self.client.get(self.url + '012/')
+        etag = response['ETag']
+        assert etag.startswith('"') and not etag.startswith('W/')
+        response = self.client.get(self.url + '012/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304 and response['ETag'] == etag
+        response = self.client.get(self.url + '013/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+    def test_rebuild_on_change(self):
+        response = self.client.get(self.url + '201/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Speciality.objects.filter(code_ua=201).first().delete()
+            Speciality.objects.create(title='New', code_ua=202)
+        response = self.client.get(self.url + '201/')
+        assert response.status_code == 404
+        response = self.client.get(self.url + '202/')
+        assert response.json()['data']['attributes']['title'] == 'New'
+
+    async def test_startup(self):
+        holder = CatalogHolder(interval=0.01)
+        with patch.object(SpecialityCatalog, 'build', side_effect=lambda: object()) as build:
+            await holder.start()
+            assert build.call_count == 1
+            catalog = await holder.aget()
+            assert await holder.aget() is catalog and build.call_count == 1
+            # Rebuilt off the requests
+            while build.call_count < 3:
+                await sleep(0.01)
+        holder._refreshing.cancel()
+        assert await holder.aget() is not catalog
+
+    def test_authentication(self):
+        self.client.logout()
+        assert self.client.get(self.url).status_code == 403
+
+
+class ChangeFeedTests(TestCase):
+    url = '/api/accomplishments/changes/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email="normal@user.com", password="foo")
+
+    def setUp(self):
+        change_hub.clear()
+        self.async_client.force_login(self.user)
+
+    def test_events_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            test = Test.objects.create(title='test')
+            assert not change_hub._events
+        with self.captureOnCommitCallbacks(execute=True):
+            test.title = 'renamed'
+            test.save()
+            test.country.add(Country.objects.create(name='test_country'))
+            id = test.id
+            test.delete()
+        events = list(change_hub._events)
+        assert [(event['type'], event['action']) for event in events] == [
+            ('test', 'created'), ('test', 'updated'), ('test', 'updated'), ('test', 'deleted')
+        ]
+        assert {event['resource_id'] for event in events} == {id}
+        assert [event['version'] for event in events] == sorted(event['version'] for event in events)
+
+    def test_clear_from_country(self):
+        country = Country.objects.create(name='test_country')
+        tests = [Test.objects.create(title=f'test{i}') for i in range(2)]
+        country.test_set.add(*tests)
+        change_hub.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            country.test_set.clear()
+        assert sorted((event['resource_id'], event['action']) for event in change_hub._events) == \
+            [(test.id, 'updated') for test in tests]
+
+    async def test_resume(self):
+        hub = ChangeHub(size=2)
+        events = [get_event(str(version), 'test', version, 'created', version)
+                  for version in range(1, 4)]
+        for event in events:
+            hub.dispatch(event)
+        assert hub.subscribe({'test'}, '2')[1] == events[2:]
+        assert hub.subscribe({'university'}, '2')[1] == []
+        assert hub.subscribe({'test'}, '1')[1] is None
+
+    async def read(self, stream, count):
+        return [(await anext(stream)).decode() for _ in range(count)]
+
+    async def test_stream(self):
+        change_hub.dispatch(get_event('a-1', 'test', 1, 'created', 1))
+        change_hub.dispatch(get_event('a-2', 'university', 2, 'updated', 2))
+        response = await self.async_client.get(self.url, headers={'Last-Event-ID': 'a-1'})
+        assert response['Content-Type'] == 'text/event-stream'
+        stream = aiter(response.streaming_content)
+        assert (await self.read(stream, 2))[1] == (
+            'id: a-2\nevent: updated\ndata: {"data":{"type":"university","id":2,'
+            '"meta":{"action":"updated","version":2}}}\n\n'
+        )
+        await sync_to_async(change_hub.dispatch)(get_event('a-3', 'test', 3, 'deleted', 3))
+        assert (await self.read(stream, 1))[0].startswith('id: a-3\nevent: deleted\n')
+
+    async def test_reset(self):
+        response = await self.async_client.get(self.url, {
+            'filter[type]': 'test', 'last_event_id': 'a-0'
+        })
+        stream = aiter(response.streaming_content)
+        assert (await self.read(stream, 2))[1] == \
+            'id: a-0\nevent: reset\ndata: {"meta":{"action":"reset"}}\n\n'
+        await sync_to_async(change_hub.dispatch)(get_event('a-4', 'university', 4, 'created', 4))
+        await sync_to_async(change_hub.dispatch)(get_event('a-5', 'test', 5, 'created', 5))
+        assert (await self.read(stream, 1))[0].startswith('id: a-5\n')
+
+    def test_reset_id(self):
+        assert render_reset('1a2b-7') == \
+            b'id: 1a2b-7\nevent: reset\ndata: {"meta":{"action":"reset"}}\n\n'
+        assert render_reset('7\nevent: updated\r\ndata: {}').startswith(b'event: reset\n')
+        assert render_reset(None).startswith(b'event: reset\n')
+
+    async def test_lifetime(self):
+        with patch.object(ChangeFeedView, 'lifetime', 0.2), \
+                patch.object(ChangeFeedView, 'heartbeat', 0.1):
+            response = await self.async_client.get(self.url)
+            assert len(change_hub) == 1
+            chunks = [chunk async for chunk in response.streaming_content]
+        assert chunks[0] == b'retry: 1000\n\n' and b': heartbeat\n\n' in chunks
+        assert len(change_hub) == 0
+
+    def test_authentication(self):
+        assert self.client.get(self.url).status_code == 403
+
+
+class PostgresChangeFeedTests(TransactionTestCase):
+    async def test_notify(self):
+        feed = PostgresChangeFeed(ChangeHub(), 'default')
+        await feed.start()
+        try:
+            subscription, _ = feed.hub.subscribe({'university'})
+
+            def change():
+                with transaction.atomic():
+                    feed.publish('university', 7, 'updated', 'default')
+                try:
+                    with transaction.atomic():
+                        feed.publish('university', 8, 'deleted', 'default')
+                        raise ValueError
+                except ValueError:
+                    pass
+                with transaction.atomic():
+                    feed.publish('university', 9, 'created', 'default')
+
+            await sync_to_async(change)()
+            first = await wait_for(subscription.queue.get(), 5)
+            second = await wait_for(subscription.queue.get(), 5)
+        finally:
+            feed.stop()
+        assert (first['resource_id'], first['action']) == (7, 'updated')
+        # The rolled back change is never sent
+        assert (second['resource_id'], second['action']) == (9, 'created')
+        assert first['id'] == str(first['version']) and second['version'] > first['version']
+
+
+class BulkChangesTests(TestCase):
+    url = '/api/accomplishments/test/bulk/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser(
+            email="super@user.com", password="foo"
+        )
+        cls.countries = [Country.objects.create(id=id, name=f'test_country_{id}')
+                         for id in (1, 2, 3)]
+        cls.city = City.objects.create(id=1334, name='test_city', country=cls.countries[0])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+        self.tests = [Test.objects.create(title=title) for title in ('a', 'a', 'b')]
+        self.tests[0].country.set(self.countries[:2])
+        self.tests[2].country.set(self.countries[:1])
+
+    def patch(self, data, params=''):
+        return self.client.patch(f'{self.url}{params}', {'data': data},
+                                 content_type='application/vnd.api+json')
+
+    def test_patch(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.patch({'type': 'test', 'attributes': {'title': 'c'}, 'relationships': {
+                'city': {'data': {'type': 'city', 'id': 1334}},
+                'country': {'data': [{'type': 'country', 'id': 2}, {'type': 'country', 'id': 3}]}
+            }}, '?filter[title]=a')
+        assert response.status_code == 200
+        assert response.json()['meta'] == {'matched': 2, 'updated': 2, 'relationships': {
+            'country': {'removed': 1, 'added': 3}
+        }}
+        changed = Test.objects.filter(id__in=[self.tests[0].id, self.tests[1].id])
+        assert {(test.title, test.city_id) for test in changed} == {('c', 1334)}
+        assert {bytes(test.title_key) for test in changed} == {get_sort_key('c')}
+        for test in changed:
+            assert set(test.country.values_list('id', flat=True)) == {2, 3}
+        assert Test.objects.get(id=self.tests[2].id).title == 'b'
+        assert list(self.tests[2].country.values_list('id', flat=True)) == [1]
+        assert [(event['resource_id'], event['action']) for event in change_hub._events][-2:] == \
+            [(self.tests[0].id, 'updated'), (self.tests[1].id, 'updated')]
+
+    def test_to_many_filter(self):
+        # The first test matches both countries
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.patch({'type': 'test', 'attributes': {'title': 'c'}},
+                                  '?filter[country]=1,2')
+        assert response.status_code == 200
+        assert response.json()['meta'] == {'matched': 2, 'updated': 2, 'relationships': {}}
+        assert [(event['resource_id'], event['action']) for event in change_hub._events][-2:] == \
+            [(self.tests[0].id, 'updated'), (self.tests[2].id, 'updated')]
+        assert [event['resource_id'] for event in change_hub._events].count(self.tests[0].id) == 1
+
+    def test_statements_do_not_depend_on_rows(self):
+        Test.objects.bulk_create([Test(title='a') for _ in range(50)])
+        data = {'type': 'test', 'relationships': {'country': {'data': [{'type': 'country', 'id': 3}]}}}
+        with CaptureQueriesContext(connection) as small:
+            self.patch(data, f'?filter[id]={self.tests[0].id}')
+        with CaptureQueriesContext(connection) as large:
+            response = self.patch(data, '?filter[title]=a')
+        assert response.json()['meta']['matched'] == 52
+        statements = [[query['sql'] for query in queries if 'accomplishments_test' in query['sql']]
+                      for queries in (small, large)]
+        # Lock the rows, replace the members: remove the old ones, add the new ones
+        assert len(statements[0]) == len(statements[1]) == 3
+
+    def test_filter_on_changed_relationship(self):
+        response = self.patch({'type': 'test', 'relationships': {'country': {'data': []}}},
+                              '?filter[country]=1')
+        assert response.json()['meta'] == {'matched': 2, 'updated': 0, 'relationships': {
+            'country': {'removed': 3, 'added': 0}
+        }}
+
+    def test_invalid_patch(self):
+        response = self.patch({'type': 'test', 'attributes': {'title': 'a' * 129, 'id': 1}},
+                              '?filter[title]=a')
+        assert response.status_code == 400
+        assert [error['source']['pointer'] for error in response.json()['errors']] == \
+            ['/data/attributes/title', '/data/attributes/id']
+        response = self.patch({'type': 'test', 'attributes': {'title': 'c'}})
+        assert response.status_code == 400
+        assert response.json()['errors'][0]['source'] == {'pointer': '/filter'}
+        response = self.patch({'type': 'test', 'relationships': {
+            'country': {'data': [{'type': 'country', 'id': 404}]}
+        }}, '?filter[title]=a')
+        assert response.status_code == 409
+        assert Test.objects.filter(title='a').count() == 2
+
+    async def delete(self, url, data=None):
+        if data is None:
+            response = await self.async_client.delete(url)
+        else:
+            response = await self.async_client.delete(
+                url, data, content_type='application/vnd.api+json'
+            )
+        if response.status_code != 202:
+            return response, None
+        await job_runner.wait()
+        return response, await Job.objects.aget(id=response.json()['data']['id'])
+
+    async def test_delete(self):
+        response, job = await self.delete(self.url, {'data': [
+            {'type': 'test', 'id': self.tests[0].id}, {'type': 'test', 'id': self.tests[2].id}
+        ]})
+        assert response['Location'] == f'http://testserver/api/jobs/{job.id}/'
+        assert (job.type, job.status, job.counts) == \
+            ('test.bulk-delete', Job.SUCCEEDED, {'matched': 2, 'deleted': 2})
+        assert job.result['meta']['relationships'] == {'country': {'removed': 3}}
+        assert [id async for id in Test.objects.values_list('id', flat=True)] == [self.tests[1].id]
+        response, job = await self.delete(f'{self.url}?filter[title]=a')
+        assert job.counts['deleted'] == 1
+        response, job = await self.delete(self.url)
+        assert response.status_code == 400 and job is None
+
+    def test_permission(self):
+        user = get_user_model().objects.create_user(email="normal@user.com", password="foo")
+        self.client.force_login(user)
+        assert self.client.delete(f'{self.url}?filter[title]=a').status_code == 403
+        assert Test.objects.count() == 3
+
+
+class UniversityJobsTests(TestCase):
+    url = '/api/accomplishments/universities/import/ua/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser(
+            email="super@user.com", password="foo"
+        )
+        cls.country = Country.objects.create(name='Ukraine', code2='UA')
+
+    def setUp(self):
+        self.async_client.force_login(self.user)
+
+    async def run_job(self, method):
+        response = await getattr(self.async_client, method)(self.url)
+        assert response.status_code == 202
+        assert response.json()['data']['attributes']['status'] == Job.QUEUED
+        await job_runner.wait()
+        response = await self.async_client.get(response['Location'])
+        return response.json()['data']['attributes']
+
+    async def test_import_and_delete(self):
+        titles = await read_university_titles('ua')
+        existing = await University.objects.acreate(title=titles[0], country=self.country)
+        job = await self.run_job('post')
+        assert job['status'] == Job.SUCCEEDED
+        assert job['counts'] == {'existing': 1, 'created': len(titles) - 1}
+        assert job['progress'] == {'done': len(titles), 'total': len(titles)}
+        assert len(job['result']['data']) == len(titles) - 1
+        assert await University.objects.acount() == len(titles)
+        assert (await self.run_job('post'))['counts'] == {'existing': len(titles)}
+
+        await Education.objects.acreate(university=existing, university_degree=0,
+                                        date_start='2000-09-01', date_end='2004-06-30')
+        job = await self.run_job('put')
+        assert job['counts'] == {'deleted': len(titles) - 1, 'protected': 1, 'missing': 0}
+        assert job['errors'] == [{
+            'detail': f"The university '{titles[0]}' has educations.",
+            'source': {'pointer': f'/data/{existing.id}'}
+        }]
+        assert [id async for id in University.objects.values_list('id', flat=True)] == \
+            [existing.id]
+
+    async def test_unsupported_country(self):
+        response = await self.async_client.post('/api/accomplishments/universities/import/pl/')
+        assert response.status_code == 404
+        assert not await Job.objects.aexists()
+
+
+class CompactRendererTests(TestCase):
+    url = '/api/accomplishments/test/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser(
+            email="super@user.com", password="foo"
+        )
+        cls.countries = [Country.objects.create(id=id, name=f'test_country_{id}')
+                         for id in range(1, 4)]
+        city = City.objects.create(id=1334, name='test_city', country=cls.countries[0])
+        cls.tests = [Test.objects.create(title=f'test{i}', city=city if i % 2 else None)
+                     for i in range(5)]
+        cls.tests[0].country.set(cls.countries)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get(self, url):
+        response = self.client.get(url, HTTP_ACCEPT=compact.MEDIA_TYPE)
+        assert response['Content-Type'] == compact.MEDIA_TYPE
+        return json.loads(response.content), self.client.get(url).json()
+
+    def test_list_and_detail(self):
+        encoded, document = self.get(self.url)
+        assert compact.decode(encoded) == document and len(document['data']) == 5
+        assert encoded['data']['$c'][0] == {'$k': 'test'}
+        assert len(json.dumps(encoded)) < len(json.dumps(document)) * 0.8
+        encoded, document = self.get(f'{self.url}{self.tests[0].id}/')
+        assert compact.decode(encoded) == document
+        encoded, document = self.get('/api/accomplishments/universities/')
+        assert compact.decode(encoded) == document
+
+    def test_bulk_create(self):
+        data = {'data': [{'type': 'test', 'attributes': {'title': f'new{i}'}} for i in range(3)]}
+        content_type = compact.MEDIA_TYPE
+        response = self.client.post(self.url, json.dumps(compact.encode(data)),
+                                    content_type=content_type)
+        expected = self.client.post(self.url, data, content_type='application/json')
+        assert response.status_code == expected.status_code
+        assert response.json() == expected.json()
+        response = self.client.post(self.url, '{"data": {"$t": []}}', content_type=content_type)
+        assert response.status_code == 400
+
+    def test_benchmark(self):
+        stdout = StringIO()
+        call_command('benchmark_renderers', repeat=2, stdout=stdout)
+        lines = stdout.getvalue().splitlines()
+        assert [line.split(':')[0] for line in lines] == ['json', 'compact']
+
+
+class ExportTests(TestCase):
+    url = '/api/accomplishments/test/export/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email="normal@user.com", password="foo")
+        cls.countries = [Country.objects.create(id=id, name=f'test_country_{id}')
+                         for id in range(1, 4)]
+        city = City.objects.create(id=1334, name='test_city', country=cls.countries[0])
+        cls.tests = [Test.objects.create(title=f'test,{i}', city=city if i % 2 else None)
+                     for i in range(5)]
+        cls.tests[1].country.set(cls.countries)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+
+    async def get(self, url, **headers):
+        response = await self.async_client.get(url, headers=headers)
+        assert response.status_code == 200
+        return response, b''.join([chunk async for chunk in response.streaming_content])
+
+    async def test_ndjson(self):
+        with patch.object(Export, 'chunk_size', 2):
+            response, content = await self.get(self.url)
+        assert response['Content-Type'] == 'application/x-ndjson'
+        lines = [json.loads(line) for line in content.decode().splitlines()]
+        page = (await sync_to_async(self.client.get)('/api/accomplishments/test/')).json()
+        assert lines == page['data']
+        ids = [self.tests[3].id, self.tests[1].id]
+        response, content = await self.get(f'{self.url}?filter[id]={ids[0]},{ids[1]}')
+        assert [json.loads(line)['id'] for line in content.splitlines()] == ids[::-1]
+
+    async def test_csv(self):
+        response, content = await self.get(self.url, accept='text/csv')
+        assert response['Content-Disposition'] == 'attachment; filename="tests.csv"'
+        rows = content.decode().splitlines()
+        assert rows[0] == 'id,title,city,country'
+        assert rows[2] == f'{self.tests[1].id},"test,1",1334,1 2 3'
+        assert rows[3] == f'{self.tests[2].id},"test,2",,'
+        response, content = await self.get(f'{self.url}?format=csv&filter[title]=none')
+        assert content == b'id,title,city,country\r\n'
+        response, content = await self.get(
+            '/api/accomplishments/universities/export/?format=csv'
+        )
+        assert content == b'id,title,country\r\n'
+
+    async def test_chunks(self):
+        chunks = [[obj.id for obj in chunk] async for chunk in read_chunks(
+            Test.objects.order_by('id'), chunk_size=2
+        )]
+        assert chunks == [[test.id for test in self.tests[i:i + 2]] for i in (0, 2, 4)]
+
+    def test_permission(self):
+        self.client.logout()
+        response = self.client.get(self.url)
+        assert response.status_code == 403
+        assert json.loads(response.content)['errors'][0]['code'] == 403
+
+
+class GeoFilterTests(TestCase):
+    url = '/api/accomplishments/test/'
+    kyiv = '50.4501,30.5234'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email="normal@user.com", password="foo")
+        country = Country.objects.create(id=1, name='Ukraine')
+        cls.cities = [City.objects.create(
+            id=id, name=name, country=country, latitude=latitude, longitude=longitude
+        ) for id, name, latitude, longitude in (
+            (1, 'Kyiv', '50.45010', '30.52340'), (2, 'Bila Tserkva', '49.79680', '30.13110'),
+            (3, 'Lviv', '49.83970', '24.02970'), (4, 'Kharkiv', '49.99350', '36.23040')
+        )]
+        cls.tests = [Test.objects.create(title=f'test{i}', city=city)
+                     for i, city in enumerate([*cls.cities[::-1], None])]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get_ids(self, **params):
+        response = self.client.get(self.url, params)
+        assert response.status_code == 200
+        return [obj['id'] for obj in response.json()['data']]
+
+    def test_near(self):
+        kyiv, bila_tserkva, lviv, kharkiv = [self.tests[3 - i].id for i in range(4)]
+        params = {'filter[near]': self.kyiv, 'filter[radius_km]': 100}
+        assert self.get_ids(**params) == sorted([kyiv, bila_tserkva])
+        assert self.get_ids(**params, sort='-distance') == [bila_tserkva, kyiv]
+        assert self.get_ids(**params, sort='distance') == [kyiv, bila_tserkva]
+        # Kharkiv is 409 km and Lviv 468 km away
+        params['filter[radius_km]'] = 440
+        assert self.get_ids(**params, sort='distance') == [kyiv, bila_tserkva, kharkiv]
+        assert self.get_ids(**params, **{'filter[title]': 'test0,test1'}) == [kharkiv]
+        assert self.get_ids(**{'filter[near]': self.kyiv}) == [kyiv]
+
+    def test_bounding_box(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, {'filter[near]': self.kyiv, 'filter[radius_km]': 100})
+        sql = next(query['sql'] for query in queries
+                   if 'FROM "accomplishments_test"' in query['sql'] and 'ASIN' in query['sql'])
+        assert '"cities_light_city"."latitude" BETWEEN' in sql
+        assert '"cities_light_city"."longitude" BETWEEN' in sql
+
+    def test_invalid(self):
+        for params in ({'filter[near]': '50.45'}, {'filter[near]': '91,30'},
+                       {'filter[near]': self.kyiv, 'filter[radius_km]': 'far'},
+                       {'filter[near]': self.kyiv, 'filter[radius_km]': 0},
+                       {'sort': 'distance'}, {'sort': 'unknown'}):
+            response = self.client.get(self.url, params)
+            assert response.status_code == 400, params
+            assert response.json()['errors'][0]['code'] == 400
+
+
+class TitleSortTests(TestCase):
+    # The code points put the capitals first
+    titles = ['apple', 'Banana', 'banana split', 'co-op', 'Coop', 'cooper', 'Delta', 'eagle',
+              'zeta', 'Zulu']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email="normal@user.com", password="foo")
+        Test.objects.bulk_create([Test(title=title) for title in cls.titles[::2]])
+        for title in cls.titles[1::2]:
+            Test.objects.create(title=title)
+        University.objects.bulk_create([University(title=title) for title in cls.titles[::-1]])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get_titles(self, url, **params):
+        response = self.client.get(url, params)
+        assert response.status_code == 200
+        return [obj['attributes']['title'] for obj in response.json()['data']]
+
+    def test_sort(self):
+        url = '/api/accomplishments/test/'
+        assert self.get_titles(url, sort='title') == self.titles
+        assert self.get_titles(url, sort='-title') == self.titles[::-1]
+        pages = [self.get_titles(url, **{'sort': 'title', 'page[limit]': 4, 'page[offset]': offset})
+                 for offset in (0, 4, 8)]
+        assert [title for page in pages for title in page] == self.titles
+        assert self.get_titles('/api/accomplishments/universities/', sort='title') == self.titles
+
+    def test_keys(self):
+        test = Test.objects.create(title='Zulu')
+        assert bytes(test.title_key) == get_sort_key('Zulu')
+        test.title = 'apple'
+        test.save()
+        test.refresh_from_db()
+        assert bytes(test.title_key) == get_sort_key('apple')
+
+    def test_index(self):
+        queryset = Test.objects.order_by('title_key', 'id')[:20]
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        assert 'test_title_key' in queryset.explain()
@@ -10,6 +10,13 @@ router_test.register(r"", views.TestViewSet, basename="test")
 
 
 urlpatterns = [
+    path("universities/import/<str:alpha2>/", views.UniversityViewSet.as_view(
+        {'post': 'create', 'put': 'put'}
+    ), name='universities-import'),
     path("universities/", include((router.urls, 'universities')), name='universities'),
-    path("test/", include((router_test.urls, 'test')), name='test')
+    path("test/", include((router_test.urls, 'test')), name='test'),
+    path("operations/", views.OperationsView.as_view(), name='operations'),
+    path("changes/", views.ChangeFeedView.as_view(), name='changes'),
+    path("specialities/", views.SpecialityCatalogView.as_view(), name='specialities'),
+    path("specialities/<str:code>/", views.SpecialityCatalogView.as_view(), name='speciality')
 ]
@@ -1,35 +1,56 @@
-import time
-from django.core.exceptions import ObjectDoesNotExist
-from django.http.response import HttpResponseRedirect
+from asyncio import TimeoutError, get_running_loop, wait_for
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
 from rest_framework.response import Response
-from rest_framework.authentication import SessionAuthentication
 from rest_framework.decorators import action
-from rest_framework.reverse import reverse
-from adrf.viewsets import ViewSet
-from asgiref.sync import sync_to_async
-from aiofiles import open
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.settings import api_settings
 
-from cities_light.models import Country
+from rozumity.authentication import AsyncSessionAuthentication
+from rozumity.bulk import BulkChanges, BulkError
+from rozumity.exports import Export
+from rozumity.jobs import get_accepted_response, job_runner
+from rozumity.operations import AtomicOperationsView, Resource
+from rozumity.parsers import CompactJSONAPIParser, JSONAPIParser
+from rozumity.renderers import CompactJSONAPIRenderer, CSVRenderer, NDJSONRenderer
 from rozumity.paginations import LimitOffsetAsyncPagination
+from rozumity.serializers import get_link_template, get_resource_object
+from rozumity.throttling import RouteTokenBucketThrottle, UserTokenBucketThrottle
+from rozumity.viewsets import AsyncAPIView, AsyncViewSet
 
+from .catalog import CONTENT_LANGUAGES, get_code, get_language, speciality_catalog
+from .changes import change_feed, change_hub, render_event, render_reset
 from .models import University, Test
 from .permissions import UniversityPermission
 from .serializers import UniversitySerializer, TestSerializer
 
-reverse = sync_to_async(reverse)
 
-
-class TestViewSet(ViewSet):
+class TestViewSet(AsyncViewSet):
     permission_classes=[UniversityPermission]
-    authentication_classes = [SessionAuthentication]
+    authentication_classes = [AsyncSessionAuthentication]
+    throttle_classes = [UserTokenBucketThrottle, RouteTokenBucketThrottle]
     pagination_class = LimitOffsetAsyncPagination
-    queryset = Test.objects.prefetch_related('country').select_related(
+    # The service callers may exchange the documents in the compact encoding
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, CompactJSONAPIRenderer]
+    parser_classes = [*api_settings.DEFAULT_PARSER_CLASSES, CompactJSONAPIParser]
+    coalesce_requests = True
+    location_field = 'city'
+    sort_fields = {'id': 'id', 'distance': 'distance', 'title': 'title_key'}
+    queryset = TestSerializer.setup_eager_loading(Test.objects.select_related(
         'city', 'city__subregion', 'city__region', 'city__country'
+    ))
+    bulk_changes = BulkChanges(
+        Resource(queryset, TestSerializer, 'test:test-list'),
+        on_change=lambda action, ids, using: change_feed.publish_many('test', ids, action, using)
     )
     
     async def retrieve(self, request, pk):
         try:
-            object = await self.queryset.aget(id=pk)
+            object = await self.get_object(pk)
         except ObjectDoesNotExist:
             response = Response({'data': None}, status=404)
         else:
@@ -39,53 +60,21 @@ class TestViewSet(ViewSet):
         return response
     
     async def list(self, request):
-        filter_params = {}
-        for key, val in request.query_params.items():
-            if not key.startswith('filter['):
-                continue
-            key = key.split('[')[-1].replace(']', '')
-            if '__' in key:
-                split_key = key.split('__')
-                key, lookup = split_key[0], '__' + split_key[1]
-            else:
-                lookup = '__in'
-            try:
-                is_relation = bool(getattr(
-                    self.queryset.model, key, None
-                ).field.remote_field)
-            except AttributeError:
-                continue
-            key = key + '__id' + lookup if is_relation else key + lookup
-            if ',' not in val and lookup != '__in' and val.isnumeric():
-                val = int(val)
-            elif lookup == '__range':
-                split = val.split(',')
-                val = [split[0], split[1]]
-            else:
-                val = val.split(',')
-            filter_params.update({key: val})
-        objects = await self.pagination_class.paginate_queryset(
-            self.queryset.filter(**filter_params).order_by('id'), request=request
+        objects = await self.paginator.paginate_queryset(
+            await self.sort_queryset(
+                await self.filter_queryset(self.queryset, request), request
+            ), request=request
         )
         data = await TestSerializer(
             objects, many=True, context={'request': request}
         ).data
-        # TODO: write unit tests
-        serializer_field = await TestSerializer(objects, many=True)['attributes']
-        serializer_obj_representation = TestSerializer(objects, many=True).__repr__()
-        async for test in TestSerializer(objects, many=True):
-            assert type(test) == list
-        assert type(serializer_field) == list
-        assert type(serializer_obj_representation) == str and len(serializer_obj_representation) > 2
-        # print(serializer_obj_representation)
         if data['data']:
-            response = await self.pagination_class.get_paginated_response(data)
+            response = await self.paginator.get_paginated_response(data)
         else:
             response = Response({'data': []})
         return response
     
     async def create(self, request):
-        startT = time.time()
         data = request.data
         is_many = True if 'data' in data.keys() and type(data['data']) == list else False
         serializer_full = TestSerializer(
@@ -97,75 +86,163 @@ class TestViewSet(ViewSet):
         else:
             response_data = await serializer_full.errors
             status = 403
-        print(f'function time: {time.time() - startT}ms')
         return Response(data=response_data, status=status)
     
+    @action(methods=["patch", "delete"], detail=False, url_path='bulk', url_name="bulk",
+            parser_classes=[JSONAPIParser, JSONParser])
+    async def bulk(self, request):
+        """
+        PATCH applies a resource object without an id to all the tests
+        selected by the `filter[...]` parameters of the list and reports the
+        numbers of the changed rows and links. DELETE queues a job deleting
+        them, or the tests of a list of resource identifiers in `data`.
+        """
+        try:
+            if request.method == 'PATCH':
+                patch = await self.bulk_changes.validate(request.data)
+                queryset = await self.get_bulk_queryset(request)
+                meta = await self.bulk_changes.update(queryset, patch)
+            else:
+                # Validates the selection, the deletion runs as a job
+                document = request.data or None
+                await self.get_bulk_queryset(request, document)
+                job = await job_runner.submit('test.bulk-delete', {
+                    'filters': {key: val for key, val in request.query_params.items()
+                                if key.startswith('filter[')},
+                    'ids': [int(obj['id']) for obj in document['data']]
+                    if document is not None else None
+                }, request.user.id)
+                return get_accepted_response(job, request)
+        except BulkError as exc:
+            return Response(status=exc.status, data={
+                'jsonapi': {'version': '1.1'}, 'errors': exc.errors
+            })
+        return Response(data={'jsonapi': {'version': '1.1'}, 'meta': meta})
+    
+    async def get_bulk_queryset(self, request, document=None):
+        queryset = Test.objects.all()
+        if document is not None:
+            data = document.get('data') if type(document) == dict else None
+            if type(data) != list or any(
+                type(obj) != dict or obj.get('type') != 'test' for obj in data
+            ):
+                raise BulkError("A list of 'test' resource identifiers is expected.")
+            try:
+                queryset = queryset.filter(id__in=[int(obj['id']) for obj in data])
+            except (KeyError, TypeError, ValueError):
+                raise BulkError('The resource identifiers must be integers.')
+        filtered = await self.filter_queryset(queryset, request)
+        if document is None and not filtered.query.where:
+            # Changing every test takes an explicit filter
+            raise BulkError('A bulk change requires a filter or a list of resource identifiers.',
+                            pointer='/filter')
+        return filtered
+    
+    @action(methods=["get"], detail=False, url_path='export', url_name='export',
+            renderer_classes=[NDJSONRenderer, CSVRenderer], coalesce_requests=False)
+    async def export(self, request):
+        """
+        Streams all the tests selected by the `filter[...]` parameters of the
+        list, as NDJSON resource objects or as CSV rows, by the Accept header
+        or `format=ndjson|csv`.
+        """
+        queryset = await self.sort_queryset(
+            await self.filter_queryset(self.queryset, request), request
+        )
+        export = Export(queryset, TestSerializer, 'test:test-list')
+        return export.get_response(request, request.accepted_renderer.format, 'tests')
+    
     @action(methods=["get"], detail=False, url_path=r'(?P<pk>\d+)/(?P<field_name>\w+)', url_name="related")
     async def related(self, request, *args, **kwargs):
-        object = await self.queryset.aget(id=kwargs['pk'])
         try:
-            field_name = kwargs['field_name']
-            field = getattr(object, field_name)
-        except AttributeError:
+            serializer_field, model_field = await self.get_relationship(kwargs['field_name'])
+        except (KeyError, FieldDoesNotExist):
             return Response({'data': None}, status=404)
-        serializer_field = TestSerializer.Relationships._declared_fields[kwargs['field_name']]
-        if hasattr(field, 'all'):
-            link = '{}?filter[id]={}'.format(
-                await reverse(
-                    getattr(serializer_field.child, 'view_name').replace('detail', 'list'),
-                    request=request
-                ),
-                ",".join([
-                    str(obj.id) async for obj in 
-                    await sync_to_async(getattr(object, field_name).all)()
-                ])
-            )
-        elif field:
-            link = await reverse(
-                getattr(serializer_field, 'view_name'), 
-                args=[getattr(object, field_name).id], 
-                request=request
+        view_name = getattr(serializer_field, 'child', serializer_field).view_name
+        link_template = await get_link_template(view_name, request=request)
+        related_model = model_field.related_model
+        if model_field.many_to_many:
+            if not await self.queryset.model.objects.filter(id=kwargs['pk']).aexists():
+                return Response({'data': None}, status=404)
+            # The lookup through the reverse name joins the through-table
+            queryset = await self.filter_queryset(related_model.objects.filter(
+                **{model_field.related_query_name(): kwargs['pk']}
+            ), request)
+            objects = await self.paginator.paginate_queryset(
+                queryset.order_by('id'), request=request
             )
-        return HttpResponseRedirect(link)
+            data = [await get_resource_object(obj, link_template) 
+                    async for obj in objects]
+            if data:
+                return await self.paginator.get_paginated_response({'data': data})
+            return Response({'data': []})
+        try:
+            related_id = await self.queryset.model.objects.values_list(
+                model_field.attname, flat=True
+            ).aget(id=kwargs['pk'])
+        except ObjectDoesNotExist:
+            return Response({'data': None}, status=404)
+        if related_id is None:
+            return Response({'data': None})
+        object = await related_model.objects.aget(id=related_id)
+        return Response({'data': await get_resource_object(object, link_template)})
     
     @action(methods=["get"], detail=False, url_path=r'(?P<pk>\d+)/relationships/(?P<field_name>\w+)', url_name="self")
     async def self(self, request, *args, **kwargs):
-        object = await self.queryset.aget(id=kwargs['pk'])
         try:
-            field_name = kwargs['field_name']
-            field = getattr(object, field_name)
-        except AttributeError:
+            serializer_field, model_field = await self.get_relationship(kwargs['field_name'])
+        except (KeyError, FieldDoesNotExist):
             return Response({'data': None}, status=404)
-        serializer_field = TestSerializer.Relationships._declared_fields[field_name]
-        if hasattr(serializer_field, 'child'):
-            view_name = getattr(serializer_field.child, 'view_name')
-        else:
-            view_name = getattr(serializer_field, 'view_name')
-        if hasattr(field, 'all'):
-            data = []
-            async for obj in await sync_to_async(field.all)():
-                obj_data = await TestSerializer.ObjectId(obj).data
-                obj_data.update({'links': {'self': await reverse(
-                    serializer_field.child.view_name, args=[obj.id], request=request
-                )}})
-                data.append(obj_data)
-            return Response(data={'data': data})
-        else:
-            data = await TestSerializer.ObjectId(field).data
-            data['links'] = {}
-            data['links']['self'] = await reverse(view_name, args=[field.id], request=request)
-            return Response(data={'data': data})
+        view_name = getattr(serializer_field, 'child', serializer_field).view_name
+        link_template = await get_link_template(view_name, request=request)
+        obj_type = model_field.related_model.__name__.lower()
+        if model_field.many_to_many:
+            if not await self.queryset.model.objects.filter(id=kwargs['pk']).aexists():
+                return Response({'data': None}, status=404)
+            through = model_field.remote_field.through
+            target = model_field.m2m_reverse_field_name() + '_id'
+            ids = await self.paginator.paginate_queryset(
+                through.objects.filter(
+                    **{model_field.m2m_field_name() + '_id': kwargs['pk']}
+                ).order_by(target).values_list(target, flat=True), 
+                request=request
+            )
+            data = [{'type': obj_type, 'id': id, 'links': {'self': link_template.format(id)}}
+                    async for id in ids]
+            if data:
+                return await self.paginator.get_paginated_response({'data': data})
+            return Response({'data': []})
+        try:
+            related_id = await self.queryset.model.objects.values_list(
+                model_field.attname, flat=True
+            ).aget(id=kwargs['pk'])
+        except ObjectDoesNotExist:
+            return Response({'data': None}, status=404)
+        if related_id is None:
+            return Response({'data': None})
+        return Response(data={'data': {
+            'type': obj_type, 'id': related_id, 
+            'links': {'self': link_template.format(related_id)}
+        }})
+    
+    async def get_relationship(self, field_name):
+        return (TestSerializer.Relationships._declared_fields[field_name], 
+                self.queryset.model._meta.get_field(field_name))
 
 
-class UniversityViewSet(ViewSet):
+class UniversityViewSet(AsyncViewSet):
     permission_classes=[UniversityPermission]
-    authentication_classes = [SessionAuthentication]
+    authentication_classes = [AsyncSessionAuthentication]
+    throttle_classes = [UserTokenBucketThrottle, RouteTokenBucketThrottle]
     pagination_class = LimitOffsetAsyncPagination
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, CompactJSONAPIRenderer]
+    coalesce_requests = True
     queryset = University.objects.select_related('country')
+    sort_fields = {'id': 'id', 'title': 'title_key'}
     
     async def retrieve(self, request, pk):
         try:
-            objects = await self.queryset.aget(id=pk)
+            objects = await self.get_object(pk)
         except ObjectDoesNotExist:
             response = Response(data={'data': None}, status=404)
         else:
@@ -175,61 +252,49 @@ class UniversityViewSet(ViewSet):
         return response
     
     async def list(self, request):
-        objects = await self.pagination_class.paginate_queryset(
-            self.queryset.order_by('id'), request=request
+        objects = await self.paginator.paginate_queryset(
+            await self.sort_queryset(self.queryset, request), request=request
         )
-        startT = time.time()
         data = await UniversitySerializer(
             objects, many=True, context={'request': request}
         ).data
-        print(f'function time: {time.time() - startT}ms')
-        if data:
-            response = await self.pagination_class.get_paginated_response(data)
-        else:
-            response = Response(status=404, data={"errors": [{
-                "status": 404, "title": "Not Found",
-                "detail": 'There are no universities.'
-            }]})
-        return response
+        return await self.paginator.get_paginated_response(data)
+    
+    @action(methods=["get"], detail=False, url_path='export', url_name='export',
+            renderer_classes=[NDJSONRenderer, CSVRenderer], coalesce_requests=False)
+    async def export(self, request):
+        """
+        Streams all the universities selected by the `filter[...]`
+        parameters, as NDJSON resource objects or as CSV rows.
+        """
+        queryset = await self.sort_queryset(
+            await self.filter_queryset(self.queryset, request), request
+        )
+        export = Export(queryset, UniversitySerializer,
+                        'universities:universities-list')
+        return export.get_response(request, request.accepted_renderer.format, 'universities')
     
     async def create(self, request, alpha2):
-        alpha2 = alpha2.upper()
-        if len(alpha2) != 2:
-            return Response(status=404, data={"errors": [{
-                "status": 400, "title": "Bad request",
-                "detail": f'Please enter a valid alpha-2 country code.'
-            }]})
-        elif alpha2 not in ['UA']:
-            return Response(status=404, data={"errors": [{
-                "status": 404, "title": "Not Found",
-                "detail": f'Sorry, but the country is not supported.'
-            }]})
-        else:
-            country = await Country.objects.aget(code2=alpha2.upper())
-            objects = []
-        async with open(
-            f'accomplishments/fixtures/universities_{alpha2.lower()}.txt', 
-            mode="r", encoding="utf-8"
-        ) as data:
-            async for line in data:
-                line = line.strip()
-                title = line.split(';')[0]
-                obj, created = await University.objects.aget_or_create(title=title, country=country)
-                if created:
-                    objects.append(obj)
-        if objects:
-            data = await JSONAPIUniversityManager(
-                objects, related=country
-            ).data
-            response = Response(status=201, data=data)
-        else:
-            response = Response(status=409, data={"errors": [{
-                "status": 409, "title": "Conflict", 
-                "detail": f'The database already contains the provided objects.'
-            }]})
+        """Queues the import of the universities of a country."""
+        response = await self.validate_country(alpha2)
+        if response is None:
+            job = await job_runner.submit(
+                'universities.import', {'alpha2': alpha2.upper()}, request.user.id
+            )
+            response = get_accepted_response(job, request)
         return response
     
     async def put(self, request, alpha2):
+        """Queues the deletion of the universities of a country."""
+        response = await self.validate_country(alpha2)
+        if response is None:
+            job = await job_runner.submit(
+                'universities.delete', {'alpha2': alpha2.upper()}, request.user.id
+            )
+            response = get_accepted_response(job, request)
+        return response
+    
+    async def validate_country(self, alpha2):
         if len(alpha2) != 2:
             return Response(status=404, data={"errors": [{
                 "status": 400, "title": "Bad request",
@@ -240,33 +305,123 @@ class UniversityViewSet(ViewSet):
                 "status": 404, "title": "Not Found",
                 "detail": f'Sorry, but the country is not supported.'
             }]})
+        return None
+
+
+class OperationsView(AtomicOperationsView):
+    permission_classes = [UniversityPermission]
+    authentication_classes = [AsyncSessionAuthentication]
+    resources = {
+        'test': Resource(
+            TestViewSet.queryset, TestSerializer, 'test:test-list',
+            on_change=lambda action, ids, using: change_feed.publish_many('test', ids, action, using)
+        ),
+        'university': Resource(
+            UniversityViewSet.queryset, UniversitySerializer, 
+            'universities:universities-list',
+            on_change=lambda action, ids, using: change_feed.publish_many(
+                'university', ids, action, using
+            )
+        )
+    }
+
+
+class SpecialityCatalogView(AsyncAPIView):
+    """
+    The specialities with the titles in the language of Accept-Language,
+    `filter[code]` selects codes, `filter[code__startswith]` a code prefix,
+    together the listed codes with the prefix.
+    The documents come from the in-memory catalog, never from the database.
+    """
+    permission_classes = [UniversityPermission]
+    authentication_classes = [AsyncSessionAuthentication]
+    content_type = 'application/vnd.api+json'
+
+    async def get(self, request, code=None):
+        language = get_language(request.headers.get('Accept-Language'))
+        catalog = await speciality_catalog.aget()
+        if code is not None:
+            document = catalog.get(language, code)
+            if document is None:
+                return Response({'data': None}, status=404)
         else:
-            objects = []
-        async with open(
-            f'accomplishments/fixtures/universities_{alpha2.lower()}.txt', 
-            mode="r", encoding="utf-8"
-        ) as data:
-            async for line in data:
-                line = line.strip()
-                title = line.split(';')[0]
-                try:
-                    obj = await University.objects.aget(title=title)
-                except ObjectDoesNotExist:
-                    pass
-                else:
-                    university = UniversityJSONAPISerializer(obj).data
-                    del university['attributes']
-                    await obj.adelete()
-                    objects.append(university)
-        if objects:
-            response = Response(status=204, data={'data': objects})
+            codes = request.query_params.get('filter[code]')
+            if codes is not None:
+                if not all(code.isdecimal() for code in codes.split(',')):
+                    raise ParseError("'filter[code]' must be numeric codes.")
+                # `12` is the code `012`
+                codes = [get_code(int(code)) for code in codes.split(',')]
+            document = catalog.filter(
+                language, codes=codes,
+                prefix=request.query_params.get('filter[code__startswith]')
+            )
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if document.etag in if_none_match or if_none_match == ['*']:
+            response = HttpResponseNotModified()
         else:
-            response = Response(status=404, data={
-                "success":"false", "errors": [{
-                    "status": 404, "title": "Not Found", 
-                    "detail": f'There are no objects with the specified titles.'
-                }]
-            })
+            response = HttpResponse(document.content, content_type=self.content_type)
+        response['ETag'] = document.etag
+        response['Content-Language'] = CONTENT_LANGUAGES[language]
+        # The catalog is only readable by authenticated users
+        response['Cache-Control'] = 'private, no-cache'
+        patch_vary_headers(response, ('Accept-Language', 'Cookie'))
         return response
 
-#TODO: API for specialities
+
+class ChangeFeedView(AsyncAPIView):
+    """
+    A stream of Server-Sent Events, an event per created, updated or deleted
+    test or university with its resource identifier and version.
+    `filter[type]` selects the types. A client reconnecting with the
+    Last-Event-ID header, or `last_event_id`, gets the events it missed,
+    or a `reset` event when they are not kept anymore. A stream ends after
+    `lifetime` seconds and the client reconnects, so the stream of a client
+    gone without notice doesn't stay subscribed forever.
+    """
+    permission_classes = [UniversityPermission]
+    authentication_classes = [AsyncSessionAuthentication]
+    types = ('test', 'university')
+    heartbeat = getattr(settings, 'CHANGE_FEED_HEARTBEAT', 15)
+    lifetime = getattr(settings, 'CHANGE_FEED_LIFETIME', 300)
+
+    async def get(self, request):
+        types = request.query_params.get('filter[type]')
+        types = set(types.split(',') if types else self.types) & set(self.types)
+        last_event_id = request.headers.get('Last-Event-ID') or \
+            request.query_params.get('last_event_id')
+        await change_feed.start()
+        subscription, missed = change_hub.subscribe(types, last_event_id)
+        response = StreamingHttpResponse(
+            self.stream(subscription, missed, last_event_id),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Proxies must not buffer the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def stream(self, subscription, missed, last_event_id):
+        try:
+            loop = get_running_loop()
+            deadline = loop.time() + self.lifetime
+            # The client reconnects a second after the end of a stream
+            yield b'retry: 1000\n\n'
+            if missed is None:
+                yield render_reset(last_event_id)
+            else:
+                for event in missed:
+                    yield render_event(event)
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    event = await wait_for(
+                        subscription.queue.get(), min(self.heartbeat, remaining)
+                    )
+                except TimeoutError:
+                    yield b': heartbeat\n\n'
+                    continue
+                if event is None:
+                    # Too slow, the client resumes from its last event
+                    break
+                yield render_event(event)
+        finally:
+            change_hub.unsubscribe(subscription)
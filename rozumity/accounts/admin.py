@@ -1,18 +1,27 @@
 from django.contrib import admin
 
+from rozumity.admin import ScalableModelAdmin
 from accounts.models import User, ClientProfile, ExpertProfile
 
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
-    pass
+class UserAdmin(ScalableModelAdmin):
+    list_display = ('email', 'is_client', 'is_expert', 'is_staff')
+    search_fields = ('^email',)
+
+
+class ProfileAdmin(ScalableModelAdmin):
+    list_display = ('user', 'first_name', 'last_name', 'country', 'city')
+    list_select_related = ('user', 'country', 'city')
+    search_fields = ('^last_name', '^first_name')
+    autocomplete_fields = ('user', 'country', 'region', 'city')
 
 
 @admin.register(ClientProfile)
-class ClientProfileAdmin(admin.ModelAdmin):
+class ClientProfileAdmin(ProfileAdmin):
     pass
 
 
 @admin.register(ExpertProfile)
-class ExpertProfileAdmin(admin.ModelAdmin):
-    pass
+class ExpertProfileAdmin(ProfileAdmin):
+    autocomplete_fields = ProfileAdmin.autocomplete_fields + ('education',)
@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-19 02:39
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_alter_abstractprofile_date_birth'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='abstractprofile',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('last_name'), name='text_pattern_ops'), name='profile_last_name_prefix'),
+        ),
+        migrations.AddIndex(
+            model_name='abstractprofile',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('first_name'), name='text_pattern_ops'), name='profile_first_name_prefix'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('email'), name='text_pattern_ops'), name='user_email_prefix'),
+        ),
+    ]
@@ -1,9 +1,11 @@
 from datetime import date, timedelta
 
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import OpClass
 from django.utils.translation import gettext_lazy as _
 
 from .managers import CustomUserManager
@@ -29,6 +31,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     class Meta:
         verbose_name = _('User')
         verbose_name_plural = _('Users')
+        indexes = [models.Index(OpClass(Upper('email'), name='text_pattern_ops'),
+                                name='user_email_prefix')]
 
 
 # TODO: subscription plans
@@ -50,6 +54,14 @@ class AbstractProfile(models.Model):
     city = models.ForeignKey('cities_light.City', on_delete=models.SET_NULL, null=True, blank=True)
     date_birth = models.DateField(default=date.today()-timedelta(days=18*365))
     
+    class Meta:
+        indexes = [
+            models.Index(OpClass(Upper('last_name'), name='text_pattern_ops'),
+                         name='profile_last_name_prefix'),
+            models.Index(OpClass(Upper('first_name'), name='text_pattern_ops'),
+                         name='profile_first_name_prefix')
+        ]
+
     @property
     def name(self):
         return f'{self.first_name} {self.last_name}'
@@ -0,0 +1,26 @@
+from rest_framework import serializers
+from rozumity.serializers import JSONAPISerializer
+
+
+class ExpertProfileSerializer(JSONAPISerializer):
+    
+    class Attributes(JSONAPISerializer.Attributes):
+        first_name = serializers.CharField(max_length=32)
+        last_name = serializers.CharField(max_length=32)
+        education_extra = serializers.CharField(
+            max_length=500, required=False, allow_null=True
+        )
+    
+    class Relationships(JSONAPISerializer.Relationships):
+        city = JSONAPISerializer.ObjectId(
+            required=False, view_name='cities-light-api-city-detail'
+        )
+        region = JSONAPISerializer.ObjectId(
+            required=False, view_name='cities-light-api-region-detail'
+        )
+        country = JSONAPISerializer.ObjectId(
+            required=False, view_name='cities-light-api-country-detail'
+        )
+    
+    class Meta:
+        model_type = 'expertprofile'
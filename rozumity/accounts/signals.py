@@ -0,0 +1,22 @@
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from rozumity.authentication import session_user_cache
+from .models import User
+
+
+@receiver(user_logged_out)
+def invalidate_logged_out_session(sender, request, user, **kwargs):
+    session = getattr(request, 'session', None)
+    if session is not None and session.session_key:
+        session_user_cache.invalidate_session(session.session_key)
+    if user is not None:
+        session_user_cache.invalidate_user(user.pk)
+
+
+# Password changes and flag updates both end with User.save()
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_sessions(sender, instance, **kwargs):
+    session_user_cache.invalidate_user(instance.pk)
@@ -2,6 +2,9 @@
 # python ../manage.py test accounts
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from cities_light.models import City, Country
+
+from .models import ClientProfile, ExpertProfile
 
 
 class UsersManagersTests(TestCase):
@@ -41,3 +44,47 @@ class UsersManagersTests(TestCase):
         with self.assertRaises(ValueError):
             User.objects.create_superuser(
                 email="super@user.com", password="foo", is_superuser=False)
+
+
+class ExpertProfileListTests(TestCase):
+    url = '/api/accounts/experts/'
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(email="normal@user.com", password="foo")
+        country = Country.objects.create(id=1, name='Ukraine')
+        kyiv, lviv = [City.objects.create(
+            id=id, name=name, country=country, latitude=latitude, longitude=longitude
+        ) for id, name, latitude, longitude in (
+            (1, 'Kyiv', '50.45010', '30.52340'), (2, 'Lviv', '49.83970', '24.02970')
+        )]
+        cls.experts = [ExpertProfile.objects.create(
+            user=User.objects.create_user(email=f'expert{i}@user.com', password='foo'),
+            first_name=f'Expert{i}', last_name='Test', city=city, country=country
+        ) for i, city in enumerate((lviv, kyiv, None))]
+        ClientProfile.objects.create(user=cls.user, first_name='Client', last_name='Test',
+                                     city=kyiv)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_list(self):
+        data = self.client.get(self.url).json()['data']
+        assert [obj['id'] for obj in data] == [expert.id for expert in self.experts]
+        assert data[0]['type'] == 'expertprofile'
+        assert data[0]['attributes']['first_name'] == 'Expert0'
+        assert data[0]['relationships']['city']['data'] == {'type': 'city', 'id': 2}
+
+    def test_near(self):
+        response = self.client.get(self.url, {
+            'filter[near]': '50.4,30.5', 'filter[radius_km]': 600, 'sort': 'distance'
+        })
+        assert [obj['id'] for obj in response.json()['data']] == \
+            [self.experts[1].id, self.experts[0].id]
+        response = self.client.get(self.url, {'filter[near]': '50.4,30.5'})
+        assert [obj['id'] for obj in response.json()['data']] == [self.experts[1].id]
+
+    def test_authentication(self):
+        self.client.logout()
+        assert self.client.get(self.url).status_code == 403
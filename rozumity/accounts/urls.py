@@ -0,0 +1,12 @@
+from django.urls import path, include
+from rest_framework import routers
+
+from . import views
+
+router = routers.DefaultRouter()
+router.register(r"", views.ExpertProfileViewSet, basename="experts")
+
+
+urlpatterns = [
+    path("experts/", include((router.urls, 'experts')), name='experts'),
+]
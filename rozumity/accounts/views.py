@@ -1,5 +1,52 @@
 from django.core.exceptions import ObjectDoesNotExist
 from rest_framework.response import Response
-from rest_framework import permissions
-from rest_framework.authentication import SessionAuthentication
-from adrf.viewsets import ViewSet
\ No newline at end of file
+
+from rozumity.authentication import AsyncSessionAuthentication
+from rozumity.paginations import LimitOffsetAsyncPagination
+from rozumity.permissions import AuthenticatedReadIsStaffOtherPermission
+from rozumity.throttling import RouteTokenBucketThrottle, UserTokenBucketThrottle
+from rozumity.viewsets import AsyncViewSet
+
+from .models import ExpertProfile
+from .serializers import ExpertProfileSerializer
+
+
+class ExpertProfileViewSet(AsyncViewSet):
+    """
+    The profiles of the experts, `filter[near]=lat,lon&filter[radius_km]=N`
+    finds those living around a point and `sort=distance` puts the nearest
+    first. The profiles of the clients are private, they have no list.
+    """
+    permission_classes = [AuthenticatedReadIsStaffOtherPermission]
+    authentication_classes = [AsyncSessionAuthentication]
+    throttle_classes = [UserTokenBucketThrottle, RouteTokenBucketThrottle]
+    pagination_class = LimitOffsetAsyncPagination
+    coalesce_requests = True
+    location_field = 'city'
+    sort_fields = {'id': 'id', 'distance': 'distance'}
+    queryset = ExpertProfile.objects.select_related(
+        'city', 'city__subregion', 'city__region', 'city__country',
+        'region', 'region__country', 'country'
+    )
+    
+    async def retrieve(self, request, pk):
+        try:
+            object = await self.get_object(pk)
+        except ObjectDoesNotExist:
+            return Response({'data': None}, status=404)
+        return Response(await ExpertProfileSerializer(
+            object, context={'request': request}
+        ).data)
+    
+    async def list(self, request):
+        objects = await self.paginator.paginate_queryset(
+            await self.sort_queryset(
+                await self.filter_queryset(self.queryset, request), request
+            ), request=request
+        )
+        data = await ExpertProfileSerializer(
+            objects, many=True, context={'request': request}
+        ).data
+        if data['data']:
+            return await self.paginator.get_paginated_response(data)
+        return Response({'data': []})
@@ -0,0 +1,188 @@
+"""
+Admin building blocks for tables with millions of rows: changelists counted
+by the planner estimate and paginated by primary key, foreign keys edited
+with autocomplete widgets searched by indexed prefixes.
+"""
+from django.contrib import admin
+from django.contrib.admin.views.autocomplete import AutocompleteJsonView
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.http import JsonResponse
+from django.utils.cache import add_never_cache_headers
+from django.utils.functional import cached_property
+from asgiref.sync import sync_to_async
+from cities_light import admin as cities_light_admin
+from cities_light.models import City, Country, Region
+
+CURSOR_VAR = 'after'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts with the row estimate of the query plan, and exactly only when
+    the estimate is small enough for an exact count to be cheap.
+    """
+    exact_count_limit = 10000
+    estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet) or \
+                connections[queryset.db].vendor != 'postgresql':
+            return super().count
+        estimate = self.estimate(queryset)
+        if estimate <= self.exact_count_limit:
+            return super().count
+        self.estimated = True
+        return estimate
+
+    @staticmethod
+    def estimate(queryset):
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Pages through the rows ordered by primary key with `after=<pk>`
+    instead of an OFFSET, the cost of a page doesn't grow with its depth.
+    A changelist sorted by a column falls back to numbered pages.
+    """
+    keyset = False
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        ordering = self.get_ordering(request, self.root_queryset)
+        if ordering not in (['pk'], ['-pk']) or self.show_all:
+            return super().get_results(request)
+        self.keyset = True
+        self.descending = ordering == ['-pk']
+        try:
+            cursor = int(self.params.get(CURSOR_VAR)) if CURSOR_VAR in self.params else None
+        except ValueError:
+            cursor = None
+        queryset = self.queryset
+        if cursor is not None:
+            queryset = queryset.filter(**{self.lookup('lt'): cursor})
+        result_list = list(queryset[:self.list_per_page + 1])
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+
+        self.result_count = paginator.count
+        self.result_count_estimated = getattr(paginator, 'estimated', False)
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = result_list[:self.list_per_page]
+        self.can_show_all = False
+        self.multi_page = cursor is not None or len(result_list) > self.list_per_page
+        self.paginator = paginator
+        self.next_url = self.previous_url = self.first_url = None
+        if len(result_list) > self.list_per_page:
+            self.next_url = self.get_query_string({CURSOR_VAR: self.result_list[-1].pk})
+        if cursor is not None:
+            self.first_url = self.get_query_string(remove=[CURSOR_VAR])
+            self.previous_url = self.get_previous_url(cursor)
+
+    def lookup(self, lookup):
+        # Lookups in the direction of the ordering
+        if not self.descending:
+            lookup = {'lt': 'gt', 'gte': 'lte'}[lookup]
+        return f'pk__{lookup}'
+
+    def get_previous_url(self, cursor):
+        # The previous page starts after the row preceding its first one
+        preceding = list(self.queryset.filter(**{self.lookup('gte'): cursor}).reverse()
+                         .values_list('pk', flat=True)[:self.list_per_page + 1])
+        if len(preceding) <= self.list_per_page:
+            return self.first_url
+        return self.get_query_string({CURSOR_VAR: preceding[-1]})
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    """
+    A ModelAdmin whose changelist stays fast on large tables.
+    `autocomplete_search_fields` replace the search fields for the
+    autocomplete widgets of the other admins.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    change_list_template = 'admin/keyset_change_list.html'
+    autocomplete_search_fields = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_search_fields(self, request):
+        if self.autocomplete_search_fields and \
+                getattr(request, 'is_autocomplete', False):
+            return self.autocomplete_search_fields
+        return super().get_search_fields(request)
+
+
+class AutocompleteView(AutocompleteJsonView):
+    """
+    The autocomplete endpoint of the admin site with the search query run
+    by the async ORM. The next page is detected by fetching one row more
+    instead of counting all the matches.
+    """
+    admin_site = admin.site
+
+    async def get(self, request, *args, **kwargs):
+        request.is_autocomplete = True
+        if not await sync_to_async(self.admin_site.has_permission)(request):
+            raise PermissionDenied
+        self.term, self.model_admin, self.source_field, to_field_name = \
+            await sync_to_async(self.process_request)(request)
+        if not await sync_to_async(self.has_perm)(request):
+            raise PermissionDenied
+        queryset = await sync_to_async(self.get_queryset)()
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        offset = (page - 1) * self.paginate_by
+        objects = [obj async for obj in queryset[offset:offset + self.paginate_by + 1]]
+        results = await sync_to_async(lambda: [
+            self.serialize_result(obj, to_field_name) for obj in objects[:self.paginate_by]
+        ])()
+        response = JsonResponse({
+            'results': results, 'pagination': {'more': len(objects) > self.paginate_by}
+        })
+        add_never_cache_headers(response)
+        return response
+
+
+class CountryAdmin(ScalableModelAdmin, cities_light_admin.CountryAdmin):
+    autocomplete_search_fields = ('^name',)
+
+
+class RegionAdmin(ScalableModelAdmin, cities_light_admin.RegionAdmin):
+    autocomplete_search_fields = ('^name',)
+
+
+class CityChangeList(KeysetChangeList, cities_light_admin.CityChangeList):
+    pass
+
+
+class CityAdmin(ScalableModelAdmin, cities_light_admin.CityAdmin):
+    list_select_related = ('subregion', 'region', 'country')
+    autocomplete_search_fields = ('^name',)
+
+    def get_changelist(self, request, **kwargs):
+        return CityChangeList
+
+
+for model, model_admin in ((Country, CountryAdmin), (Region, RegionAdmin), (City, CityAdmin)):
+    admin.site.unregister(model)
+    admin.site.register(model, model_admin)
@@ -11,6 +11,9 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from rozumity.lifespan import with_lifespan
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rozumity.settings')
 
-application = get_asgi_application()
+# The startup hooks are registered by the apps
+application = with_lifespan(get_asgi_application())
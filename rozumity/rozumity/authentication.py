@@ -0,0 +1,144 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from django.conf import settings
+from django.contrib.auth import get_user
+from rest_framework.authentication import SessionAuthentication
+from asgiref.sync import sync_to_async
+
+get_user = sync_to_async(get_user)
+
+
+class UserSnapshot:
+    """
+    A read-only copy of the user flags that the permission classes need.
+    It is stored in the session cache instead of the model instance, so
+    a cached request never touches the database.
+    """
+    __slots__ = ('id', 'is_staff', 'is_active', 'is_client', 'is_expert')
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, is_staff=False, is_active=True,
+                 is_client=False, is_expert=False):
+        self.id = id
+        self.is_staff = is_staff
+        self.is_active = is_active
+        self.is_client = is_client
+        self.is_expert = is_expert
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {self.id}>'
+
+    def __str__(self):
+        return str(self.id)
+
+    def __eq__(self, other):
+        return getattr(other, 'pk', None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    @property
+    def pk(self):
+        return self.id
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            user.id, user.is_staff, user.is_active,
+            user.is_client, user.is_expert
+        )
+
+
+class SessionUserCache:
+    """
+    A bounded LRU map of session key -> UserSnapshot with a short TTL.
+    Invalidation comes from the accounts signals, the TTL bounds the
+    staleness between several worker processes.
+    """
+    def __init__(self, max_size=4096, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._sessions = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, session_key):
+        with self._lock:
+            item = self._items.get(session_key)
+            if item is None:
+                return None
+            user, expires = item
+            if expires <= monotonic():
+                self._pop(session_key)
+                return None
+            self._items.move_to_end(session_key)
+            return user
+
+    def set(self, session_key, user):
+        with self._lock:
+            self._pop(session_key)
+            self._items[session_key] = (user, monotonic() + self.ttl)
+            self._sessions.setdefault(user.id, set()).add(session_key)
+            while len(self._items) > self.max_size:
+                self._pop(next(iter(self._items)))
+
+    def invalidate_session(self, session_key):
+        with self._lock:
+            self._pop(session_key)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for session_key in list(self._sessions.get(user_id, ())):
+                self._pop(session_key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._sessions.clear()
+
+    def _pop(self, session_key):
+        item = self._items.pop(session_key, None)
+        if item is None:
+            return
+        sessions = self._sessions.get(item[0].id)
+        if sessions is not None:
+            sessions.discard(session_key)
+            if not sessions:
+                del self._sessions[item[0].id]
+
+
+session_user_cache = SessionUserCache(
+    getattr(settings, 'SESSION_USER_CACHE_SIZE', 4096),
+    getattr(settings, 'SESSION_USER_CACHE_TTL', 30)
+)
+
+
+class AsyncSessionAuthentication(SessionAuthentication):
+    """
+    Session authentication for the async viewsets. A cache hit resolves
+    the user from the session cookie alone, a miss loads the session and
+    the user once in a worker thread and stores a UserSnapshot.
+    """
+    cache = session_user_cache
+
+    async def aauthenticate(self, request):
+        batch = getattr(request._request, 'batch', None)
+        if batch is not None:
+            return (batch.user, None) if batch.user is not None else None
+        session_key = request._request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if not session_key:
+            return None
+        user = self.cache.get(session_key)
+        if user is None:
+            user = await get_user(request._request)
+            if not user.is_authenticated or not user.is_active:
+                return None
+            user = UserSnapshot.from_user(user)
+            self.cache.set(session_key, user)
+        self.enforce_csrf(request)
+        return (user, None)
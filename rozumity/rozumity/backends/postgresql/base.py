@@ -0,0 +1,68 @@
+"""
+PostgreSQL backend that keeps the connections in a pool, configured by
+the POOL entry of a DATABASES alias:
+
+    'POOL': {'min_size': 2, 'max_size': 20, 'timeout': 5, 'max_lifetime': 1800,
+             'max_idle': 300, 'check_interval': 30}
+
+Django "closes" the connection of a request thread when the request ends,
+this returns it to the pool instead of closing the socket.
+"""
+from threading import Lock
+from django.db.backends.postgresql import base, creation
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from .pool import ConnectionPool
+
+pools = {}
+pools_lock = Lock()
+
+
+def get_pool(settings_dict, conn_params):
+    key = tuple(sorted((name, str(value)) for name, value in conn_params.items()))
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(**settings_dict.get('POOL', {}))
+            pools[key].database = conn_params.get('dbname')
+        return pools[key]
+
+
+def get_pool_stats():
+    with pools_lock:
+        items = list(pools.values())
+    return [{'database': pool.database, **pool.stats()} for pool in items]
+
+
+def close_pools(database=None):
+    with pools_lock:
+        for key, pool in list(pools.items()):
+            if database is None or pool.database == database:
+                pool.close()
+                del pools[key]
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # A database with open connections can't be dropped
+        close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+    pool = None
+
+    def get_new_connection(self, conn_params):
+        self.pool = get_pool(self.settings_dict, conn_params)
+        connection = self.pool.getconn(
+            lambda: super(DatabaseWrapper, self).get_new_connection(conn_params)
+        )
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        self.isolation_level = (IsolationLevel.READ_COMMITTED if isolation_level is None
+                                else IsolationLevel(isolation_level))
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection)
@@ -0,0 +1,190 @@
+from threading import Condition, Lock
+from time import monotonic
+from psycopg2 import OperationalError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS, \
+    TRANSACTION_STATUS_INERROR
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class PooledConnection:
+    __slots__ = ('connection', 'created', 'used')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = self.used = monotonic()
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of psycopg2 connections to one database.
+    Connections are checked out by the database wrappers of the request
+    threads and returned when Django closes them at the end of a request.
+    Idle connections above `min_size` are closed after `max_idle` seconds,
+    every connection is closed after `max_lifetime` seconds, a connection
+    idle for more than `check_interval` seconds is pinged before reuse.
+    """
+    def __init__(self, min_size=0, max_size=10, timeout=5, max_lifetime=1800,
+                 max_idle=300, check_interval=30):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self._idle = []
+        self._used = {}
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+        self._counters = dict.fromkeys((
+            'connections_opened', 'connections_closed', 'checkouts',
+            'health_checks_failed', 'timeouts'
+        ), 0)
+        self._wait_time = 0.0
+        self._condition = Condition(Lock())
+
+    def stats(self):
+        with self._condition:
+            return {
+                'min_size': self.min_size, 'max_size': self.max_size,
+                'size': self._size, 'idle': len(self._idle),
+                'in_use': len(self._used), 'waiting': self._waiting,
+                **self._counters, 'wait_time': round(self._wait_time, 6)
+            }
+
+    def getconn(self, connect):
+        """
+        Returns an idle connection or opens one with `connect`, waiting
+        up to `timeout` seconds when `max_size` connections are in use.
+        """
+        deadline = monotonic() + self.timeout
+        while True:
+            item = self._reserve(deadline)
+            if item is None:
+                return self._open(connect)
+            if self._is_healthy(item):
+                with self._condition:
+                    item.used = monotonic()
+                    self._used[item.connection] = item
+                    self._counters['checkouts'] += 1
+                return item.connection
+            self._discard(item)
+
+    def putconn(self, connection):
+        with self._condition:
+            item = self._used.pop(connection, None)
+        if item is None:
+            connection.close()
+            return
+        now = monotonic()
+        if self._closed or now - item.created > self.max_lifetime or not self._reset(connection):
+            self._discard(item)
+            return
+        with self._condition:
+            item.used = now
+            self._idle.append(item)
+            self._evict(now)
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for item in idle:
+            self._discard(item)
+
+    def _reserve(self, deadline):
+        # An idle connection, or None when a new one may be opened
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise OperationalError('The connection pool is closed.')
+                if self._idle:
+                    # The most recently used connection is the warmest one
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout(
+                        f'No connection was available within {self.timeout} seconds.'
+                    )
+                self._waiting += 1
+                started = monotonic()
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                    self._wait_time += monotonic() - started
+
+    def _open(self, connect):
+        try:
+            connection = connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        item = PooledConnection(connection)
+        with self._condition:
+            self._used[connection] = item
+            self._counters['connections_opened'] += 1
+            self._counters['checkouts'] += 1
+        return connection
+
+    def _is_healthy(self, item):
+        now = monotonic()
+        if item.connection.closed or now - item.created > self.max_lifetime:
+            return False
+        if now - item.used < self.check_interval:
+            return True
+        try:
+            with item.connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if item.connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                item.connection.rollback()
+        except Exception:
+            with self._condition:
+                self._counters['health_checks_failed'] += 1
+            return False
+        return True
+
+    @staticmethod
+    def _reset(connection):
+        if connection.closed:
+            return False
+        status = connection.info.transaction_status
+        if status == TRANSACTION_STATUS_IDLE:
+            return True
+        if status not in (TRANSACTION_STATUS_INTRANS, TRANSACTION_STATUS_INERROR):
+            return False
+        try:
+            connection.rollback()
+        except Exception:
+            return False
+        return True
+
+    def _evict(self, now):
+        # Called with the lock held, keeps at least min_size connections
+        expired = [item for item in self._idle if now - item.used > self.max_idle]
+        for item in expired[:max(0, self._size - self.min_size)]:
+            self._idle.remove(item)
+            self._size -= 1
+            self._counters['connections_closed'] += 1
+            item.connection.close()
+
+    def _discard(self, item):
+        try:
+            item.connection.close()
+        except Exception:
+            pass
+        with self._condition:
+            self._used.pop(item.connection, None)
+            self._size -= 1
+            self._counters['connections_closed'] += 1
+            self._condition.notify()
@@ -0,0 +1,144 @@
+import json
+from asyncio import Semaphore, ensure_future, gather, iscoroutinefunction
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.http import HttpRequest, QueryDict
+from django.template.response import SimpleTemplateResponse
+from django.urls import Resolver404, resolve
+from rest_framework.response import Response
+from asgiref.sync import sync_to_async
+
+from rozumity.authentication import AsyncSessionAuthentication
+from rozumity.viewsets import AsyncAPIView
+
+
+class NotAcceptable:
+    """The body of a sub-response which is not a JSON document."""
+
+
+class BatchContext:
+    """
+    State shared by the sub-requests of one batch: the authenticated user
+    and a map of in-flight lookups, so the same object requested by several
+    sub-requests is fetched once.
+    """
+    def __init__(self, user):
+        self.user = user
+        self.shared = {}
+
+    async def get_or_set(self, key, function):
+        if key not in self.shared:
+            self.shared[key] = ensure_future(function())
+        return await self.shared[key]
+
+
+class BatchView(AsyncAPIView):
+    """
+    Dispatches a list of relative GET urls through the resolved async views
+    concurrently and returns their documents in one response.
+    """
+    authentication_classes = [AsyncSessionAuthentication]
+    max_requests = getattr(settings, 'BATCH_MAX_REQUESTS', 50)
+    max_concurrency = getattr(settings, 'BATCH_MAX_CONCURRENCY', 8)
+
+    async def post(self, request):
+        urls = request.data.get('requests') if type(request.data) == dict else None
+        if type(urls) != list or not urls or not all(type(url) == str for url in urls):
+            return Response(status=400, data={"errors": [{
+                "status": 400, "title": "Bad request",
+                "detail": "Please provide a list of relative urls in 'requests'."
+            }]})
+        if len(urls) > self.max_requests:
+            return Response(status=400, data={"errors": [{
+                "status": 400, "title": "Bad request",
+                "detail": f'A batch may contain up to {self.max_requests} requests.'
+            }]})
+        batch = BatchContext(request.user)
+        semaphore = Semaphore(self.max_concurrency)
+
+        async def dispatch(url):
+            async with semaphore:
+                return await self.dispatch_one(request, batch, url)
+
+        results = await gather(*[dispatch(url) for url in urls])
+        return Response(data={'results': results})
+
+    async def dispatch_one(self, request, batch, url):
+        parts = urlsplit(url)
+        result = {'url': url}
+        if parts.scheme or parts.netloc or not parts.path.startswith('/'):
+            return {**result, 'status': 400, 'body': {"errors": [{
+                "status": 400, "title": "Bad request",
+                "detail": 'Only relative urls are supported.'
+            }]}}
+        try:
+            match = resolve(parts.path)
+        except Resolver404:
+            match = None
+        if match is None or getattr(match.func, 'cls', None) is self.__class__:
+            return {**result, 'status': 404, 'body': {"errors": [{
+                "status": 404, "title": "Not Found",
+                "detail": 'The url does not match any resource.'
+            }]}}
+        view = match.func
+        if not iscoroutinefunction(view):
+            view = sync_to_async(view)
+        try:
+            response = await view(
+                self.get_subrequest(request._request, batch, parts),
+                *match.args, **match.kwargs
+            )
+            body = await self.get_body(response)
+        except Exception:
+            return {**result, 'status': 500, 'body': {"errors": [{
+                "status": 500, "title": "Internal Server Error",
+                "detail": 'The request could not be processed.'
+            }]}}
+        if body is NotAcceptable:
+            return {**result, 'status': 406, 'body': {"errors": [{
+                "status": 406, "title": "Not Acceptable",
+                "detail": 'Only JSON documents can be batched.'
+            }]}}
+        result['status'] = response.status_code
+        if response.has_header('Location'):
+            result['headers'] = {'Location': response['Location']}
+        if body is not None:
+            result['body'] = body
+        return result
+
+    @staticmethod
+    async def get_body(response):
+        """The document of a response, `NotAcceptable` for a stream or a non-JSON body."""
+        if isinstance(response, Response):
+            return response.data
+        # A stream is never started, closing the response would
+        # send request_finished in the middle of the batch
+        if response.streaming:
+            return NotAcceptable
+        if isinstance(response, SimpleTemplateResponse) and not response.is_rendered:
+            await sync_to_async(response.render)()
+        if not response.content:
+            return None
+        try:
+            return json.loads(response.content)
+        except ValueError:
+            return NotAcceptable
+
+    @staticmethod
+    def get_subrequest(request, batch, parts):
+        subrequest = HttpRequest()
+        subrequest.method = 'GET'
+        subrequest.path = subrequest.path_info = parts.path
+        subrequest.META = {
+            **request.META, 'REQUEST_METHOD': 'GET', 'PATH_INFO': parts.path,
+            'QUERY_STRING': parts.query
+        }
+        subrequest.META.pop('CONTENT_LENGTH', None)
+        subrequest.META.pop('CONTENT_TYPE', None)
+        subrequest.GET = QueryDict(parts.query)
+        subrequest.COOKIES = request.COOKIES
+        subrequest.batch = batch
+        for attr in ('session', 'user'):
+            if hasattr(request, attr):
+                setattr(subrequest, attr, getattr(request, attr))
+        return subrequest
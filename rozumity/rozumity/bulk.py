@@ -0,0 +1,208 @@
+"""
+Changes of all the resources matched by a filter at once. A patch is
+validated once and applied by a single UPDATE, the to-many relationships
+are replaced by set-based statements on their through-tables, whatever
+the number of rows.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connections, router, transaction
+from rest_framework.exceptions import ValidationError
+from asgiref.sync import sync_to_async
+
+from rozumity.collation import with_sort_keys
+from rozumity.serializers import JSONAPIObjectIdSerializer
+
+
+class BulkError(Exception):
+    def __init__(self, detail='', status=400, pointer='/data', errors=None):
+        if errors is None:
+            errors = [{'status': status, 'source': {'pointer': pointer}, 'detail': detail}]
+        statuses = {error['status'] for error in errors}
+        self.status = statuses.pop() if len(statuses) == 1 else 400
+        self.errors = errors
+        super().__init__(errors)
+
+
+class BulkPatch:
+    """The validated column values and the new members of the to-many relationships."""
+    __slots__ = ('values', 'members')
+
+    def __init__(self, values, members):
+        self.values = values
+        self.members = members
+
+
+class BulkChanges:
+    """
+    Updates and deletes the rows of a resource selected by a queryset.
+    The rows are locked and their ids taken once, so a filter on a changed
+    column or relationship selects the same rows for every statement.
+    The model may only be referenced by its own to-many relationships.
+    """
+    max_rows = 100000
+
+    def __init__(self, resource, on_change=None):
+        if resource.model._meta.related_objects:
+            raise ImproperlyConfigured(
+                f'{resource.model.__name__} is referenced by other models, '
+                'its rows can not be deleted in bulk.'
+            )
+        self.resource = resource
+        self.model = resource.model
+        self.type = resource.serializer_class.Meta.model_type
+        # Called with the action and the ids of the changed rows
+        self.on_change = on_change
+
+    async def validate(self, document):
+        data = document.get('data') if type(document) == dict else None
+        if type(data) != dict or data.get('type') != self.type:
+            raise BulkError(f"A '{self.type}' resource object is expected.")
+        if 'id' in data or 'lid' in data:
+            raise BulkError('A bulk patch applies to the selected resources, '
+                            'it may not contain an identifier.')
+        attributes = data.get('attributes', {})
+        relationships = data.get('relationships', {})
+        if type(attributes) != dict or type(relationships) != dict:
+            raise BulkError("The 'attributes' and 'relationships' members must be objects.")
+        values, members, errors = {}, {}, []
+        fields = self.resource.serializer_class.Attributes._declared_fields
+        for key, val in attributes.items():
+            field = fields.get(key)
+            pointer = f'/data/attributes/{key}'
+            if field is None or field.read_only:
+                errors.append((pointer, f"The attribute '{key}' can not be changed."))
+                continue
+            try:
+                values[key] = field.run_validation(val)
+            except ValidationError as exc:
+                errors.append((pointer, f"The JSON field '{key}' caused an exception: "
+                                        f"{str(exc.detail[0]).lower()}"))
+        for name, val in relationships.items():
+            pointer = f'/data/relationships/{name}'
+            try:
+                if type(val) != dict or 'data' not in val:
+                    raise BulkError(f"The relationship '{name}' must contain 'data'.")
+                if name in self.resource.to_many:
+                    field = self.resource.to_many[name]
+                    if type(val['data']) != list:
+                        raise BulkError(f"The relationship '{name}' expects a list.")
+                    members[name] = list(dict.fromkeys([
+                        await self.validate_identifier(field, obj) for obj in val['data']
+                    ]))
+                elif name in self.resource.to_one:
+                    field = self.resource.to_one[name]
+                    if val['data'] is None:
+                        if not field.null:
+                            raise BulkError(f"The relationship '{name}' may not be null.")
+                        values[field.attname] = None
+                    else:
+                        values[field.attname] = await self.validate_identifier(field, val['data'])
+                else:
+                    raise BulkError(f"Unknown relationship '{name}'.")
+            except BulkError as exc:
+                errors.append((pointer, exc.errors[0]['detail']))
+        if errors:
+            raise BulkError(errors=[{'status': 400, 'source': {'pointer': pointer},
+                                     'detail': detail} for pointer, detail in errors])
+        if not values and not members:
+            raise BulkError('The patch does not change anything.')
+        return BulkPatch(values, members)
+
+    @staticmethod
+    async def validate_identifier(field, identifier):
+        obj_type = field.related_model.__name__.lower()
+        if type(identifier) != dict or identifier.get('type') != obj_type:
+            raise BulkError(f"A '{obj_type}' resource identifier is expected.")
+        serializer = JSONAPIObjectIdSerializer(data=identifier)
+        if not await serializer.is_valid():
+            raise BulkError('The resource identifier must be an integer.')
+        return (await serializer.validated_data)['id']
+
+    def select(self, queryset):
+        # A to-many filter joins a row once per match and DISTINCT can not
+        # be locked, the rows are locked through a subquery of the matches
+        ids = list(self.model.objects.using(queryset.db)
+                   .filter(pk__in=queryset.values('pk')).order_by('pk')
+                   .select_for_update(of=('self',))
+                   .values_list('pk', flat=True)[:self.max_rows + 1])
+        if len(ids) > self.max_rows:
+            raise BulkError(f'A bulk change may select up to {self.max_rows} resources.',
+                            status=413, pointer='/filter')
+        return ids
+
+    @staticmethod
+    def get_through(field):
+        through = field.remote_field.through
+        return (through._meta.db_table,
+                through._meta.get_field(field.m2m_field_name()).column,
+                through._meta.get_field(field.m2m_reverse_field_name()).column)
+
+    def _update(self, queryset, patch):
+        using = router.db_for_write(self.model)
+        counts = {'matched': 0, 'updated': 0, 'relationships': {}}
+        with transaction.atomic(using=using):
+            ids = self.select(queryset.using(using))
+            counts['matched'] = len(ids)
+            if not ids:
+                return counts
+            if patch.values:
+                counts['updated'] = self.model.objects.using(using) \
+                    .filter(pk__in=ids).update(**with_sort_keys(self.model, patch.values))
+            with connections[using].cursor() as cursor:
+                for name, targets in patch.members.items():
+                    table, source, target = self.get_through(self.resource.to_many[name])
+                    # The members kept are neither removed nor added again
+                    cursor.execute(
+                        f'DELETE FROM {table} WHERE {source} = ANY(%s) '
+                        f'AND NOT {target} = ANY(%s)', [ids, targets]
+                    )
+                    removed = cursor.rowcount
+                    cursor.execute(
+                        f'INSERT INTO {table} ({source}, {target}) '
+                        f'SELECT source, target FROM unnest(%s::bigint[]) AS source '
+                        f'CROSS JOIN unnest(%s::bigint[]) AS target ON CONFLICT DO NOTHING',
+                        [ids, targets]
+                    )
+                    counts['relationships'][name] = {'removed': removed, 'added': cursor.rowcount}
+            if patch.members:
+                # The deferred foreign keys of the added members fail here, not at the commit
+                connections[using].check_constraints(
+                    [self.get_through(self.resource.to_many[name])[0] for name in patch.members]
+                )
+            if self.on_change is not None:
+                self.on_change('updated', ids, using)
+        return counts
+
+    def _delete(self, queryset):
+        using = router.db_for_write(self.model)
+        counts = {'matched': 0, 'deleted': 0, 'relationships': {}}
+        with transaction.atomic(using=using):
+            ids = self.select(queryset.using(using))
+            counts['matched'] = len(ids)
+            if not ids:
+                return counts
+            with connections[using].cursor() as cursor:
+                for name, field in self.resource.to_many.items():
+                    table, source, target = self.get_through(field)
+                    cursor.execute(f'DELETE FROM {table} WHERE {source} = ANY(%s)', [ids])
+                    counts['relationships'][name] = {'removed': cursor.rowcount}
+                cursor.execute(
+                    f'DELETE FROM {self.model._meta.db_table} '
+                    f'WHERE {self.model._meta.pk.column} = ANY(%s)', [ids]
+                )
+                counts['deleted'] = cursor.rowcount
+            if self.on_change is not None:
+                self.on_change('deleted', ids, using)
+        return counts
+
+    async def update(self, queryset, patch):
+        try:
+            return await sync_to_async(self._update)(queryset, patch)
+        except IntegrityError as exc:
+            raise BulkError(str(exc).splitlines()[0], status=409)
+
+    async def delete(self, queryset):
+        try:
+            return await sync_to_async(self._delete)(queryset)
+        except IntegrityError as exc:
+            raise BulkError(str(exc).splitlines()[0], status=409)
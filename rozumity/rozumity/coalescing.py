@@ -0,0 +1,80 @@
+"""
+Single-flight coalescing of safe requests. The first request of a key
+computes and renders the response, the identical requests arriving while
+it is in flight wait for it and get a copy of its rendered bytes.
+"""
+from asyncio import TimeoutError, get_running_loop, shield, wait_for
+from django.conf import settings
+from django.http import HttpResponse
+
+
+class LeaderCancelled(Exception):
+    """The request computing a response went away before finishing it."""
+
+
+class SharedResponse:
+    """The status, headers and rendered content of a response."""
+    __slots__ = ('status', 'headers', 'content')
+
+    def __init__(self, response):
+        self.status = response.status_code
+        self.headers = list(response.items())
+        self.content = response.content
+
+    def to_response(self):
+        response = HttpResponse(self.content, status=self.status)
+        for name, value in self.headers:
+            response[name] = value
+        return response
+
+
+class SingleFlight:
+    """
+    The futures of the responses in flight. A follower waits up to
+    `timeout` seconds and then computes its own response, so a slow
+    leader doesn't hold up every request of its key.
+    """
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+        self._flights = {}
+        self.stats = dict.fromkeys(('leaders', 'followers', 'timeouts'), 0)
+
+    def __len__(self):
+        return len(self._flights)
+
+    async def run(self, key, compute):
+        future = self._flights.get(key)
+        if future is not None and future.get_loop() is get_running_loop():
+            self.stats['followers'] += 1
+            try:
+                shared = await wait_for(shield(future), self.timeout)
+            except TimeoutError:
+                self.stats['timeouts'] += 1
+            except LeaderCancelled:
+                pass
+            else:
+                return shared.to_response()
+            return await compute()
+        return await self.lead(key, compute)
+
+    async def lead(self, key, compute):
+        self.stats['leaders'] += 1
+        future = get_running_loop().create_future()
+        self._flights[key] = future
+        try:
+            response = await compute()
+        except BaseException as exc:
+            # The followers get the same error, a cancelled leader lets them retry
+            future.set_exception(exc if isinstance(exc, Exception) else LeaderCancelled())
+            # Retrieved, nobody may be waiting for it
+            future.exception()
+            raise
+        else:
+            future.set_result(SharedResponse(response))
+            return response
+        finally:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+
+
+single_flight = SingleFlight(getattr(settings, 'COALESCING_TIMEOUT', 10))
@@ -0,0 +1,158 @@
+"""
+A compact encoding of the JSON:API documents for the service callers,
+negotiated as `application/vnd.rozumity.compact+json`. It is still JSON,
+with every array of objects turned into columns:
+
+    {"$n": 2, "$t": [["type"], ["id"], ["attributes", "title"], ["links", "self"]],
+     "$c": [{"$k": "test"}, [1, 2], ["a", "b"],
+            {"$p": "http://host/api/accomplishments/test/", "$s": "/", "$v": ["1", "2"]}]}
+
+`$t` lists the paths of the leaves of the `$n` objects and `$c` their
+columns. A column of a single scalar is that value `$k`, a column of
+repeated strings is the table of its distinct strings `$d` and their
+indexes `$i`, a column of strings sharing a prefix and a suffix keeps
+only the rest `$v` of each, a column the objects `$m` lack holds the
+values of the others. An object with a `$t` or an `$o` key of its own
+is wrapped as `{"$o": object}`. Decoding gives back the document, the
+order of the keys apart.
+"""
+from collections.abc import Mapping
+from os.path import commonprefix
+
+MEDIA_TYPE = 'application/vnd.rozumity.compact+json'
+# A shorter prefix and suffix cost more than they save
+MIN_AFFIX = 4
+SCALARS = (str, int, float, bool, type(None))
+
+
+class Missing:
+    """The value of a column for an object without its path."""
+    __slots__ = ()
+
+
+MISSING = Missing()
+
+
+def encode(value):
+    if isinstance(value, Mapping):
+        obj = {key: encode(val) for key, val in value.items()}
+        return {'$o': obj} if '$t' in obj or '$o' in obj else obj
+    if isinstance(value, (list, tuple)):
+        if len(value) > 1 and all(isinstance(item, Mapping) and item for item in value):
+            return encode_table(value)
+        return [encode(item) for item in value]
+    return value
+
+
+def flatten(obj, prefix=()):
+    for key, val in obj.items():
+        path = (*prefix, key)
+        if isinstance(val, Mapping) and val:
+            yield from flatten(val, path)
+        else:
+            yield path, val
+
+
+def encode_table(rows):
+    columns = {}
+    for index, row in enumerate(rows):
+        for path, val in flatten(row):
+            column = columns.get(path)
+            if column is None:
+                column = columns[path] = ([], [])
+            column[0].append(index)
+            column[1].append(val)
+    count = len(rows)
+    encoded = []
+    for indexes, values in columns.values():
+        column = encode_column(values)
+        if len(indexes) < count:
+            present = set(indexes)
+            column = {'$m': [index for index in range(count) if index not in present],
+                      '$c': column}
+        encoded.append(column)
+    return {'$n': count, '$t': [list(path) for path in columns], '$c': encoded}
+
+
+def encode_column(values):
+    if len(values) < 2:
+        return [encode(val) for val in values]
+    first = values[0]
+    # 1, 1.0 and True are equal but not the same value
+    if isinstance(first, SCALARS) and all(
+        type(val) is type(first) and val == first for val in values
+    ):
+        return {'$k': first}
+    if not all(isinstance(val, str) for val in values):
+        return [encode(val) for val in values]
+    distinct = dict.fromkeys(values)
+    if len(distinct) * 2 <= len(values):
+        indexes = {val: index for index, val in enumerate(distinct)}
+        return {'$d': list(distinct), '$i': [indexes[val] for val in values]}
+    prefix = commonprefix(values)
+    rests = [val[len(prefix):] for val in values]
+    suffix = commonprefix([rest[::-1] for rest in rests])[::-1]
+    if len(prefix) + len(suffix) < MIN_AFFIX:
+        return values
+    end = len(suffix)
+    return {'$p': prefix, '$s': suffix,
+            '$v': [rest[:len(rest) - end] for rest in rests] if end else rests}
+
+
+def decode(value):
+    """The document of an encoded one, ValueError when it is malformed."""
+    if isinstance(value, dict):
+        if '$t' in value:
+            return decode_table(value)
+        if '$o' in value:
+            value = value['$o']
+            if not isinstance(value, dict):
+                raise ValueError("An '$o' member must be an object.")
+        return {key: decode(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    return value
+
+
+def decode_column(column, count):
+    if isinstance(column, list):
+        values = [decode(val) for val in column]
+    elif not isinstance(column, dict):
+        raise ValueError('A column must be an array or an object.')
+    elif '$m' in column:
+        missing = set(column['$m'])
+        if not missing.issubset(range(count)):
+            raise ValueError('A missing row is out of the table.')
+        present = iter(decode_column(column['$c'], count - len(missing)))
+        values = [MISSING if index in missing else next(present) for index in range(count)]
+    elif '$k' in column:
+        values = [column['$k']] * count
+    elif '$d' in column:
+        strings = column['$d']
+        values = [strings[index] for index in column['$i']]
+    elif '$p' in column:
+        prefix, suffix = column['$p'], column['$s']
+        values = [f'{prefix}{val}{suffix}' for val in column['$v']]
+    else:
+        raise ValueError('Unknown column encoding.')
+    if len(values) != count:
+        raise ValueError(f'A column must have {count} values.')
+    return values
+
+
+def decode_table(table):
+    count = table['$n']
+    if type(count) != int or count < 0 or len(table['$t']) != len(table['$c']):
+        raise ValueError('Malformed table.')
+    rows = [{} for _ in range(count)]
+    for path, column in zip(table['$t'], table['$c']):
+        if not isinstance(path, list) or not path:
+            raise ValueError('A path must be a non-empty array.')
+        *parents, key = path
+        for row, val in zip(rows, decode_column(column, count)):
+            if val is MISSING:
+                continue
+            for parent in parents:
+                row = row.setdefault(parent, {})
+            row[key] = val
+    return rows
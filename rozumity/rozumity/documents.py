@@ -0,0 +1,128 @@
+from collections.abc import Mapping
+from sys import intern
+
+_types = {}
+
+
+def get_type(model):
+    """
+    Returns the resource type of a model class, interned once,
+    so every object of a page refers to the same string.
+    """
+    try:
+        return _types[model]
+    except KeyError:
+        return _types.setdefault(model, intern(model.__name__.lower()))
+
+
+def get_links_template(url, id):
+    """
+    Turns the url of a resource or of its collection into a template
+    shared by all the resources of a document.
+    """
+    suffix = f'{id}/'
+    if url.endswith(suffix):
+        url = url[:-len(suffix)]
+    return url.replace('{', '{{').replace('}', '}}') + '{}/'
+
+
+class DocumentMember(Mapping):
+    """
+    A read-only mapping over the slots of a document member. Members are
+    built by the serializers and kept until the response is rendered,
+    the JSON encoder turns them into objects with dict().
+    """
+    __slots__ = ()
+    _keys = ()
+
+    def __iter__(self):
+        return (key for key in self._keys if self._has(key))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __getitem__(self, key):
+        if key not in self._keys or not self._has(key):
+            raise KeyError(key)
+        return self._get(key)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def _has(self, key):
+        return True
+
+    def _get(self, key):
+        return getattr(self, key)
+
+
+class ResourceIdentifier(DocumentMember):
+    __slots__ = ('type', 'id')
+    _keys = __slots__
+
+    def __init__(self, type, id):
+        self.type = type
+        self.id = id
+
+    @classmethod
+    def from_instance(cls, obj):
+        if obj is None:
+            return None
+        return cls(get_type(obj.__class__), obj.id)
+
+
+class ResourceLinks(DocumentMember):
+    __slots__ = ('template', 'id')
+    _keys = ('self',)
+
+    def __init__(self, template, id):
+        self.template = template
+        self.id = id
+
+    def _get(self, key):
+        return self.template.format(self.id)
+
+
+class RelationshipLinks(DocumentMember):
+    __slots__ = ('resource', 'name')
+    _keys = ('self', 'related')
+
+    def __init__(self, resource, name):
+        self.resource = resource
+        self.name = name
+
+    def _get(self, key):
+        url = self.resource['self']
+        if key == 'self':
+            return f'{url}relationships/{self.name}/'
+        return f'{url}{self.name}/'
+
+
+class Relationship(DocumentMember):
+    __slots__ = ('data', 'links', 'meta', 'view_name')
+    _keys = ('data', 'links', 'meta')
+
+    def __init__(self, data, links=None, meta=None, view_name=None):
+        self.data = data
+        self.links = links
+        self.meta = meta
+        # The view of the related resources, used for the included links
+        self.view_name = view_name
+
+    def _has(self, key):
+        return key == 'data' or getattr(self, key) is not None
+
+
+class Resource(DocumentMember):
+    __slots__ = ('type', 'id', 'attributes', 'relationships', 'links')
+    _keys = __slots__
+
+    def __init__(self, type, id, attributes=None, relationships=None, links=None):
+        self.type = type
+        self.id = id
+        self.attributes = attributes
+        self.relationships = relationships
+        self.links = links
+
+    def _has(self, key):
+        return key in ('type', 'id') or bool(getattr(self, key))
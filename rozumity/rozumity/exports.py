@@ -0,0 +1,105 @@
+"""
+Exports of all the resources of a queryset as a stream of NDJSON resource
+objects or of CSV rows. The rows are read by a server-side cursor a chunk
+at a time, and the next chunk is only read once the previous one was sent,
+so an export holds a chunk in memory whatever the number of rows and goes
+at the pace of its client.
+"""
+import csv
+import json
+from io import StringIO
+from itertools import islice
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.reverse import reverse
+from rest_framework.utils import encoders
+from asgiref.sync import sync_to_async
+
+# The rows fetched from the cursor at once
+CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 1000)
+
+
+async def read_chunks(queryset, chunk_size=CHUNK_SIZE):
+    """
+    The objects of a queryset by lists of `chunk_size`, the prefetched
+    relationships are fetched per chunk.
+    """
+    iterator = queryset.iterator(chunk_size=chunk_size)
+    # The cursor belongs to the connection of the thread that opened it,
+    # every chunk is read in the same thread
+    read = sync_to_async(lambda: list(islice(iterator, chunk_size)), thread_sensitive=True)
+    try:
+        while chunk := await read():
+            yield chunk
+    finally:
+        await sync_to_async(iterator.close, thread_sensitive=True)()
+
+
+def get_linkage(relationship):
+    """The ids of the linkage of a relationship, separated by spaces."""
+    data = relationship.data if relationship is not None else None
+    if data is None:
+        return ''
+    if isinstance(data, list):
+        return ' '.join(str(obj.id) for obj in data)
+    return data.id
+
+
+class Export:
+    """
+    The resources of `queryset` represented by `serializer_class`, linked
+    as the resources of the list `view_name`.
+    """
+    content_types = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+    chunk_size = CHUNK_SIZE
+
+    def __init__(self, queryset, serializer_class, view_name):
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self.view_name = view_name
+
+    async def resources(self, request):
+        serializer = self.serializer_class(context={'request': request})
+        # The links of the resources are those of the list, not of the export
+        setattr(serializer, serializer.url_field_name,
+                await sync_to_async(reverse)(self.view_name, request=request))
+        async for chunk in read_chunks(self.queryset, self.chunk_size):
+            yield [await serializer.to_resource(obj) for obj in chunk]
+
+    async def ndjson(self, request):
+        async for resources in self.resources(request):
+            yield ''.join(
+                json.dumps(resource, cls=encoders.JSONEncoder, ensure_ascii=False,
+                           separators=(',', ':')) + '\n'
+                for resource in resources
+            ).encode()
+
+    async def csv(self, request):
+        attributes = list(self.serializer_class.Attributes._declared_fields)
+        relationships = list(self.serializer_class.Relationships._declared_fields)
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['id', *attributes, *relationships])
+        async for resources in self.resources(request):
+            for resource in resources:
+                resource_attributes = resource.attributes or {}
+                resource_relationships = resource.relationships or {}
+                writer.writerow([
+                    resource.id,
+                    *(resource_attributes.get(name) for name in attributes),
+                    *(get_linkage(resource_relationships.get(name)) for name in relationships)
+                ])
+            yield output.getvalue().encode()
+            output.seek(0)
+            output.truncate()
+        # Only the header when there is no row
+        if output.tell():
+            yield output.getvalue().encode()
+
+    def get_response(self, request, format, filename):
+        response = StreamingHttpResponse(
+            getattr(self, format)(request), content_type=self.content_types[format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}.{format}"'
+        response['Cache-Control'] = 'no-store'
+        return response
@@ -0,0 +1,87 @@
+"""
+The proximity filter of the lists,
+
+    ?filter[near]=50.45,30.52&filter[radius_km]=25&sort=distance
+
+for the resources located by a cities_light city. The cities inside the
+bounding box of the circle are found by the index on their coordinates,
+the haversine distance then keeps those inside the circle and is
+annotated as `distance` to sort by. No spatial extension is needed.
+"""
+from functools import reduce
+from math import asin, cos, degrees, isfinite, radians, sin
+from operator import or_
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cast, Cos, Least, Power, Radians, Sin, Sqrt
+from rest_framework.exceptions import ParseError
+
+# The mean radius of the Earth
+EARTH_RADIUS_KM = 6371.0088
+DEFAULT_RADIUS_KM = 50
+MAX_RADIUS_KM = 2000
+
+
+def parse_near(params):
+    """The latitude, longitude and radius of the parameters, None without `filter[near]`."""
+    near = params.get('filter[near]')
+    if near is None:
+        return None
+    try:
+        lat, lon = (float(val) for val in near.split(','))
+        radius = float(params.get('filter[radius_km]', DEFAULT_RADIUS_KM))
+    except ValueError:
+        raise ParseError("'filter[near]' must be 'latitude,longitude' "
+                         "and 'filter[radius_km]' a number.")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ParseError("'filter[near]' is out of the range of the coordinates.")
+    if not (isfinite(radius) and 0 < radius <= MAX_RADIUS_KM):
+        raise ParseError(f"'filter[radius_km]' must be between 0 and {MAX_RADIUS_KM}.")
+    return lat, lon, radius
+
+
+def get_bounding_box(lat, lon, radius):
+    """
+    The latitude range and the longitude ranges of the smallest box around
+    the circle, two longitude ranges when it crosses the antimeridian.
+    """
+    distance = radius / EARTH_RADIUS_KM
+    min_lat, max_lat = lat - degrees(distance), lat + degrees(distance)
+    if min_lat <= -90 or max_lat >= 90 or sin(distance) >= cos(radians(lat)):
+        # A pole is inside the circle
+        return (max(min_lat, -90), min(max_lat, 90)), [(-180, 180)]
+    delta = degrees(asin(sin(distance) / cos(radians(lat))))
+    min_lon, max_lon = lon - delta, lon + delta
+    if min_lon < -180:
+        return (min_lat, max_lat), [(min_lon + 360, 180), (-180, max_lon)]
+    if max_lon > 180:
+        return (min_lat, max_lat), [(min_lon, 180), (-180, max_lon - 360)]
+    return (min_lat, max_lat), [(min_lon, max_lon)]
+
+
+def get_distance(lat, lon, latitude, longitude):
+    """The haversine distance in km from a point to the coordinate expressions."""
+    lat, lon = radians(lat), radians(lon)
+    latitude = Radians(Cast(latitude, FloatField()))
+    longitude = Radians(Cast(longitude, FloatField()))
+    value = Power(Sin((latitude - lat) / 2), 2) + \
+        cos(lat) * Cos(latitude) * Power(Sin((longitude - lon) / 2), 2)
+    # The rounding errors must not leave the domain of asin
+    return 2 * EARTH_RADIUS_KM * ASin(Sqrt(Least(value, Value(1.0))))
+
+
+def filter_near(queryset, params, location):
+    """
+    The objects of `queryset` whose city, the `location` path, is within
+    the radius of `filter[near]`, annotated with their `distance`.
+    """
+    near = parse_near(params)
+    if near is None:
+        return queryset
+    lat, lon, radius = near
+    (min_lat, max_lat), lon_ranges = get_bounding_box(lat, lon, radius)
+    box = Q(**{f'{location}__latitude__range': (min_lat, max_lat)}) & reduce(or_, [
+        Q(**{f'{location}__longitude__range': lon_range}) for lon_range in lon_ranges
+    ])
+    return queryset.filter(box).annotate(distance=get_distance(
+        lat, lon, F(f'{location}__latitude'), F(f'{location}__longitude')
+    )).filter(distance__lte=radius)
@@ -0,0 +1,249 @@
+"""
+Background jobs run by the event loop of the process that queued them.
+A job is a row of the job table, so it outlives the request that queued
+it: a process picks up the queued jobs and the jobs left running by a
+stopped process at the startup of its ASGI application, or when a job
+is first submitted. The jobs of a type run at most `JOB_CONCURRENCY[type]`
+at once in a process, one by default:
+
+    JOB_CONCURRENCY = {'universities.import': 2}
+
+A synchronous job runs in a thread of its own, never in the thread
+shared by the async ORM calls of the requests.
+"""
+import logging
+from asyncio import Semaphore, create_task, gather, get_running_loop, iscoroutinefunction, sleep
+from contextvars import Context
+from datetime import timedelta
+from io import StringIO
+from os import getpid
+from secrets import token_hex
+from socket import gethostname
+from django.conf import settings
+from django.core.management import call_command
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from asgiref.sync import sync_to_async
+
+from rozumity.lifespan import on_startup
+from rozumity.models import Job
+
+logger = logging.getLogger('rozumity.jobs')
+
+# The job types by name
+registry = {}
+
+
+class JobFailed(Exception):
+    """Ends a job as failed, with the errors the job reported itself."""
+
+
+class JobType:
+    __slots__ = ('name', 'function', 'resumable', 'submittable')
+
+    def __init__(self, name, function, resumable, submittable):
+        self.name = name
+        self.function = function
+        self.resumable = resumable
+        self.submittable = submittable
+
+    @property
+    def concurrency(self):
+        return getattr(settings, 'JOB_CONCURRENCY', {}).get(self.name, 1)
+
+
+def job_type(name, resumable=True, submittable=False):
+    """
+    Registers a job function called with a JobContext and the params of
+    the job. A job left by a stopped process runs again when `resumable`,
+    fails otherwise. A `submittable` job may be queued by the staff
+    through the job endpoint.
+    """
+    def decorator(function):
+        registry[name] = JobType(name, function, resumable, submittable)
+        return function
+    return decorator
+
+
+class JobContext:
+    """
+    The progress of a running job. The job function only changes it,
+    the runner saves it every few seconds and once the job ends. The
+    counts and errors are replaced, not changed in place, as they may be
+    saved from another thread at any time.
+    """
+    def __init__(self, job):
+        self.job = job
+
+    def progress(self, done, total=None):
+        self.job.done = done
+        if total is not None:
+            self.job.total = total
+
+    def count(self, name, number=1):
+        self.job.counts = {**self.job.counts, name: self.job.counts.get(name, 0) + number}
+
+    def error(self, detail, pointer=None):
+        error = {'detail': detail}
+        if pointer is not None:
+            error['source'] = {'pointer': pointer}
+        self.job.errors = [*self.job.errors, error]
+
+
+class JobRunner:
+    save_interval = 2
+    # A running job without a heartbeat for so long was left by a stopped process
+    stale_after = 60
+
+    def __init__(self):
+        self.worker = f'{gethostname()}:{getpid()}:{token_hex(2)}'[:64]
+        self._loop = None
+        self._semaphores = {}
+        self._tasks = set()
+
+    async def submit(self, type, params=None, user_id=None):
+        if type not in registry:
+            raise LookupError(f"Unknown job type '{type}'.")
+        await self.start()
+        job = await Job.objects.acreate(type=type, params=params or {}, user_id=user_id)
+        self.schedule(job)
+        return job
+
+    async def start(self):
+        """Picks up the jobs of the table once per event loop."""
+        loop = get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop, self._semaphores, self._tasks = loop, {}, set()
+        now = timezone.now()
+        stale = Job.objects.filter(status=Job.RUNNING, heartbeat__lt=now - timedelta(
+            seconds=self.stale_after
+        ))
+        for name, job_type in registry.items():
+            if job_type.resumable:
+                await stale.filter(type=name).aupdate(status=Job.QUEUED)
+            else:
+                await stale.filter(type=name).aupdate(
+                    status=Job.FAILED, finished=now,
+                    errors=[{'detail': 'The job was interrupted and can not run again.'}]
+                )
+        async for job in Job.objects.filter(status=Job.QUEUED).order_by('id'):
+            self.schedule(job)
+
+    def schedule(self, job):
+        # Not in the context of the request which submitted the job,
+        # whose replica pin would route the reads of the job
+        task = create_task(self.run(job.id, job.type), context=Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def get_semaphore(self, job_type):
+        if job_type.name not in self._semaphores:
+            self._semaphores[job_type.name] = Semaphore(job_type.concurrency)
+        return self._semaphores[job_type.name]
+
+    async def run(self, job_id, type):
+        job_type = registry.get(type)
+        if job_type is None:
+            await Job.objects.filter(id=job_id, status=Job.QUEUED).aupdate(
+                status=Job.FAILED, finished=timezone.now(),
+                errors=[{'detail': f"Unknown job type '{type}'."}]
+            )
+            return
+        async with self.get_semaphore(job_type):
+            now = timezone.now()
+            # Another process may have picked it up meanwhile
+            claimed = await Job.objects.filter(id=job_id, status=Job.QUEUED).aupdate(
+                status=Job.RUNNING, worker=self.worker, started=now, heartbeat=now,
+                attempts=F('attempts') + 1
+            )
+            if not claimed:
+                return
+            job = await Job.objects.aget(id=job_id)
+            context = JobContext(job)
+            saving = create_task(self.keep_saving(job))
+            try:
+                if iscoroutinefunction(job_type.function):
+                    job.result = await job_type.function(context, **job.params)
+                else:
+                    job.result = await sync_to_async(
+                        job_type.function, thread_sensitive=False
+                    )(context, **job.params)
+            except JobFailed:
+                job.status = Job.FAILED
+            except Exception as exc:
+                logger.exception('The job %s failed', job)
+                context.error(str(exc) or exc.__class__.__name__)
+                job.status = Job.FAILED
+            else:
+                job.status = Job.SUCCEEDED
+            finally:
+                saving.cancel()
+            job.finished = timezone.now()
+            await self.save(job, 'status', 'result', 'finished')
+
+    async def keep_saving(self, job):
+        while True:
+            await sleep(self.save_interval)
+            await self.save(job)
+
+    @staticmethod
+    async def save(job, *fields):
+        job.heartbeat = timezone.now()
+        await job.asave(update_fields=['done', 'total', 'counts', 'errors', 'heartbeat', *fields])
+
+    async def wait(self):
+        """Waits for the jobs scheduled in this process."""
+        while self._tasks:
+            await gather(*list(self._tasks))
+
+
+job_runner = JobRunner()
+on_startup(job_runner.start)
+
+
+
+def get_job_resource(job, url):
+    return {
+        'type': 'job', 'id': job.id,
+        'attributes': {
+            'type': job.type, 'status': job.status,
+            'progress': {'done': job.done, 'total': job.total},
+            'counts': job.counts, 'errors': job.errors, 'result': job.result,
+            'created': job.created, 'started': job.started, 'finished': job.finished
+        },
+        'links': {'self': url}
+    }
+
+
+def get_accepted_response(job, request):
+    """The 202 response of a queued job, pointing to the job resource."""
+    url = reverse('job', args=[job.id], request=request)
+    response = Response(status=202, data={'data': get_job_resource(job, url)})
+    response['Location'] = url
+    return response
+
+
+class JobOutput(StringIO):
+    """Counts the rows reported by the `generate_data` command."""
+    steps = 10
+
+    def __init__(self, context):
+        super().__init__()
+        self.context = context
+
+    def write(self, line):
+        label, _, rest = line.partition(': ')
+        if rest.endswith(' s\n') and ' rows ' in rest:
+            self.context.count(label, int(rest.split(' ', 1)[0]))
+            self.context.progress(len(self.context.job.counts), self.steps)
+        return super().write(line)
+
+
+# A rerun would generate the data twice
+@job_type('generate-data', resumable=False, submittable=True)
+def generate_data(context, **options):
+    context.progress(0, JobOutput.steps)
+    call_command('generate_data', stdout=JobOutput(context), **options)
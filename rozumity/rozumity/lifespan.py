@@ -0,0 +1,41 @@
+"""
+The startup of the ASGI application. The servers speaking the lifespan
+protocol run the startup hooks before the first request, in a context
+of their own, so no request state leaks into the tasks they start.
+"""
+import logging
+
+logger = logging.getLogger('rozumity.lifespan')
+
+# The coroutine functions run at startup, registered by the apps
+startup_hooks = []
+
+
+def on_startup(function):
+    startup_hooks.append(function)
+    return function
+
+
+async def startup():
+    for function in startup_hooks:
+        try:
+            await function()
+        except Exception:
+            # The requests are served even when a hook fails
+            logger.exception('The startup hook %s failed', function.__qualname__)
+
+
+def with_lifespan(application):
+    """The ASGI application answering the lifespan protocol."""
+    async def lifespan(scope, receive, send):
+        if scope['type'] != 'lifespan':
+            return await application(scope, receive, send)
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    return lifespan
@@ -0,0 +1,268 @@
+"""
+Drives an ASGI application in-process with concurrent virtual clients,
+without a network, and reports the latency, the error rate and the number
+of database queries of each step of a scenario.
+
+A scenario is a JSON file:
+
+    {"clients": 20, "requests": 2000, "steps": [
+        {"name": "universities-list", "weight": 70,
+         "path": "/api/accomplishments/universities/",
+         "query": {"page[offset]": "{randint:0:1000}"}},
+        {"name": "test-detail", "weight": 20,
+         "path": "/api/accomplishments/test/{id:accomplishments.Test}/"},
+        {"name": "test-create", "weight": 10, "method": "POST", "bulk": 50,
+         "path": "/api/accomplishments/test/",
+         "body": {"data": {"type": "test", "attributes": {"title": "test"}}}}
+    ]}
+
+`{randint:a:b}` is replaced by a random integer, `{id:app.Model}` by the id
+of a random existing object. With `bulk` the `data` of the body becomes
+a list of that many objects.
+"""
+import json
+import re
+from asyncio import Event, gather
+from collections import Counter
+from contextvars import ContextVar
+from random import Random
+from time import perf_counter
+from urllib.parse import urlencode
+from django.apps import apps
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.utils.crypto import get_random_string
+
+PLACEHOLDER = re.compile(r'\{(randint|id):([^}]*)\}')
+
+# The query counter of the request being sent
+query_counter = ContextVar('query_counter', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    counter = query_counter.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    return values[max(0, int(round(percent / 100 * len(values))) - 1)]
+
+
+class Step:
+    def __init__(self, name, path, weight=1, method='GET', query=None, body=None,
+                 bulk=None, content_type='application/json'):
+        self.name = name
+        self.path = path
+        self.weight = weight
+        self.method = method.upper()
+        self.query = query or {}
+        self.body = body
+        self.bulk = bulk
+        self.content_type = content_type
+
+    def get_models(self):
+        text = json.dumps([self.path, self.query, self.body])
+        return {value for kind, value in PLACEHOLDER.findall(text) if kind == 'id'}
+
+    def render(self, random, ids):
+        def replace(match):
+            kind, value = match.groups()
+            if kind == 'randint':
+                start, end = value.split(':')
+                return str(random.randint(int(start), int(end)))
+            return str(random.choice(ids[value]))
+
+        def render_value(value):
+            if isinstance(value, str):
+                return PLACEHOLDER.sub(replace, value)
+            elif isinstance(value, list):
+                return [render_value(item) for item in value]
+            elif isinstance(value, dict):
+                return {key: render_value(item) for key, item in value.items()}
+            return value
+        body = b''
+        if self.body is not None:
+            body = self.body
+            if self.bulk:
+                body = {**body, 'data': [body['data']] * self.bulk}
+            body = json.dumps(render_value(body)).encode()
+        return (render_value(self.path), urlencode(render_value(self.query)), body)
+
+
+class Scenario:
+    def __init__(self, steps, clients=10, requests=1000, duration=None, user=None):
+        self.steps = steps
+        self.clients = clients
+        self.requests = requests
+        self.duration = duration
+        self.user = user
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as file:
+            data = json.load(file)
+        steps = [Step(**step) for step in data.pop('steps')]
+        return cls(steps, **data)
+
+    def load_ids(self):
+        """Loads the ids of the models referenced by the placeholders."""
+        ids = {}
+        for label in set().union(*[step.get_models() for step in self.steps]):
+            ids[label] = list(apps.get_model(label).objects.values_list('id', flat=True))
+            if not ids[label]:
+                raise ValueError(f'There are no {label} objects.')
+        return ids
+
+
+class StepStats:
+    __slots__ = ('latencies', 'queries', 'errors', 'statuses')
+
+    def __init__(self):
+        self.latencies = []
+        self.queries = 0
+        self.errors = 0
+        self.statuses = Counter()
+
+    def report(self, elapsed):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            'requests': count,
+            'throughput': round(count / elapsed, 1) if elapsed else 0,
+            'p50': round(percentile(latencies, 50) * 1000, 2),
+            'p90': round(percentile(latencies, 90) * 1000, 2),
+            'p99': round(percentile(latencies, 99) * 1000, 2),
+            'error_rate': round(self.errors / count, 4) if count else 0,
+            'queries': round(self.queries / count, 2) if count else 0,
+            'statuses': dict(self.statuses)
+        }
+
+
+def get_host():
+    host = next(iter(settings.ALLOWED_HOSTS), '*').lstrip('.')
+    return 'localhost' if host in ('', '*') else host
+
+
+class VirtualClient:
+    def __init__(self, session_key, csrf_token, host=None):
+        host = host or get_host()
+        self.session_key = session_key
+        cookie = (f'{settings.SESSION_COOKIE_NAME}={session_key}; '
+                  f'{settings.CSRF_COOKIE_NAME}={csrf_token}')
+        self.headers = [
+            (b'host', host.encode()),
+            (b'cookie', cookie.encode()),
+            (b'x-csrftoken', csrf_token.encode())
+        ]
+
+    @classmethod
+    def login(cls, user):
+        client = Client()
+        client.force_login(user)
+        return cls(client.cookies[settings.SESSION_COOKIE_NAME].value, get_random_string(32))
+
+    @staticmethod
+    def logout(clients):
+        Session.objects.filter(
+            session_key__in=[client.session_key for client in clients]
+        ).delete()
+
+
+class LoadTest:
+    def __init__(self, application, scenario, clients, ids, seed=0):
+        self.application = application
+        self.scenario = scenario
+        self.clients = clients
+        self.ids = ids
+        self.seed = seed
+        self.stats = {step.name: StepStats() for step in scenario.steps}
+
+    async def run(self):
+        connection_created.connect(install_query_counter)
+        started = perf_counter()
+        self.deadline = started + self.scenario.duration if self.scenario.duration else None
+        self.remaining = self.scenario.requests
+        try:
+            await gather(*[self.run_client(index, client)
+                           for index, client in enumerate(self.clients)])
+        finally:
+            connection_created.disconnect(install_query_counter)
+        elapsed = perf_counter() - started
+        total = StepStats()
+        for stats in self.stats.values():
+            total.latencies += stats.latencies
+            total.queries += stats.queries
+            total.errors += stats.errors
+            total.statuses.update(stats.statuses)
+        return {
+            'elapsed': round(elapsed, 3),
+            'steps': {name: stats.report(elapsed) for name, stats in self.stats.items()},
+            'total': total.report(elapsed)
+        }
+
+    def has_next(self):
+        if self.deadline is not None:
+            return perf_counter() < self.deadline
+        self.remaining -= 1
+        return self.remaining >= 0
+
+    async def run_client(self, index, client):
+        random = Random(self.seed + index)
+        steps = self.scenario.steps
+        weights = [step.weight for step in steps]
+        while self.has_next():
+            step = random.choices(steps, weights)[0]
+            path, query_string, body = step.render(random, self.ids)
+            stats = self.stats[step.name]
+            counter = [0]
+            token = query_counter.set(counter)
+            started = perf_counter()
+            try:
+                status = await self.send(client, step, path, query_string, body)
+            except Exception:
+                status = 500
+            finally:
+                query_counter.reset(token)
+            stats.latencies.append(perf_counter() - started)
+            stats.queries += counter[0]
+            stats.statuses[status] += 1
+            if status >= 400:
+                stats.errors += 1
+
+    async def send(self, client, step, path, query_string, body):
+        headers = list(client.headers)
+        if body:
+            headers += [(b'content-type', step.content_type.encode()),
+                        (b'content-length', str(len(body)).encode())]
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': step.method, 'scheme': 'http', 'path': path,
+            'raw_path': path.encode(), 'query_string': query_string.encode(),
+            'root_path': '', 'headers': headers,
+            'client': ('127.0.0.1', 0), 'server': ('localhost', 80)
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        response = {}
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # The client never disconnects, the handler cancels the wait
+            await Event().wait()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+        await self.application(scope, receive, send)
+        return response['status']
@@ -0,0 +1,37 @@
+from statistics import median
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import load_backend
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the pooled backend with a new connection per request: '
+        'every request connects, runs a query and closes the connection.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        settings_dict = connections[options['database']].settings_dict
+        for engine in ('django.db.backends.postgresql', 'rozumity.backends.postgresql'):
+            backend = load_backend(engine)
+            timings = []
+            for _ in range(options['requests']):
+                connection = backend.DatabaseWrapper(
+                    {**settings_dict, 'ENGINE': engine}, options['database']
+                )
+                started = perf_counter()
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                connection.close()
+                timings.append(perf_counter() - started)
+            timings.sort()
+            self.stdout.write(
+                f'{engine}: {options["requests"] / sum(timings):.0f} requests/s, '
+                f'p50 {median(timings) * 1000:.2f} ms, '
+                f'p99 {timings[int(len(timings) * 0.99) - 1] * 1000:.2f} ms'
+            )
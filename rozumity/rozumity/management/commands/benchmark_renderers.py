@@ -0,0 +1,59 @@
+from gzip import compress
+from io import BytesIO
+from statistics import median
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from asgiref.sync import async_to_sync
+
+from rozumity.parsers import CompactJSONAPIParser
+from rozumity.renderers import CompactJSONAPIRenderer
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the JSON and the compact encodings of a page of tests or '
+        'universities: the bytes of the document, plain and gzipped, and the '
+        'times to render and to parse it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--resource', choices=['test', 'university'], default='test')
+        parser.add_argument('--limit', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        from accomplishments.serializers import TestSerializer, UniversitySerializer
+        from accomplishments.views import TestViewSet, UniversityViewSet
+        viewset, serializer_class = {
+            'test': (TestViewSet, TestSerializer),
+            'university': (UniversityViewSet, UniversitySerializer)
+        }[options['resource']]
+        objects = viewset.queryset.order_by('id')[:options['limit']]
+        if not objects.exists():
+            raise CommandError('There is nothing to render, see the generate_data command.')
+        request = RequestFactory().get(f'/api/accomplishments/{options["resource"]}/')
+
+        async def serialize():
+            return await serializer_class(objects, many=True, context={'request': request}).data
+        document = async_to_sync(serialize)()
+        decoded = {}
+        for name, renderer, parser in (('json', JSONRenderer(), JSONParser()),
+                                       ('compact', CompactJSONAPIRenderer(), CompactJSONAPIParser())):
+            render_times, parse_times = [], []
+            for _ in range(options['repeat']):
+                started = perf_counter()
+                content = renderer.render(document)
+                render_times.append(perf_counter() - started)
+                started = perf_counter()
+                decoded[name] = parser.parse(BytesIO(content))
+                parse_times.append(perf_counter() - started)
+            self.stdout.write(
+                f'{name}: {len(content)} bytes, {len(compress(content))} gzipped, '
+                f'render p50 {median(render_times) * 1000:.2f} ms, '
+                f'parse p50 {median(parse_times) * 1000:.2f} ms'
+            )
+        if decoded['compact'] != decoded['json']:
+            raise CommandError('The compact document differs from the JSON one.')
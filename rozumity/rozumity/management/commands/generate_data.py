@@ -0,0 +1,279 @@
+import csv
+from datetime import date, datetime, timedelta, timezone
+from io import StringIO
+from itertools import islice
+from random import Random
+from pathlib import Path
+from time import perf_counter
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import Max
+from cities_light.models import City, Country
+
+from rozumity.collation import get_sort_key
+from accomplishments.models import Education, Speciality, Test, University
+from accounts.models import AbstractProfile, ClientProfile, ExpertProfile, User
+
+FIRST_NAMES = (
+    'Oleksandr', 'Olena', 'Andrii', 'Iryna', 'Dmytro', 'Natalia', 'Serhii', 'Tetiana',
+    'Maksym', 'Yulia', 'Ivan', 'Oksana', 'Taras', 'Kateryna', 'Bohdan', 'Sofia',
+    'Anna', 'Mark', 'Emma', 'Lukas', 'Marta', 'Piotr', 'Eva', 'Jan'
+)
+LAST_NAMES = (
+    'Shevchenko', 'Kovalenko', 'Bondarenko', 'Tkachenko', 'Kravchenko', 'Melnyk',
+    'Boiko', 'Kovalchuk', 'Oliinyk', 'Lysenko', 'Moroz', 'Marchenko', 'Savchenko',
+    'Rudenko', 'Nowak', 'Novak', 'Muller', 'Schmidt', 'Dubois', 'Rossi'
+)
+UNIVERSITY_KINDS = (
+    'National University', 'State University', 'Technical University',
+    'Medical University', 'Pedagogical University', 'Agrarian University',
+    'Polytechnic Institute', 'University of Economics', 'Academy of Arts',
+    'Linguistic University'
+)
+SPECIALITY_KINDS = ('', 'Applied ', 'Theoretical ', 'Computational ', 'Clinical ', 'Digital ')
+TEST_KINDS = (
+    'Personality', 'Anxiety', 'Depression', 'Attention', 'Memory', 'Stress',
+    'Burnout', 'Sleep', 'Motivation', 'Empathy', 'Resilience', 'Self-esteem'
+)
+
+
+class Loader:
+    """
+    Writes rows to a table in batches, with COPY on PostgreSQL
+    and with multi-row INSERT statements on the other databases.
+    """
+    def __init__(self, connection, batch_size, use_copy=True):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.use_copy = use_copy and connection.vendor == 'postgresql'
+
+    def load(self, model, columns, rows):
+        count = 0
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                return count
+            if self.use_copy:
+                self.copy(model._meta.db_table, columns, batch)
+            else:
+                self.insert(model._meta.db_table, columns, batch)
+            count += len(batch)
+
+    def copy(self, table, columns, batch):
+        arrays = [index for index, value in enumerate(batch[0]) if type(value) == list]
+        if arrays:
+            batch = [self.to_arrays(row, arrays) for row in batch]
+        binaries = [index for index, value in enumerate(batch[0]) if type(value) == bytes]
+        if binaries:
+            batch = [self.to_hex(row, binaries) for row in batch]
+        buffer = StringIO()
+        # None is written as an unquoted empty value, which COPY loads as NULL,
+        # the generated strings are never empty
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        quote = self.connection.ops.quote_name
+        with self.connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {quote(table)} ({", ".join(map(quote, columns))}) '
+                'FROM STDIN WITH (FORMAT csv)', buffer
+            )
+
+    def insert(self, table, columns, batch):
+        quote = self.connection.ops.quote_name
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {quote(table)} ({", ".join(map(quote, columns))}) '
+                f'VALUES ({", ".join(["%s"] * len(columns))})', batch
+            )
+
+    @staticmethod
+    def to_arrays(row, arrays):
+        row = list(row)
+        for index in arrays:
+            row[index] = '{%s}' % ','.join(map(str, row[index]))
+        return row
+
+    @staticmethod
+    def to_hex(row, binaries):
+        # The text format of bytea
+        row = list(row)
+        for index in binaries:
+            row[index] = '\\x' + row[index].hex()
+        return row
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates seeded, deterministic synthetic data: specialities, universities, '
+        'educations, users with client and expert profiles, and tests linked to the '
+        'installed cities_light countries and cities.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--tests', type=int, default=10000)
+        parser.add_argument('--test-countries', type=int, default=3,
+                            help='Maximum number of countries linked to a test.')
+        parser.add_argument('--universities', type=int, default=1000)
+        parser.add_argument('--specialities', type=int, default=100)
+        parser.add_argument('--educations', type=int, default=2000)
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--experts', type=int, default=200)
+        parser.add_argument('--password', default='rozumity',
+                            help='Password of all the generated users.')
+        parser.add_argument('--email-domain', default='example.com')
+        parser.add_argument('--batch-size', type=int, default=50000)
+        parser.add_argument('--no-copy', action='store_false', dest='copy',
+                            help='Use INSERT statements instead of COPY.')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        self.using = options['database']
+        self.seed = options['seed']
+        self.loader = Loader(connection, options['batch_size'], options['copy'])
+        # The default ordering by name has ties, the seed needs a stable order
+        self.cities = list(City.objects.using(self.using).order_by('id').values_list(
+            'id', 'region_id', 'country_id'
+        ))
+        self.countries = list(
+            Country.objects.using(self.using).order_by('id').values_list('id', flat=True)
+        )
+        if not self.cities or not self.countries:
+            raise CommandError('Please load the cities_light data first (cities_light).')
+        self.city_names = dict(City.objects.using(self.using).values_list('id', 'name'))
+        models = [Speciality, University, Education, User, AbstractProfile, Test]
+        with transaction.atomic(using=self.using):
+            self.generate_specialities(options['specialities'])
+            self.generate_universities(options['universities'])
+            self.generate_educations(options['educations'])
+            self.generate_users(options)
+            self.generate_tests(options['tests'], options['test_countries'])
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(sql)
+
+    def random(self, name):
+        # Every kind of object has its own stream, so the options don't affect each other
+        return Random(f'{self.seed}:{name}')
+
+    def get_ids(self, model, count):
+        start = (model.objects.using(self.using).aggregate(Max('id'))['id__max'] or 0) + 1
+        return range(start, start + count)
+
+    def load(self, model, columns, rows, label=None):
+        started = perf_counter()
+        count = self.loader.load(model, columns, rows)
+        self.stdout.write(
+            f'{label or model._meta.verbose_name_plural}: {count} rows '
+            f'in {perf_counter() - started:.1f} s'
+        )
+
+    def generate_specialities(self, count):
+        random = self.random('specialities')
+        path = Path(apps.get_app_config('accomplishments').path)
+        with open(path / 'fixtures' / 'specialities_of_ukraine_en.csv',
+                  encoding='utf-8') as file:
+            titles = [row[1] for row in csv.reader(file)]
+        self.specialities = self.get_ids(Speciality, count)
+
+        def rows():
+            for index, id in enumerate(self.specialities):
+                title = f'{random.choice(SPECIALITY_KINDS)}{random.choice(titles)}'[:128]
+                yield id, title, get_sort_key(title), 100 + index % 32000
+        self.load(Speciality, ['id', 'title', 'title_key', 'code_ua'], rows())
+
+    def generate_universities(self, count):
+        random = self.random('universities')
+        self.universities = self.get_ids(University, count)
+
+        def rows():
+            for id in self.universities:
+                city_id, _, country_id = random.choice(self.cities)
+                title = f'{self.city_names[city_id]} {random.choice(UNIVERSITY_KINDS)}'[:128]
+                yield id, title, get_sort_key(title), country_id
+        self.load(University, ['id', 'title', 'title_key', 'country_id'], rows())
+
+    def generate_educations(self, count):
+        random = self.random('educations')
+        self.educations = self.get_ids(Education, count)
+        specialities = self.specialities or [None]
+
+        def rows():
+            for id in self.educations:
+                date_start = date(1980, 9, 1) + timedelta(days=random.randrange(40 * 365))
+                date_end = date_start + timedelta(days=365 * random.randint(1, 6))
+                yield (id, random.choice(self.universities), random.randrange(6),
+                       random.choice(specialities), date_start, date_end)
+        if count and not self.universities:
+            raise CommandError('Educations need at least one university.')
+        self.load(Education, [
+            'id', 'university_id', 'university_degree', 'speciality_id',
+            'date_start', 'date_end'
+        ], rows())
+
+    def generate_users(self, options):
+        random = self.random('users')
+        password = make_password(options['password'])
+        domain = options['email_domain']
+        clients, experts = options['clients'], options['experts']
+        users = self.get_ids(User, clients + experts)
+        date_joined = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        self.load(User, [
+            'id', 'password', 'is_superuser', 'email', 'is_staff', 'is_client',
+            'is_expert', 'is_active', 'date_joined'
+        ], (
+            (id, password, False, f'user{id}@{domain}', False, index < clients,
+             index >= clients, True,
+             date_joined + timedelta(minutes=random.randrange(1000000)))
+            for index, id in enumerate(users)
+        ))
+        # The profiles are rows of the parent table and of the table of their kind
+        profiles = self.get_ids(AbstractProfile, clients + experts)
+        random = self.random('profiles')
+
+        def rows():
+            for id, user_id in zip(profiles, users):
+                city_id, region_id, country_id = random.choice(self.cities)
+                yield (id, user_id, random.choice(FIRST_NAMES), random.choice(LAST_NAMES),
+                       [random.randrange(6)], country_id, region_id, city_id,
+                       date(1950, 1, 1) + timedelta(days=random.randrange(50 * 365)))
+        self.load(AbstractProfile, [
+            'id', 'user_id', 'first_name', 'last_name', 'gender',
+            'country_id', 'region_id', 'city_id', 'date_birth'
+        ], rows(), label='profiles')
+        self.load(ClientProfile, ['abstractprofile_ptr_id'],
+                  ((id,) for id in profiles[:clients]))
+        experts = profiles[clients:]
+        self.load(ExpertProfile, ['abstractprofile_ptr_id'], ((id,) for id in experts))
+        random = self.random('expert educations')
+        through = ExpertProfile.education.through
+        self.load(through, ['expertprofile_id', 'education_id'], (
+            (expert, education) for expert in experts
+            for education in random.sample(self.educations, min(
+                len(self.educations), random.randint(1, 3)
+            ))
+        ), label='expert educations')
+
+    def generate_tests(self, count, max_countries):
+        random = self.random('tests')
+        tests = self.get_ids(Test, count)
+
+        def rows():
+            for id in tests:
+                city_id = random.choice(self.cities)[0] if random.random() < 0.9 else None
+                title = f'{random.choice(TEST_KINDS)} test {id}'
+                yield id, title, get_sort_key(title), city_id
+        self.load(Test, ['id', 'title', 'title_key', 'city_id'], rows())
+        random = self.random('test countries')
+        through = Test.country.through
+        self.load(through, ['test_id', 'country_id'], (
+            (test, country) for test in tests
+            for country in random.sample(self.countries, min(
+                len(self.countries), random.randint(0, max_countries)
+            ))
+        ), label='test countries')
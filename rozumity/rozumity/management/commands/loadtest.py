@@ -0,0 +1,60 @@
+import asyncio
+import json
+from contextlib import redirect_stdout
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from rozumity.loadtest import LoadTest, Scenario, VirtualClient
+
+
+class Command(BaseCommand):
+    help = 'Runs a load test scenario against rozumity.asgi.application in-process.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', help='Path to a JSON scenario file.')
+        parser.add_argument('--user', help='Email of the user the clients log in as.')
+        parser.add_argument('--clients', type=int)
+        parser.add_argument('--requests', type=int)
+        parser.add_argument('--duration', type=float, help='Seconds, instead of --requests.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        from rozumity.asgi import application
+        try:
+            scenario = Scenario.from_file(options['scenario'])
+            ids = scenario.load_ids()
+        except (OSError, ValueError, TypeError, LookupError) as e:
+            raise CommandError(f'Invalid scenario: {e}')
+        for name in ('clients', 'requests', 'duration', 'user'):
+            if options[name] is not None:
+                setattr(scenario, name, options[name])
+        if not scenario.user:
+            raise CommandError('Please provide the email of a user with --user.')
+        try:
+            user = get_user_model().objects.get(email=scenario.user)
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'The user {scenario.user} does not exist.')
+        clients = [VirtualClient.login(user) for _ in range(scenario.clients)]
+        try:
+            # The views print their timings
+            with redirect_stdout(StringIO()):
+                report = asyncio.run(
+                    LoadTest(application, scenario, clients, ids, options['seed']).run()
+                )
+        finally:
+            VirtualClient.logout(clients)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f'{scenario.clients} clients, {report["elapsed"]} s')
+        self.stdout.write(
+            f'{"step":<24}{"requests":>9}{"req/s":>9}{"p50 ms":>9}{"p90 ms":>9}'
+            f'{"p99 ms":>9}{"errors":>8}{"queries":>9}'
+        )
+        for name, row in [*report['steps'].items(), ('total', report['total'])]:
+            self.stdout.write(
+                f'{name:<24}{row["requests"]:>9}{row["throughput"]:>9}{row["p50"]:>9}'
+                f'{row["p90"]:>9}{row["p99"]:>9}{row["error_rate"]:>8.2%}{row["queries"]:>9}'
+            )
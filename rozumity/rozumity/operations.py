@@ -0,0 +1,456 @@
+from django.db import IntegrityError, router, transaction
+from django.db.models import Q
+from asgiref.sync import sync_to_async
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
+
+from rozumity.collation import with_sort_keys
+from rozumity.parsers import JSONAPIParser
+from rozumity.serializers import JSONAPIObjectIdSerializer
+from rozumity.viewsets import AsyncAPIView
+
+reverse = sync_to_async(reverse)
+
+ATOMIC_EXTENSION = 'https://jsonapi.org/ext/atomic'
+
+
+class OperationError(Exception):
+    def __init__(self, index=None, detail='', status=400, errors=None):
+        if errors is None:
+            pointer = '/atomic:operations'
+            if index is not None:
+                pointer = f'{pointer}/{index}'
+            errors = [{'status': status, 'source': {'pointer': pointer},
+                       'detail': detail}]
+        statuses = {error['status'] for error in errors}
+        self.status = statuses.pop() if len(statuses) == 1 else 400
+        self.errors = errors
+        super().__init__(errors)
+
+
+class Lid:
+    __slots__ = ('type', 'value')
+
+    def __init__(self, type, value):
+        self.type = type
+        self.value = value
+
+    @property
+    def key(self):
+        return (self.type, self.value)
+
+
+class Resource:
+    """
+    A resource type which can be changed through the operations endpoint.
+    Relationships are taken from the serializer and matched against
+    the model fields, so the model and the serializer must agree.
+    `on_change(action, ids, using)` is called in the transaction with the
+    resources created or updated by the bulk writes, which send no signals.
+    """
+    def __init__(self, queryset, serializer_class, view_name, on_change=None):
+        self.queryset = queryset
+        self.model = queryset.model
+        self.serializer_class = serializer_class
+        self.view_name = view_name
+        self.on_change = on_change
+        self.to_one, self.to_many = {}, {}
+        relationships = serializer_class.Relationships._declared_fields
+        for name in relationships.keys():
+            field = self.model._meta.get_field(name)
+            data = self.to_many if field.many_to_many else self.to_one
+            data[name] = field
+
+
+class Operation:
+    __slots__ = ('index', 'op', 'resource', 'id', 'lid',
+                 'relationship', 'attributes', 'linkage')
+
+    def __init__(self, index, op, resource, id=None, lid=None,
+                 relationship=None, attributes=None, linkage=None):
+        self.index = index
+        self.op = op
+        self.resource = resource
+        self.id = id
+        self.lid = lid
+        self.relationship = relationship
+        self.attributes = attributes or {}
+        self.linkage = linkage or {}
+
+    @property
+    def kind(self):
+        if self.relationship is not None:
+            return f'{self.op}_members'
+        return self.op
+
+    @property
+    def lids(self):
+        values = [self.id]
+        for val in self.linkage.values():
+            values.extend(val if type(val) == list else [val])
+        return {val.key for val in values if isinstance(val, Lid)}
+
+
+class AtomicOperations:
+    """
+    Executes a JSON:API Atomic Operations document. All operations are
+    validated before the first query, then consecutive operations of
+    the same kind and type are executed as one bulk statement inside
+    a single transaction.
+    """
+    max_operations = 1000
+
+    def __init__(self, resources, request=None):
+        self.resources = resources
+        self.request = request
+        self.lids = {}
+
+    async def parse(self, document):
+        try:
+            operations = document['atomic:operations']
+        except (KeyError, TypeError):
+            raise OperationError(
+                detail="The document must contain the 'atomic:operations' member."
+            )
+        if type(operations) != list or not operations:
+            raise OperationError(detail='Please provide a list of operations.')
+        if len(operations) > self.max_operations:
+            raise OperationError(
+                status=413,
+                detail=f'A request may contain up to {self.max_operations} operations.'
+            )
+        parsed, errors, declared = [], [], set()
+        for index, operation in enumerate(operations):
+            try:
+                parsed.append(await self.parse_operation(index, operation, declared))
+            except OperationError as exc:
+                errors.extend(exc.errors)
+        if errors:
+            raise OperationError(errors=errors)
+        return parsed
+
+    async def parse_operation(self, index, operation, declared):
+        if type(operation) != dict:
+            raise OperationError(index, 'An operation must be an object.')
+        op, ref, data = operation.get('op'), operation.get('ref'), operation.get('data')
+        if op not in ('add', 'update', 'remove'):
+            raise OperationError(index, f"Unknown operation code '{op}'.")
+        target = ref if ref is not None else data
+        if type(target) != dict:
+            raise OperationError(
+                index, "An operation requires a 'ref' or a resource object in 'data'."
+            )
+        resource = self.resources.get(target.get('type'))
+        if resource is None:
+            raise OperationError(
+                index, f"The resource type '{target.get('type')}' is not supported."
+            )
+        relationship = ref.get('relationship') if ref is not None else None
+        if relationship is not None:
+            linkage = await self.validate_linkage(index, resource, relationship, data, declared)
+            obj_id = await self.get_identifier(index, ref, declared)
+            if relationship in resource.to_many:
+                return Operation(index, op, resource, obj_id, relationship=relationship,
+                                 linkage={relationship: linkage})
+            if op != 'update':
+                raise OperationError(
+                    index, 'Only to-many relationships accept add and remove operations.'
+                )
+            return Operation(index, op, resource, obj_id, linkage={relationship: linkage})
+        if op == 'remove':
+            if ref is None:
+                raise OperationError(index, "A remove operation requires a 'ref'.")
+            return Operation(index, op, resource, await self.get_identifier(index, ref, declared))
+        if type(data) != dict:
+            raise OperationError(index, "The 'data' member must be a resource object.")
+        relationships = data.get('relationships', {})
+        if type(relationships) != dict:
+            raise OperationError(index, "The 'relationships' member must be an object.")
+        linkage = {}
+        for name, val in relationships.items():
+            if type(val) != dict or 'data' not in val:
+                raise OperationError(index, f"The relationship '{name}' must contain 'data'.")
+            linkage[name] = await self.validate_linkage(
+                index, resource, name, val['data'], declared
+            )
+        if op == 'add':
+            attributes = await self.validate_resource(index, resource, data)
+            lid = data.get('lid')
+            if lid is not None:
+                if (data['type'], lid) in declared:
+                    raise OperationError(index, f"The local identifier '{lid}' is not unique.")
+                declared.add((data['type'], lid))
+            return Operation(index, op, resource, lid=lid,
+                             attributes=attributes, linkage=linkage)
+        obj_id = await self.get_identifier(index, target, declared)
+        attributes = await self.validate_attributes(index, resource, data.get('attributes', {}))
+        return Operation(index, op, resource, obj_id,
+                         attributes=attributes, linkage=linkage)
+
+    async def get_identifier(self, index, ref, declared):
+        if 'id' in ref:
+            try:
+                return int(ref['id'])
+            except (TypeError, ValueError):
+                raise OperationError(index, 'The resource identifier must be an integer.')
+        lid = ref.get('lid')
+        if lid is None:
+            raise OperationError(index, "A resource identifier requires 'id' or 'lid'.")
+        if (ref['type'], lid) not in declared:
+            raise OperationError(index, f"The local identifier '{lid}' was not declared.")
+        return Lid(ref['type'], lid)
+
+    async def validate_resource(self, index, resource, data):
+        relationships = {}
+        for name, val in data.get('relationships', {}).items():
+            linkage = val['data']
+            if type(linkage) == dict and 'lid' in linkage:
+                linkage = {'type': linkage.get('type'), 'id': 0}
+            relationships[name] = {'data': linkage}
+        serializer = resource.serializer_class(data={'data': {
+            **data, 'relationships': relationships
+        }})
+        if not await serializer.is_valid():
+            raise OperationError(errors=[{
+                'status': 400,
+                'source': {'pointer': '/atomic:operations/{}/data/{}'.format(
+                    index, key.replace('.', '/')
+                )},
+                'detail': f"The JSON field '{key}' caused an exception: {val[0].lower()}"
+            } for key, val in serializer._errors.items()])
+        attributes = await serializer.validated_data
+        return {key: val for key, val in attributes.items() if key != 'relationships'}
+
+    async def validate_attributes(self, index, resource, attributes):
+        if type(attributes) != dict:
+            raise OperationError(index, "The 'attributes' member must be an object.")
+        fields = resource.serializer_class.Attributes._declared_fields
+        validated, errors = {}, []
+        for key, val in attributes.items():
+            field = fields.get(key)
+            if field is None or field.read_only:
+                errors.append(f"The attribute '{key}' can not be changed.")
+                continue
+            try:
+                validated[key] = field.run_validation(val)
+            except ValidationError as exc:
+                errors.append(f"The JSON field '{key}' caused an exception: "
+                              f"{str(exc.detail[0]).lower()}")
+        if errors:
+            raise OperationError(errors=[{
+                'status': 400,
+                'source': {'pointer': f'/atomic:operations/{index}/data/attributes'},
+                'detail': detail
+            } for detail in errors])
+        return validated
+
+    async def validate_linkage(self, index, resource, name, linkage, declared):
+        if name in resource.to_many:
+            field = resource.to_many[name]
+            if type(linkage) != list:
+                raise OperationError(index, f"The relationship '{name}' expects a list.")
+            return [await self.validate_identifier(index, field, obj, declared)
+                    for obj in linkage]
+        field = resource.to_one.get(name)
+        if field is None:
+            raise OperationError(index, f"Unknown relationship '{name}'.")
+        if linkage is None:
+            if not field.null:
+                raise OperationError(index, f"The relationship '{name}' may not be null.")
+            return None
+        return await self.validate_identifier(index, field, linkage, declared)
+
+    async def validate_identifier(self, index, field, identifier, declared):
+        obj_type = field.related_model.__name__.lower()
+        if type(identifier) != dict or identifier.get('type') != obj_type:
+            raise OperationError(index, f"A '{obj_type}' resource identifier is expected.")
+        if 'id' not in identifier and 'lid' in identifier:
+            return await self.get_identifier(index, identifier, declared)
+        serializer = JSONAPIObjectIdSerializer(data=identifier)
+        if not await serializer.is_valid():
+            raise OperationError(index, 'The resource identifier must be an integer.')
+        return (await serializer.validated_data)['id']
+
+    @staticmethod
+    def group(operations):
+        groups, lids = [], set()
+        for operation in operations:
+            if (groups and groups[-1][0].kind == operation.kind
+                    and groups[-1][0].resource is operation.resource
+                    and not operation.lids & lids):
+                groups[-1].append(operation)
+            else:
+                groups.append([operation])
+                lids = set()
+            if operation.lid is not None:
+                lids.add((operation.resource.model.__name__.lower(), operation.lid))
+        return groups
+
+    def resolve(self, index, value):
+        if not isinstance(value, Lid):
+            return value
+        try:
+            return self.lids[value.key]
+        except KeyError:
+            raise OperationError(index, f"The local identifier '{value.value}' was not resolved.")
+
+    async def execute(self, operations):
+        try:
+            await sync_to_async(self._execute)(self.group(operations))
+        except IntegrityError as exc:
+            raise OperationError(status=409, detail=str(exc).splitlines()[0])
+
+    def _execute(self, groups):
+        with transaction.atomic():
+            for group in groups:
+                kind = group[0].kind
+                getattr(self, f'execute_{kind}')(group)
+                resource = group[0].resource
+                # A removal is published by the delete signals
+                if resource.on_change is not None and kind != 'remove':
+                    resource.on_change(
+                        'created' if kind == 'add' else 'updated',
+                        list(dict.fromkeys(operation.id for operation in group)),
+                        router.db_for_write(resource.model)
+                    )
+
+    def get_existing(self, group):
+        model = group[0].resource.model
+        ids = [self.resolve(operation.index, operation.id) for operation in group]
+        existing = set(model.objects.filter(id__in=ids).values_list('id', flat=True))
+        for operation, obj_id in zip(group, ids):
+            if obj_id not in existing:
+                raise OperationError(operation.index, 'The resource does not exist.', 404)
+            operation.id = obj_id
+        return ids
+
+    def get_foreign_keys(self, operation):
+        return {
+            field.attname: self.resolve(operation.index, operation.linkage[name])
+            for name, field in operation.resource.to_one.items()
+            if name in operation.linkage
+        }
+
+    def execute_add(self, group):
+        resource = group[0].resource
+        objects = resource.model.objects.bulk_create([
+            resource.model(**operation.attributes, **self.get_foreign_keys(operation))
+            for operation in group
+        ])
+        for operation, obj in zip(group, objects):
+            operation.id = obj.id
+            if operation.lid is not None:
+                self.lids[(resource.model.__name__.lower(), operation.lid)] = obj.id
+        self.set_members(group, clear=False)
+
+    def execute_update(self, group):
+        model = group[0].resource.model
+        self.get_existing(group)
+        buckets = {}
+        for operation in group:
+            values = with_sort_keys(
+                model, {**operation.attributes, **self.get_foreign_keys(operation)}
+            )
+            if values:
+                buckets.setdefault(tuple(sorted(values)), []).append(
+                    model(id=operation.id, **values)
+                )
+        for fields, objects in buckets.items():
+            model.objects.bulk_update(objects, fields)
+        self.set_members(group, clear=True)
+
+    def execute_remove(self, group):
+        ids = self.get_existing(group)
+        group[0].resource.model.objects.filter(id__in=ids).delete()
+
+    def execute_add_members(self, group):
+        self.get_existing(group)
+        self.set_members(group, clear=False)
+
+    def execute_update_members(self, group):
+        self.get_existing(group)
+        self.set_members(group, clear=True)
+
+    def execute_remove_members(self, group):
+        self.get_existing(group)
+        for name, field in group[0].resource.to_many.items():
+            through, source, target = self.get_through(field)
+            query = Q()
+            for operation in group:
+                if name in operation.linkage:
+                    query |= Q(**{source: operation.id, f'{target}__in': [
+                        self.resolve(operation.index, val)
+                        for val in operation.linkage[name]
+                    ]})
+            if query:
+                through.objects.filter(query).delete()
+
+    @staticmethod
+    def get_through(field):
+        return (field.remote_field.through,
+                field.m2m_field_name() + '_id',
+                field.m2m_reverse_field_name() + '_id')
+
+    def set_members(self, group, clear):
+        for name, field in group[0].resource.to_many.items():
+            operations = [operation for operation in group if name in operation.linkage]
+            if not operations:
+                continue
+            through, source, target = self.get_through(field)
+            if clear:
+                through.objects.filter(**{
+                    f'{source}__in': [operation.id for operation in operations]
+                }).delete()
+            through.objects.bulk_create([
+                through(**{source: operation.id,
+                           target: self.resolve(operation.index, val)})
+                for operation in operations for val in operation.linkage[name]
+            ], ignore_conflicts=True)
+
+    async def results(self, operations):
+        objects = {}
+        for operation in operations:
+            if operation.kind in ('add', 'update'):
+                objects.setdefault(operation.resource, set()).add(operation.id)
+        for resource, ids in objects.items():
+            objects[resource] = await resource.queryset.ain_bulk(list(ids))
+        results = []
+        for operation in operations:
+            obj = objects.get(operation.resource, {}).get(operation.id)
+            if operation.kind not in ('add', 'update') or obj is None:
+                results.append({})
+                continue
+            serializer = operation.resource.serializer_class(
+                obj, context={'request': self.request}
+            )
+            setattr(serializer, serializer.url_field_name, await reverse(
+                operation.resource.view_name, request=self.request
+            ))
+            data = await serializer.data
+            results.append({'data': data['data']})
+        return results
+
+
+class AtomicOperationsView(AsyncAPIView):
+    resources = {}
+    parser_classes = [JSONAPIParser, JSONParser]
+
+    async def post(self, request):
+        operations = AtomicOperations(self.resources, request)
+        try:
+            parsed = await operations.parse(request.data)
+            await operations.execute(parsed)
+        except OperationError as exc:
+            return Response(status=exc.status, data={
+                'jsonapi': {'version': '1.1', 'ext': [ATOMIC_EXTENSION]},
+                'errors': exc.errors
+            })
+        results = await operations.results(parsed)
+        if not any(results):
+            return Response(status=204)
+        return Response(data={
+            'jsonapi': {'version': '1.1', 'ext': [ATOMIC_EXTENSION]},
+            'atomic:results': results
+        })
@@ -1,4 +1,5 @@
 from contextlib import suppress
+from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from django.contrib.sites.shortcuts import get_current_site
 from rest_framework.settings import api_settings
@@ -18,7 +19,7 @@ class LimitOffsetAsyncPagination:
     limit_query_description = _('Number of results to return per page.')
     offset_query_param = 'page[offset]'
     offset_query_description = _('The initial index from which to return the results.')
-    max_limit = None
+    max_limit = getattr(settings, 'PAGE_MAX_LIMIT', 1000)
     current_site = None
 
     @staticmethod
@@ -186,7 +187,3 @@ class LimitOffsetAsyncPagination:
             return await queryset.acount()
         except (AttributeError, TypeError):
             return len(queryset)
-
-
-if __name__ != '__main__':
-    LimitOffsetAsyncPagination = sync_to_async(LimitOffsetAsyncPagination).func()
@@ -0,0 +1,23 @@
+import json
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+from rozumity import compact
+
+
+class JSONAPIParser(JSONParser):
+    media_type = 'application/vnd.api+json'
+
+
+class CompactJSONAPIParser(BaseParser):
+    """Parses the documents of the compact encoding, see `rozumity.compact`."""
+    media_type = compact.MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            return compact.decode(json.loads(stream.read().decode(encoding)))
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError,
+                RecursionError) as exc:
+            raise ParseError(f'Compact JSON parse error - {exc}')
@@ -0,0 +1,63 @@
+import csv
+import json
+from io import StringIO
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils import encoders
+
+from rozumity import compact
+
+
+class CompactJSONAPIRenderer(BaseRenderer):
+    """
+    Renders a document in the compact encoding, see `rozumity.compact`,
+    for the callers accepting `application/vnd.rozumity.compact+json`.
+    """
+    media_type = compact.MEDIA_TYPE
+    format = 'compact'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(
+            compact.encode(data), cls=encoders.JSONEncoder, ensure_ascii=False,
+            allow_nan=False, separators=(',', ':')
+        ).encode()
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    The media type of the NDJSON exports, a document rendered here is an
+    error of the export on a single line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(
+            data, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(',', ':')
+        ).encode() + b'\n'
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    The media type of the CSV exports, a document rendered here is an
+    error of the export as rows of status, pointer and detail.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['status', 'pointer', 'detail'])
+        for error in data.get('errors', []) if isinstance(data, dict) else []:
+            writer.writerow([error.get('status', error.get('code')),
+                             error.get('source', {}).get('pointer'), error.get('detail')])
+        return output.getvalue().encode()
@@ -0,0 +1,94 @@
+from asyncio import iscoroutinefunction
+from contextvars import ContextVar
+from random import choice
+from time import time
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.decorators import sync_and_async_middleware
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_COOKIE = 'primary_until'
+PIN_HEADER = 'X-Primary-Until'
+
+# The database alias the reads of the current request go to
+read_database = ContextVar('read_database', default=None)
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def is_pinned(request):
+    """
+    A client that has written recently reads from the primary until the
+    time it got in the cookie, or echoes back in the header.
+    """
+    value = request.COOKIES.get(PIN_COOKIE) or request.headers.get(PIN_HEADER)
+    try:
+        return float(value) > time()
+    except (TypeError, ValueError):
+        return False
+
+
+def get_read_database(request):
+    replicas = get_replicas()
+    if not replicas or request.method not in SAFE_METHODS or is_pinned(request):
+        return None
+    return choice(replicas)
+
+
+def pin_to_primary(request, response):
+    if not get_replicas() or request.method in SAFE_METHODS:
+        return response
+    seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+    until = str(int(time() + seconds))
+    response.set_cookie(PIN_COOKIE, until, max_age=seconds,
+                        httponly=True, samesite='Lax')
+    response[PIN_HEADER] = until
+    return response
+
+
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    """
+    Sends the reads of safe requests to a replica, unsafe requests and the
+    requests of recently writing clients stay on the primary.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = read_database.set(get_read_database(request))
+            try:
+                response = await get_response(request)
+            finally:
+                read_database.reset(token)
+            return pin_to_primary(request, response)
+    else:
+        def middleware(request):
+            token = read_database.set(get_read_database(request))
+            try:
+                response = get_response(request)
+            finally:
+                read_database.reset(token)
+            return pin_to_primary(request, response)
+    return middleware
+
+
+class ReplicaRouter:
+    """
+    Reads go to the replica chosen for the request, if any,
+    writes and migrations always go to the primary.
+    """
+    def db_for_read(self, model, **hints):
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db in get_replicas() else None
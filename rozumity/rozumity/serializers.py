@@ -1,22 +1,36 @@
 import re
-from asyncio import ensure_future, iscoroutinefunction
+from asyncio import ensure_future, gather, iscoroutinefunction
 from copy import deepcopy
 from functools import wraps
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 from django.db.models.manager import BaseManager
+from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured, SynchronousOnlyOperation
 from django.core.exceptions import ValidationError as DjangoValidationError
 from asgiref.sync import sync_to_async
 from rest_framework import serializers
 from rest_framework.reverse import reverse
 from rest_framework.exceptions import ValidationError
+from rest_framework.relations import ManyRelatedField, RelatedField
+from rest_framework.validators import (
+    BaseUniqueForValidator, UniqueTogetherValidator, UniqueValidator
+)
 from rest_framework.utils.serializer_helpers import (
     BoundField, JSONBoundField, NestedBoundField, ReturnDict
 )
 from rest_framework.fields import (JSONField, Field, SkipField, get_error_detail)
 
+from rozumity.documents import (
+    Relationship, RelationshipLinks, Resource, ResourceIdentifier, ResourceLinks,
+    get_links_template, get_type
+)
+
 reverse = sync_to_async(reverse)
 deepcopy_async = sync_to_async(deepcopy)
 
+LINK_PLACEHOLDER = 987654321
+
 
 async def get_field_info(obj):
     fields, forward_relations = {}, {}
@@ -26,6 +40,61 @@ async def get_field_info(obj):
     return {'fields': fields, 'forward_relations': forward_relations}
 
 
+async def gather_limited(coroutines, limit):
+    """
+    Awaits the coroutines concurrently, at most `limit` at a time,
+    and returns their results in the given order. A nested call is given
+    a limit of 1 and runs in the slot of its caller, one coroutine after
+    the other, so the outermost limit bounds the whole nesting.
+    """
+    coroutines = list(coroutines)
+    if limit <= 1 or len(coroutines) <= 1:
+        return [await coroutine for coroutine in coroutines]
+    results = [None] * len(coroutines)
+    pending = iter(enumerate(coroutines))
+
+    # `limit` workers instead of a task per coroutine
+    async def work():
+        for index, coroutine in pending:
+            results[index] = await coroutine
+    try:
+        await gather(*[work() for _ in range(min(limit, len(coroutines)))])
+    finally:
+        # Those left by a failure are never awaited
+        for _, coroutine in pending:
+            coroutine.close()
+    return results
+
+
+async def get_limited_objects(instance, key, manager, limit):
+    # Prefetched by JSONAPISerializer.setup_eager_loading
+    objects = getattr(instance, f'{key}_limited', None)
+    if objects is None:
+        objects = [obj async for obj in (await sync_to_async(manager.all)())[:limit]]
+    return objects[:limit]
+
+
+async def get_link_template(view_name, request=None):
+    url = await reverse(view_name, args=[LINK_PLACEHOLDER], request=request)
+    url = url.replace('{', '{{').replace('}', '}}')
+    return url.replace(str(LINK_PLACEHOLDER), '{}')
+
+
+async def get_resource_object(obj, link_template=None):
+    attributes, relationships = {}, {}
+    for field in obj.__class__._meta.fields:
+        if field.primary_key:
+            continue
+        elif not field.remote_field:
+            attributes[field.name] = getattr(obj, field.name)
+        elif getattr(obj, field.attname) is not None:
+            relationships[field.name] = Relationship(ResourceIdentifier(
+                get_type(field.related_model), getattr(obj, field.attname)
+            ))
+    links = ResourceLinks(link_template, obj.id) if link_template else None
+    return Resource(get_type(obj.__class__), obj.id, attributes, relationships, links)
+
+
 class JSONAPISerializerRepr:
     def __init__(self, serializer, indent=1, force_many=None):
         self._serializer = serializer
@@ -95,6 +164,82 @@ class JSONAPISerializerRepr:
         return ret
 
 
+def io_bound(function):
+    """
+    Marks a validator or a sync `validate_<name>` method as doing I/O,
+    so the validation plan runs it in a worker thread.
+    """
+    function.io_bound = True
+    return function
+
+
+def is_io_bound(obj):
+    if getattr(obj, 'io_bound', False):
+        return True
+    if isinstance(obj, (RelatedField, ManyRelatedField, UniqueValidator,
+                        UniqueTogetherValidator, BaseUniqueForValidator)):
+        return True
+    return any(is_io_bound(validator) for validator in getattr(obj, 'validators', ()))
+
+
+class ValidationStep:
+    __slots__ = ('name', 'field', 'run', 'run_is_async', 'validate', 'validate_is_async')
+
+    def __init__(self, name, field, validate=None):
+        self.name = name
+        self.field = field
+        if isinstance(field, JSONAPIBaseSerializer):
+            # Nested serializers validate with their own plan
+            self.run, self.run_is_async = field.to_internal_value, True
+        elif iscoroutinefunction(field.run_validation):
+            self.run, self.run_is_async = field.run_validation, True
+        elif is_io_bound(field):
+            self.run, self.run_is_async = sync_to_async(field.run_validation), True
+        else:
+            self.run, self.run_is_async = field.run_validation, False
+        self.validate, self.validate_is_async = validate, True
+        if validate is not None and not iscoroutinefunction(validate):
+            if is_io_bound(validate):
+                self.validate = sync_to_async(validate)
+            else:
+                self.validate_is_async = False
+
+
+class ValidationPlan:
+    """
+    The validation of a serializer class resolved once: the writable fields
+    with their runners and the Meta validators with pre-split names.
+    Pure Python fields and validators run inline on the event loop,
+    only the I/O-bound ones are offloaded to a worker thread.
+    """
+    __slots__ = ('steps', 'validators')
+
+    def __init__(self, serializer_class, validators):
+        meta = getattr(serializer_class, 'Meta', None)
+        read_only_fields = getattr(meta, 'read_only_fields', [])
+        self.steps = []
+        for name, field in deepcopy(serializer_class._declared_fields).items():
+            if hasattr(field, 'child'):
+                field.child.required, field = field.required, field.child
+                if serializer_class.__name__ == 'Relationships':
+                    field.read_only = True
+            if field.read_only or name in read_only_fields:
+                continue
+            self.steps.append(ValidationStep(
+                name, field, getattr(serializer_class, 'validate_' + name, None)
+            ))
+        self.validators = []
+        for field_name, validator in validators.items():
+            if is_io_bound(validator):
+                function = sync_to_async(validator)
+            else:
+                function = validator
+            self.validators.append((
+                field_name, field_name.split('.'), function, is_io_bound(validator),
+                getattr(validator, 'requires_context', False)
+            ))
+
+
 class NotSelectedForeignKey(ImproperlyConfigured):
     def __init__(self, message=None):
         self.message = (
@@ -110,6 +255,7 @@ class NotSelectedForeignKey(ImproperlyConfigured):
 # TODO: maybe add the Field class to the bases and use the basic metaclass
 class JSONAPIBaseSerializer:
     _creation_counter = 0
+    concurrency_limit = getattr(settings, 'JSONAPI_CONCURRENCY_LIMIT', 4)
     source = None
     initial = None
     field_name = ''
@@ -228,10 +374,9 @@ class JSONAPIBaseSerializer:
     
     async def run_validators(self, value):
         errors = {}
-        validators = await self.validators
-        for field_name, validator in validators.items():
-            subfield = field_name.split('.')
-            if len(subfield) > 1 and field_name.startswith(subfield[0]):
+        plan = await self.get_validation_plan()
+        for field_name, subfield, validator, is_async, requires_context in plan.validators:
+            if len(subfield) > 1:
                 value_field = value.get(subfield[0]).get(subfield[-1])
             else:
                 try:
@@ -242,10 +387,11 @@ class JSONAPIBaseSerializer:
                         "to specify an 'attributes' or 'relationships' subfield."
                     ))
             try:
-                if getattr(validator, 'requires_context', False):
-                    validator(value_field, self)
+                args = (value_field, self) if requires_context else (value_field,)
+                if is_async:
+                    await validator(*args)
                 else:
-                    validator(value_field)
+                    validator(*args)
             except ValidationError as exc:
                 if isinstance(exc.detail, dict):
                     raise
@@ -310,38 +456,31 @@ class JSONAPIBaseSerializer:
             raise ValidationError(self._errors)
         return not bool(self._errors)
     
-    @staticmethod
-    async def _to_coroutine(function):
-        if not iscoroutinefunction(function):
-            function = sync_to_async(function)
-        return function
+    async def get_validation_plan(self):
+        plan = self.__class__.__dict__.get('_validation_plan')
+        if plan is None:
+            plan = ValidationPlan(self.__class__, await self.validators)
+            self.__class__._validation_plan = plan
+        return plan
     
     async def to_internal_value(self, data):
-        meta = getattr(self, 'Meta', None)
-        read_only_fields = getattr(meta, 'read_only_fields', [])
         ret = {}
         errors = {}
-        fields = await self.fields
-        for name, field in fields.items():
-            if hasattr(field, 'child'):
-                field.child.required, field = field.required, field.child
-                if self.__class__.__name__ == 'Relationships':
-                    field.read_only = True
-            if field.read_only or name in read_only_fields:
-                continue
-            value = await self.get_value(name, data)
+        plan = await self.get_validation_plan()
+        for step in plan.steps:
+            name, field = step.name, step.field
+            value = data.get(name)
             value = value.pop('data', value) if type(value) in [dict, list] else value
             value = [value] if type(value) != list else value
-            run_validation = await self._to_coroutine(field.run_validation)
-            validate_method = getattr(self, 'validate_' + name, None)
             for obj in value:
-                if hasattr(field, '_validated_data'):
-                    del field._validated_data
                 try:
-                    validated_value = await run_validation(obj)
-                    if validate_method is not None:
-                        validate_method_awaited = await self._to_coroutine(validate_method)
-                        validated_value = await validate_method_awaited(obj)
+                    validated_value = step.run(obj)
+                    if step.run_is_async:
+                        validated_value = await validated_value
+                    if step.validate is not None:
+                        validated_value = step.validate(self, obj)
+                        if step.validate_is_async:
+                            validated_value = await validated_value
                 except ValidationError as exc:
                     detail = exc.detail
                     if type(detail) == dict:
@@ -369,10 +508,8 @@ class JSONAPIBaseSerializer:
             return ret
     
     async def to_representation(self, instance):
-        fields = await self.fields
-        instance_map = {key: getattr(instance, key) for key in fields.keys()}
-        return {name: await self.get_value(name, instance_map) 
-                for name in fields.keys()}
+        # The declared fields are only read here, no need to copy them
+        return {name: getattr(instance, name) for name in self._declared_fields}
 
     @property
     async def _readable_fields(self):
@@ -477,28 +614,41 @@ class JSONAPIAttributesSerializer(JSONAPIBaseSerializer, metaclass=SerializerMet
 
 # TODO: create the ModelSerializer-like functionality with own coroutine
 class JSONAPIRelationsSerializer(JSONAPIBaseSerializer, metaclass=SerializerMetaclass):
-    async def to_representation(self, instance):
-        fields = await self.fields
-        data = {name: await self.get_value(
-            name, {key: getattr(instance, key) for key in fields.keys()}
-        ) for name in fields.keys()}
-        url = getattr(self, self.url_field_name, None)
-        for key, val in data.items():
-            field = fields[key]
-            if hasattr(val, 'all'):
-                data[key] = {'data': [await JSONAPIObjectIdSerializer(obj).data
-                                      async for obj in await sync_to_async(val.all)()]}
-                field, field.view_name = fields[key].child, fields[key].child.view_name
-            else:
-                data[key] = {'data': await JSONAPIObjectIdSerializer(val).data}
-            if url:
-                data[key][self.url_field_name] = {
-                    'self': f"{url}relationships/{key}/",
-                    'related': f"{url}{key}/"
-                }
-                if field.view_name:
-                    data[key][self.url_field_name]['included'] = field.view_name
-        return data
+    async def to_representation(self, instance, links=None, linkage_limit=None,
+                                concurrency_limit=None):
+        fields = self._declared_fields
+        results = await gather_limited([
+            self._get_linkage(instance, key, field, links, linkage_limit or {})
+            for key, field in fields.items()
+        ], concurrency_limit or self.concurrency_limit)
+        return dict(zip(fields.keys(), results))
+
+    async def _get_linkage(self, instance, key, field, links, linkage_limit):
+        val, meta = getattr(instance, key), None
+        if hasattr(val, 'all') and key in linkage_limit:
+            data, meta = await self._get_truncated_linkage(
+                instance, key, val, linkage_limit[key]
+            )
+            field = field.child
+        elif hasattr(val, 'all'):
+            data = [ResourceIdentifier.from_instance(obj)
+                    async for obj in await sync_to_async(val.all)()]
+            field = field.child
+        else:
+            data = ResourceIdentifier.from_instance(val)
+        if links is None:
+            return Relationship(data, meta=meta)
+        return Relationship(data, RelationshipLinks(links, key), meta, field.view_name)
+
+    @staticmethod
+    async def _get_truncated_linkage(instance, key, manager, limit):
+        objects = await get_limited_objects(instance, key, manager, limit)
+        # The count is annotated by JSONAPISerializer.setup_eager_loading
+        count = getattr(instance, f'{key}__count', None)
+        if count is None:
+            count = len(objects) if len(objects) < limit else await manager.acount()
+        return ([ResourceIdentifier.from_instance(obj) for obj in objects],
+                {'count': count})
 
 
 class JSONAPIManySerializer(JSONAPIBaseSerializer):
@@ -550,29 +700,35 @@ class JSONAPIManySerializer(JSONAPIBaseSerializer):
                     "Please provide a list of valid objects."
                     if data else error_message
                 ]})
-        validated_data = []
-        for obj_data in data:
-            obj_data = await self.child.run_validation({'data': obj_data})
-            errors = self.child._errors
-            if not errors:
-                validated_data.append(await self.child.validated_data)
-                del self.child._validated_data
-            else:
-                raise ValidationError(errors)
+        validated_data = [await self.child.to_internal_value({'data': obj_data})
+                          for obj_data in data]
         self._validated_data = validated_data
         return validated_data
     
     async def to_representation(self, iterable):
+        is_included_disabled = self._context.get('is_included_disabled', False)
+        cache = {}
+        
+        # The rows share the limit with what they resolve
+        async def represent(instance):
+            resource = await self.child.to_resource(instance, concurrency_limit=1)
+            obj_included = {}
+            if resource.links is not None:
+                await self.child._get_included(
+                    instance, resource.relationships, 
+                    obj_included, is_included_disabled, cache, concurrency_limit=1
+                )
+            return resource, obj_included
+        
+        results = await gather_limited(
+            [represent(instance) async for instance in iterable], 
+            self.child.concurrency_limit
+        )
         data, included = [], {}
-        async for instance in iterable:
-            obj_data = await self.child.__class__(
-                instance, context={**self._context, 'is_included_disabled': True}
-            ).data
-            data.append(obj_data['data'])
-            await self.child._get_included(
-                instance, obj_data.get('data').get('relationships'), 
-                included, self._context.get('is_included_disabled', False)
-            )
+        for obj_data, obj_included in results:
+            data.append(obj_data)
+            for key, val in obj_included.items():
+                included.setdefault(key, val)
         # Sort included
         # data['included'] = sorted(
         #    list(included.values()), 
@@ -599,6 +755,30 @@ class JSONAPISerializer(JSONAPIBaseSerializer, metaclass=SerializerMetaclass):
     class Meta:
         list_serializer_class = JSONAPIManySerializer
         read_only_fields = ('id')
+        linkage_limit = {}
+
+    # Shared by the links of all the resources the serializer represents
+    _links_template = None
+    
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """
+        Prefetches only the embedded part of the limited to-many relationships
+        and annotates their full size for the meta.count of the linkage.
+        The size is a correlated subquery, so the queryset is not grouped
+        and its count() leaves the annotation out.
+        """
+        linkage_limit = getattr(cls.Meta, 'linkage_limit', {})
+        for key, limit in linkage_limit.items():
+            field = queryset.model._meta.get_field(key)
+            related_model, related_name = field.related_model, field.remote_field.name
+            count = related_model.objects.filter(**{related_name: OuterRef('pk')}) \
+                .order_by().values(related_name).annotate(count=Count('pk')).values('count')
+            queryset = queryset.prefetch_related(Prefetch(
+                key, queryset=related_model.objects.order_by('id')[:limit],
+                to_attr=f'{key}_limited'
+            )).annotate(**{f'{key}__count': Coalesce(Subquery(count), 0)})
+        return queryset
     
     @property
     async def errors(self):
@@ -628,48 +808,66 @@ class JSONAPISerializer(JSONAPIBaseSerializer, metaclass=SerializerMetaclass):
         return {"jsonapi": { "version": "1.1" }, 'errors': error_details}
     
     async def _get_included(self, instance, rels, included, 
-                            is_included_disabled=False):
+                            is_included_disabled=False, cache=None, concurrency_limit=None):
         if not rels or is_included_disabled:
             return
-        for rel in rels.keys():
-            rel_field = getattr(instance, rel)
-            view_name = rels[rel]['links'].pop('included')
-            if hasattr(rel_field, 'all'):
-                objects_list = [obj async for obj in await sync_to_async(rel_field.all)()]
+        cache = {} if cache is None else cache
+        results = await gather_limited([
+            self._get_included_objects(
+                instance, rel, rels[rel].view_name, cache
+            ) for rel in rels.keys()
+        ], concurrency_limit or self.concurrency_limit)
+        for objects in results:
+            for key, data_included in objects:
+                included.setdefault(key, data_included)
+    
+    async def _get_included_objects(self, instance, rel, view_name, cache):
+        rel_field = getattr(instance, rel)
+        if hasattr(rel_field, 'all'):
+            limit = getattr(self.Meta, 'linkage_limit', {}).get(rel)
+            if limit is not None:
+                objects_list = await get_limited_objects(instance, rel, rel_field, limit)
             else:
-                objects_list = [rel_field]
-            field_info = await get_field_info(objects_list[0])
-            for obj in objects_list:
-                data_included = {'type': obj.__class__.__name__.lower(), 'id': obj.id}
-                key = "_".join(str(data_included.values()))
-                if included.get(key):
-                    continue
-                for attribute in field_info.get('fields').keys():
-                    if attribute == 'id':
-                        continue
-                    if not data_included.get('attributes'):
-                        data_included['attributes'] = {}
-                    data_included['attributes'][attribute] = getattr(obj, attribute)
-                for relationship in field_info.get('forward_relations').keys():
-                    if not data_included.get('relationships'):
-                        data_included['relationships'] = {}
-                    objects_list = getattr(obj, relationship)
-                    try:
-                        objects_list = [obj async for obj in await sync_to_async(objects_list.all)()]
-                    except (AttributeError, TypeError):
-                        objects_list = [objects_list]
-                    if not objects_list:
-                        continue
-                    objects_list = [await JSONAPIObjectIdSerializer(obj).data 
-                                    for obj in objects_list]
-                    data_included['relationships'][relationship] = {
-                        'data': objects_list if len(objects_list) > 1 else objects_list.pop()
-                    }
-                data_included['links'] = {'self': await reverse(
-                    view_name, args=[data_included['id']],
-                    request=self._context.get('request')
-                )}
-                included[key] = data_included
+                objects_list = [obj async for obj in await sync_to_async(rel_field.all)()]
+        elif rel_field is not None:
+            objects_list = [rel_field]
+        else:
+            objects_list = []
+        if not objects_list:
+            return []
+        field_info = await get_field_info(objects_list[0])
+        link_template = await get_link_template(
+            view_name, request=self._context.get('request')
+        ) if view_name else None
+        result = []
+        for obj in objects_list:
+            key = f"{obj.__class__.__name__.lower()}_{obj.id}"
+            if key not in cache:
+                cache[key] = await self._get_included_object(obj, field_info, link_template)
+            result.append((key, cache[key]))
+        return result
+    
+    @staticmethod
+    async def _get_included_object(obj, field_info, link_template):
+        attributes, relationships = {}, {}
+        for attribute in field_info.get('fields').keys():
+            if attribute == 'id':
+                continue
+            attributes[attribute] = getattr(obj, attribute)
+        for relationship in field_info.get('forward_relations').keys():
+            objects_list = getattr(obj, relationship)
+            try:
+                objects_list = [obj async for obj in await sync_to_async(objects_list.all)()]
+            except (AttributeError, TypeError):
+                objects_list = [objects_list]
+            if not objects_list:
+                continue
+            objects_list = [ResourceIdentifier.from_instance(obj) for obj in objects_list]
+            relationships[relationship] = Relationship(
+                objects_list if len(objects_list) > 1 else objects_list.pop()
+            )
+        links = ResourceLinks(link_template, obj.id) if link_template else None
+        return Resource(get_type(obj.__class__), obj.id, attributes, relationships, links)
     
     async def to_internal_value(self, data):
         error_message = "The field must contain a valid object description."
@@ -685,41 +883,34 @@ class JSONAPISerializer(JSONAPIBaseSerializer, metaclass=SerializerMetaclass):
         return {**data.get('attributes', {}), 
                 'relationships': data.get('relationships', {})}
     
-    async def to_representation(self, instance):
-        fields = await self.fields
-        serializer_map = {
-            'attributes': fields['attributes'].__class__(instance),
-            'relationships': fields['relationships'].__class__(
-                instance, context={**self._context}
-            )
-        }
+    async def to_resource(self, instance, concurrency_limit=None):
+        fields = self._declared_fields
         url = getattr(self, self.url_field_name, None)
-        obj_map = await self.ObjectId(instance).data
-        parent_id = str(obj_map['id'])
-        if url and not url.endswith(parent_id + '/'):
-            url = f"{url}{parent_id}/"
-        setattr(serializer_map['relationships'], self.url_field_name, url)
-        for key, val in serializer_map.items():
-            if len(val._declared_fields):
-                try:
-                    obj_map[key] = await val.data
-                except SynchronousOnlyOperation as e:
-                    raise NotSelectedForeignKey from e
-            else:
-                obj_map[key] = {}
-        data = {name: await self.get_value(name, obj_map) for name in 
-                fields.keys() if name in obj_map}
-        data = {key: val for key, val in data.items() if val}
-        included = {}
+        links = None
         if url:
+            if self._links_template is None:
+                self._links_template = get_links_template(url, instance.id)
+            links = ResourceLinks(self._links_template, instance.id)
+        try:
+            attributes = await fields['attributes'].to_representation(instance)
+            relationships = await fields['relationships'].to_representation(
+                instance, links, getattr(self.Meta, 'linkage_limit', {}), concurrency_limit
+            )
+        except SynchronousOnlyOperation as e:
+            raise NotSelectedForeignKey from e
+        return Resource(
+            get_type(instance.__class__), instance.id, attributes, relationships, links
+        )
+
+    async def to_representation(self, instance):
+        resource = await self.to_resource(instance)
+        included = {}
+        if resource.links is not None:
             await self._get_included(
-                instance, data.get('relationships'), included,
+                instance, resource.relationships, included,
                 self._context.get('is_included_disabled', False)
             )
-            data['links'] = {'self': url}
-        return {'data': data, 
-                'included': [] if not included 
-                else list(included.values())}
+        return {'data': resource, 'included': list(included.values())}
 
     async def validate_type(self, value):
         obj_type = getattr(self.Meta, 'model_type', None)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -37,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework', 'adrf',
     'cities_light',
     'rozumity',
@@ -45,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'rozumity.slowqueries.slow_query_middleware',
+    'rozumity.routers.replica_routing_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,15 +84,42 @@ WSGI_APPLICATION = 'rozumity.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'rozumity.backends.postgresql',
         'NAME': 'postgres',
         'USER': 'postgres',
         'PASSWORD': 'postgres',
         'HOST': 'localhost',
         'PORT': '5432',
+        # Connections shared by the request threads, see rozumity.backends
+        'POOL': {
+            'min_size': 2,
+            'max_size': 20,
+            'timeout': 5,
+            'max_lifetime': 1800,
+            'max_idle': 300,
+            'check_interval': 30,
+        },
     }
 }
 
+# Read replicas as "host:port,host:port", safe requests read from one of them.
+# In tests every replica mirrors the default database.
+DATABASE_REPLICAS = []
+
+for index, address in enumerate(filter(None, os.environ.get(
+        'DATABASE_REPLICA_HOSTS', '').split(','))):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'], 'HOST': host, 'PORT': port or '5432',
+        'TEST': {'MIRROR': 'default'}
+    }
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+DATABASE_ROUTERS = ['rozumity.routers.ReplicaRouter']
+
+# Seconds a client keeps reading from the primary after a write
+REPLICA_PIN_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -133,6 +164,22 @@ CITIES_LIGHT_INCLUDE_COUNTRIES = [
 CITIES_LIGHT_INCLUDE_CITY_TYPES = ['PPL', 'PPLA', 'PPLA2', 'PPLA3', 'PPLA4', 'PPLC']
 
 
+# Session user cache
+# Snapshots of authenticated users kept in-process by rozumity.authentication
+
+SESSION_USER_CACHE_SIZE = 4096
+
+SESSION_USER_CACHE_TTL = 30
+
+
+# Batch endpoint
+# Limits for the sub-requests dispatched by rozumity.batch
+
+BATCH_MAX_REQUESTS = 50
+
+BATCH_MAX_CONCURRENCY = 8
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
 
@@ -154,5 +201,43 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 100,
+    # Token buckets, the capacity is the number of requests of a period
+    'DEFAULT_THROTTLE_RATES': {'user': '600/min', 'route': '6000/min'},
     'EXCEPTION_HANDLER': 'rozumity.errors.custom_jsonapi_exception_handler'
 }
+
+# The largest page[limit] of the lists, a larger one gets this many
+PAGE_MAX_LIMIT = 1000
+
+# The rows an export reads from its server-side cursor at once
+EXPORT_CHUNK_SIZE = 1000
+
+# Rows, or relationships and included resources of an object, resolved at
+# once by a serializer
+JSONAPI_CONCURRENCY_LIMIT = 4
+
+# The cache alias of the throttle buckets shared by the worker processes,
+# None keeps them in each process
+THROTTLE_CACHE = None
+
+# The database whose LISTEN/NOTIFY carries the change feed to every worker
+# process, None keeps the feed in each process
+CHANGE_FEED_DATABASE = None
+# The latest events kept for the clients resuming the feed
+CHANGE_FEED_BUFFER = 1000
+# The seconds between the heartbeats of an idle stream
+CHANGE_FEED_HEARTBEAT = 15
+# The seconds before a stream ends and its client reconnects
+CHANGE_FEED_LIFETIME = 300
+
+# The jobs of a type run at once in a process, one when missing
+JOB_CONCURRENCY = {
+    'universities.import': 1, 'universities.delete': 1,
+    'test.bulk-delete': 2, 'generate-data': 1
+}
+
+# The log of the queries slower than `threshold_ms`, a share `explain_rate`
+# of the slow SELECT queries gets its EXPLAIN (ANALYZE, BUFFERS) plan, e.g.
+# {'threshold_ms': 100, 'explain_rate': 0.1, 'path': BASE_DIR / 'logs' / 'slow_queries.log'}
+# None disables it
+SLOW_QUERY_LOG = None
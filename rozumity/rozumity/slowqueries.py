@@ -0,0 +1,242 @@
+"""
+An opt-in log of the slow queries, enabled by
+
+    SLOW_QUERY_LOG = {'threshold_ms': 100, 'explain_rate': 0.1,
+                      'path': BASE_DIR / 'logs' / 'slow_queries.log',
+                      'max_bytes': 10 * 1024 * 1024, 'backup_count': 5}
+
+A query slower than the threshold is written as a JSON line with the route
+of the request, the fingerprint of its SQL and its parameters. A sampled
+share of the slow SELECT queries is run again with EXPLAIN (ANALYZE, BUFFERS)
+and gets its plan recorded, those locking rows or calling functions with side
+effects only get their estimated plan.
+"""
+import json
+import logging
+import re
+from asyncio import iscoroutinefunction
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from hashlib import sha1
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from random import random
+from threading import Lock
+from time import perf_counter
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.decorators import sync_and_async_middleware
+
+MAX_PARAMS = 20
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+VALUES_LIST = re.compile(r'(VALUES\s*\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+')
+SPACES = re.compile(r'\s+')
+ANCHORS = re.compile(r'(?:(?<=/)|^)\^|\$(?=/|$)')
+# A SELECT which locks rows or has side effects, ANALYZE would run them twice
+SIDE_EFFECTS = re.compile(
+    r'\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE|KEY\s+SHARE)\b'
+    r'|\b(?:pg_notify|nextval|setval|pg_advisory\w*)\s*\(', re.IGNORECASE
+)
+
+# The request whose queries are being run
+current_request = ContextVar('current_request', default=None)
+
+logger = logging.getLogger('rozumity.slow_queries')
+logger_lock = Lock()
+
+
+def get_config():
+    config = getattr(settings, 'SLOW_QUERY_LOG', None)
+    if not config:
+        return None
+    return {
+        'threshold_ms': 100, 'explain_rate': 0.1,
+        'path': Path(settings.BASE_DIR) / 'logs' / 'slow_queries.log',
+        'max_bytes': 10 * 1024 * 1024, 'backup_count': 5, **config
+    }
+
+
+def get_log_paths(config):
+    """The log file and its rotated backups, the newest first."""
+    path = Path(config['path'])
+    return [path] + [path.with_name(f'{path.name}.{index}')
+                     for index in range(1, config['backup_count'] + 1)]
+
+
+def normalize(sql):
+    """
+    The SQL with its literals and lists of placeholders collapsed, the same
+    query with other values or another number of them normalizes the same.
+    """
+    sql = STRING.sub('?', sql)
+    sql = NUMBER.sub('?', sql)
+    sql = PLACEHOLDER_LIST.sub('(...)', sql)
+    sql = VALUES_LIST.sub(r'\1', sql)
+    return SPACES.sub(' ', sql).strip().replace('%s', '?')
+
+
+def get_fingerprint(sql):
+    return sha1(normalize(sql).encode()).hexdigest()[:16]
+
+
+def get_route(request):
+    if request is None:
+        return None
+    match = getattr(request, 'resolver_match', None)
+    if match is None or not match.route:
+        return request.path
+    # The routes of the routers are regular expressions
+    return '/' + ANCHORS.sub('', match.route)
+
+
+def get_logger(config):
+    with logger_lock:
+        path = str(Path(config['path']).resolve())
+        handlers = [handler for handler in logger.handlers
+                    if getattr(handler, 'baseFilename', None) == path]
+        if not handlers:
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+                handler.close()
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(
+                path, maxBytes=config['max_bytes'], backupCount=config['backup_count'],
+                encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+    return logger
+
+
+def explain(connection, sql, params):
+    """
+    The plan of the query run again with EXPLAIN (ANALYZE, BUFFERS) on the
+    raw connection, inside a savepoint when a transaction is open. A query
+    with side effects is only planned, not run again.
+    """
+    options = 'FORMAT JSON' if SIDE_EFFECTS.search(sql) else 'ANALYZE, BUFFERS, FORMAT JSON'
+    savepoint = connection.in_atomic_block
+    with connection.connection.cursor() as cursor:
+        if savepoint:
+            cursor.execute('SAVEPOINT slow_query_explain')
+        try:
+            cursor.execute(f'EXPLAIN ({options}) {sql}', params)
+            plan = cursor.fetchone()[0]
+        except Exception:
+            if savepoint:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            return None
+        if savepoint:
+            cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+    return plan
+
+
+def record_slow_queries(execute, sql, params, many, context):
+    config = get_config()
+    if config is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    result = execute(sql, params, many, context)
+    duration = (perf_counter() - started) * 1000
+    if duration < config['threshold_ms']:
+        return result
+    connection = context['connection']
+    request = current_request.get()
+    entry = {
+        'time': datetime.now(timezone.utc).isoformat(),
+        'database': connection.alias,
+        'route': get_route(request),
+        'method': request.method if request is not None else None,
+        'path': request.path if request is not None else None,
+        'fingerprint': get_fingerprint(sql),
+        'sql': sql,
+        'params': list(params[:MAX_PARAMS]) if params is not None and not many else None,
+        'duration_ms': round(duration, 3),
+        'plan': None
+    }
+    if not many and connection.vendor == 'postgresql' and \
+            sql.lstrip()[:6].upper() == 'SELECT' and random() < config['explain_rate']:
+        entry['plan'] = explain(connection, sql, params)
+    get_logger(config).info(json.dumps(entry, default=str))
+    return result
+
+
+def install_slow_query_log(sender=None, connection=None, **kwargs):
+    if record_slow_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_slow_queries)
+
+
+@sync_and_async_middleware
+def slow_query_middleware(get_response):
+    """
+    Records the slow queries of the requests when SLOW_QUERY_LOG is set.
+    """
+    if get_config() is None:
+        raise MiddlewareNotUsed
+    connection_created.connect(install_slow_query_log)
+    for connection in connections.all(initialized_only=True):
+        install_slow_query_log(connection=connection)
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = current_request.set(request)
+            try:
+                return await get_response(request)
+            finally:
+                current_request.reset(token)
+    else:
+        def middleware(request):
+            token = current_request.set(request)
+            try:
+                return get_response(request)
+            finally:
+                current_request.reset(token)
+    return middleware
+
+
+def read_entries(config):
+    entries = []
+    for path in get_log_paths(config):
+        try:
+            with open(path, encoding='utf-8') as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            continue
+        for line in reversed(lines):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    return entries
+
+
+def summarize(entries):
+    """
+    The entries grouped by fingerprint, the slowest total first,
+    with the latest plan captured for each.
+    """
+    groups = {}
+    for entry in entries:
+        group = groups.get(entry['fingerprint'])
+        if group is None:
+            group = groups[entry['fingerprint']] = {
+                'sql': normalize(entry['sql']), 'count': 0, 'total_ms': 0.0,
+                'max_ms': 0.0, 'routes': {}, 'last_seen': entry['time'],
+                'example': {'sql': entry['sql'], 'params': entry['params']}, 'plan': None
+            }
+        group['count'] += 1
+        group['total_ms'] += entry['duration_ms']
+        group['max_ms'] = max(group['max_ms'], entry['duration_ms'])
+        route = entry['route'] or ''
+        group['routes'][route] = group['routes'].get(route, 0) + 1
+        if group['plan'] is None and entry['plan'] is not None:
+            group['plan'] = entry['plan']
+    for group in groups.values():
+        group['total_ms'] = round(group['total_ms'], 3)
+        group['mean_ms'] = round(group['total_ms'] / group['count'], 3)
+    return sorted(groups.items(), key=lambda item: -item[1]['total_ms'])
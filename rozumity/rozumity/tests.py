@@ -1,10 +1,51 @@
 # python manage.py test
 # python ../manage.py test rozumity
-from django.test import TestCase
-# from django.contrib.auth import get_user_model
+import json
+from io import BytesIO, StringIO
+from tempfile import TemporaryDirectory
+import tracemalloc
+from contextlib import nullcontext, redirect_stdout
+from threading import Thread, get_ident
+from time import sleep as sleep_sync
+from types import SimpleNamespace
+from datetime import timedelta
+from asyncio import CancelledError, create_task, gather, sleep
+from unittest import skipUnless
+from unittest.mock import patch
+from django.conf import settings
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.utils import timezone
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from asgiref.sync import async_to_sync, sync_to_async
+from rozumity.admin import EstimatedCountPaginator
+from rozumity.coalescing import SingleFlight
+from rozumity.collation import MAX_KEY_BYTES, get_sort_key
+from rozumity import compact
+from rozumity.geo import get_bounding_box
+from rozumity.jobs import JobFailed, JobRunner, JobType, job_runner, registry
+from rozumity.lifespan import startup_hooks, with_lifespan
+from rozumity.loadtest import LoadTest, Scenario, Step, VirtualClient
+from rozumity.backends.postgresql.pool import ConnectionPool, PoolTimeout
+from rozumity.models import Job
+from rozumity.authentication import SessionUserCache, UserSnapshot, session_user_cache
+from rozumity.parsers import CompactJSONAPIParser
+from rozumity.routers import PIN_COOKIE, ReplicaRouter, read_database, replica_routing_middleware
+from rozumity.serializers import gather_limited, io_bound
+from rozumity.slowqueries import explain, get_fingerprint, normalize
+from rozumity.throttling import LocalBucketStore, local_bucket_store, refill
 from accomplishments.serializers import TestSerializer
-from accomplishments.models import Test
-from cities_light.models import City, Country
+from accomplishments.views import TestViewSet, UniversityViewSet
+from accomplishments.models import Education, Speciality, Test, University
+from accounts.models import ClientProfile, ExpertProfile
+from cities_light.models import City, Country, Region
 
 
 class SerializerTests(TestCase):
@@ -41,4 +82,973 @@ class SerializerTests(TestCase):
         await object.country.aset(countries)
         assert await self.serializer(object).data == {'data': {'type': 'test', 'id': 2, 'attributes': {'title': 'test1'}, 
                          'relationships': {'city': {'data': {'type': 'city', 'id': 1334}}, 
-                                           'country': {'data': [{'type': 'country', 'id': 2}, {'type': 'country', 'id': 27}]}}}}
\ No newline at end of file
+                                           'country': {'data': [{'type': 'country', 'id': 2}, {'type': 'country', 'id': 27}]}}}}
+
+class SessionUserCacheTests(SimpleTestCase):
+    def test_cache_is_bounded(self):
+        cache = SessionUserCache(max_size=2, ttl=30)
+        for key in range(3):
+            cache.set(str(key), UserSnapshot(key))
+        assert len(cache) == 2
+        assert cache.get('0') is None
+        assert cache.get('2').id == 2
+    
+    def test_cache_expires(self):
+        cache = SessionUserCache(max_size=2, ttl=0)
+        cache.set('key', UserSnapshot(1))
+        assert cache.get('key') is None
+    
+    def test_invalidate_user(self):
+        cache = SessionUserCache(max_size=4, ttl=30)
+        cache.set('first', UserSnapshot(1))
+        cache.set('second', UserSnapshot(1))
+        cache.set('third', UserSnapshot(2))
+        cache.invalidate_user(1)
+        assert cache.get('first') is None and cache.get('second') is None
+        assert cache.get('third').id == 2
+
+
+class AsyncSessionAuthenticationTests(TestCase):
+    url = '/api/accomplishments/universities/'
+    
+    def setUp(self):
+        session_user_cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email="normal@user.com", password="foo"
+        )
+        self.client.force_login(self.user)
+    
+    def test_cached_session_skips_database(self):
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(self.url)
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get(self.url)
+        assert response.status_code == 200
+        assert len(first) - len(second) == 2
+    
+    def test_user_update_invalidates_cache(self):
+        self.client.get(self.url)
+        assert len(session_user_cache) == 1
+        self.user.is_active = False
+        self.user.save()
+        assert len(session_user_cache) == 0
+        assert self.client.get(self.url).status_code == 403
+
+
+class BatchViewTests(TestCase):
+    url = '/api/batch/'
+    
+    def setUp(self):
+        session_user_cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email="normal@user.com", password="foo"
+        )
+        self.client.force_login(self.user)
+    
+    def post(self, requests):
+        return self.client.post(self.url, {'requests': requests}, content_type='application/json')
+    
+    def test_batch(self):
+        country = Country.objects.create(id=2, name='test_country_2')
+        city = City.objects.create(id=1334, name='test_city', country=country)
+        test = Test.objects.create(title='test1', city=city)
+        test.country.set([country])
+        response = self.post([
+            f'/api/accomplishments/test/{test.id}/',
+            f'/api/accomplishments/test/{test.id}/relationships/country/',
+            '/api/accomplishments/universities/?page[limit]=5',
+            '/api/unknown/',
+            'http://example.com/api/accomplishments/test/'
+        ])
+        results = response.json()['results']
+        assert response.status_code == 200
+        assert [result['status'] for result in results] == [200, 200, 200, 404, 400]
+        assert results[0]['body']['data']['attributes'] == {'title': 'test1'}
+        assert results[1]['body']['data'][0]['id'] == 2
+    
+    def test_batch_shares_objects(self):
+        country = Country.objects.create(id=2, name='test_country_2')
+        city = City.objects.create(id=1334, name='test_city', country=country)
+        test = Test.objects.create(title='test1', city=city)
+        self.post([f'/api/accomplishments/test/{test.id}/'])
+        with CaptureQueriesContext(connection) as single:
+            self.post([f'/api/accomplishments/test/{test.id}/'])
+        with CaptureQueriesContext(connection) as double:
+            self.post([f'/api/accomplishments/test/{test.id}/'] * 2)
+        assert len(single) == len(double)
+    
+    def test_non_json_responses(self):
+        response = self.post([
+            '/api/accomplishments/test/export/?format=ndjson',
+            '/api/auth/login/',
+            '/api/accomplishments/test/'
+        ])
+        assert response.status_code == 200
+        assert [result['status'] for result in response.json()['results']] == [406, 406, 200]
+
+    def test_batch_requires_list(self):
+        assert self.post('/api/accomplishments/test/').status_code == 400
+
+
+class GatherLimitedTests(SimpleTestCase):
+    async def test_order_and_limit(self):
+        running, peak, finished = 0, 0, []
+
+        async def task(value, children=()):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            # Lets the other tasks start when they may
+            await sleep(0)
+            # A parent does not run while its children do
+            running -= 1
+            results = await gather_limited([task(child) for child in children], 1)
+            running += 1
+            await sleep(0)
+            running -= 1
+            finished.append(value)
+            return value, results
+
+        results = await gather_limited(
+            [task(value, [value * 10, value * 10 + 1]) for value in range(1, 5)], 2
+        )
+        assert results == [(value, [(value * 10, []), (value * 10 + 1, [])])
+                           for value in range(1, 5)]
+        # The nested tasks ran one after the other in the slots of their parents
+        assert peak == 2
+        assert finished.index(10) < finished.index(11) < finished.index(1)
+
+
+class DocumentMemoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        countries = [Country.objects.create(id=id, name=f'test_country_{id}')
+                     for id in range(1, 4)]
+        city = City.objects.create(id=1334, name='test_city', country=countries[0])
+        tests = Test.objects.bulk_create([
+            Test(title=f'test{i}', city=city) for i in range(1000)
+        ])
+        Test.country.through.objects.bulk_create([
+            Test.country.through(test_id=test.id, country_id=country.id)
+            for test in tests for country in countries
+        ])
+
+    async def test_page_document_is_compact(self):
+        objects = await sync_to_async(list)(TestViewSet.queryset.order_by('id'))
+
+        async def iterate():
+            for obj in objects:
+                yield obj
+        serializer = TestSerializer(iterate(), many=True, context={
+            'request': RequestFactory().get('/api/accomplishments/test/')
+        })
+        tracemalloc.start()
+        try:
+            data = await serializer.data
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        content = JSONRenderer().render(data)
+        tracemalloc.start()
+        try:
+            # The same document held as plain dicts
+            plain = json.loads(content)
+            size, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert len(plain['data']) == 1000 and len(plain['included']) == 4
+        assert plain['data'][0]['relationships']['country'] == {
+            'data': [{'type': 'country', 'id': id} for id in range(1, 4)],
+            'links': {
+                'self': f'http://testserver/api/accomplishments/test/{objects[0].id}/relationships/country/',
+                'related': f'http://testserver/api/accomplishments/test/{objects[0].id}/country/'
+            },
+            'meta': {'count': 3}
+        }
+        assert peak < size
+
+
+class ValidationPlanTests(SimpleTestCase):
+    data = {'data': {'type': 'test', 'attributes': {'title': 'test1'},
+                     'relationships': {'city': {'data': {'type': 'city', 'id': 1334}}}}}
+
+    async def test_plan_is_compiled_once(self):
+        plan = await TestSerializer().get_validation_plan()
+        assert plan is await TestSerializer().get_validation_plan()
+        assert [step.name for step in plan.steps] == ['type', 'attributes', 'relationships']
+        assert not any(step.run_is_async for step in plan.steps
+                       if step.name == 'type')
+
+    async def test_io_bound_validation_runs_in_thread(self):
+        threads = {}
+
+        class Serializer(TestSerializer):
+            class Attributes(TestSerializer.Attributes):
+                def validate_title(self, value):
+                    threads['title'] = get_ident()
+                    return value
+
+            class Relationships(TestSerializer.Relationships):
+                @io_bound
+                def validate_city(self, value):
+                    threads['city'] = get_ident()
+                    return value
+
+        serializer = Serializer(data=json.loads(json.dumps(self.data)))
+        assert await serializer.is_valid()
+        assert threads['title'] == get_ident() != threads['city']
+
+    async def test_bulk_errors(self):
+        data = [json.loads(json.dumps(self.data['data'])) for _ in range(3)]
+        data[2]['attributes']['title'] = 't' * 129
+        serializer = TestSerializer(data={'data': data}, many=True)
+        assert not await serializer.is_valid()
+        assert list(serializer._errors) == ['attributes.title']
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'], REPLICA_PIN_SECONDS=5)
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.databases = []
+
+        def view(request):
+            self.databases.append(ReplicaRouter().db_for_read(Test))
+            return HttpResponse()
+        self.middleware = replica_routing_middleware(view)
+
+    def test_reads_go_to_replica(self):
+        response = self.middleware(RequestFactory().get('/'))
+        assert self.databases == ['replica_0'] and PIN_COOKIE not in response.cookies
+        assert ReplicaRouter().db_for_read(Test) is None
+        assert ReplicaRouter().db_for_write(Test) == 'default'
+
+    def test_write_pins_client_to_primary(self):
+        response = self.middleware(RequestFactory().post('/'))
+        assert self.databases == [None]
+        factory = RequestFactory()
+        factory.cookies[PIN_COOKIE] = response.cookies[PIN_COOKIE].value
+        self.middleware(factory.get('/'))
+        self.middleware(RequestFactory(headers={'X-Primary-Until': '1'}).get('/'))
+        assert self.databases == [None, None, 'replica_0']
+
+    async def test_async_middleware(self):
+        async def view(request):
+            self.databases.append(ReplicaRouter().db_for_read(Test))
+            return HttpResponse()
+        await replica_routing_middleware(view)(RequestFactory().get('/'))
+        assert self.databases == ['replica_0']
+
+
+@skipUnless(settings.DATABASE_REPLICAS, 'DATABASE_REPLICA_HOSTS is not set')
+class ReplicaDatabaseTests(TransactionTestCase):
+    # DATABASE_REPLICA_HOSTS=localhost:5433 python manage.py test rozumity.tests.ReplicaDatabaseTests
+    # The replica reads only what is committed on the primary
+    databases = {'default', *settings.DATABASE_REPLICAS}
+
+    def setUp(self):
+        user = get_user_model().objects.create_superuser(email="super@user.com", password="foo")
+        self.client.force_login(user)
+
+    def count_queries(self, method, *args, **kwargs):
+        with CaptureQueriesContext(connections[settings.DATABASE_REPLICAS[0]]) as replica:
+            with CaptureQueriesContext(connection) as primary:
+                response = getattr(self.client, method)(*args, **kwargs)
+        return response, len(primary), len(replica)
+
+    @override_settings(DATABASE_REPLICAS=settings.DATABASE_REPLICAS[:1])
+    def test_read_your_writes(self):
+        response, primary, replica = self.count_queries('get', '/api/accomplishments/test/')
+        assert response.status_code == 200 and replica and not primary
+        response, primary, replica = self.count_queries(
+            'post', '/api/accomplishments/operations/', {'atomic:operations': [{
+                'op': 'add', 'data': {'type': 'test', 'attributes': {'title': 'test1'}}
+            }]}, content_type='application/vnd.api+json'
+        )
+        assert response.status_code == 200 and PIN_COOKIE in response.cookies
+        assert primary and not replica
+        response, primary, replica = self.count_queries('get', '/api/accomplishments/test/')
+        assert primary and not replica
+
+
+class FakeConnection:
+    def __init__(self, healthy=True):
+        self.closed = 0
+        self.healthy = healthy
+        self.info = SimpleNamespace(transaction_status=0)
+
+    def cursor(self):
+        if not self.healthy:
+            raise Exception('server closed the connection unexpectedly')
+        return nullcontext(SimpleNamespace(execute=lambda sql: None))
+
+    def rollback(self):
+        self.info.transaction_status = 0
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def test_connections_are_reused(self):
+        pool = ConnectionPool(max_size=2)
+        connection = pool.getconn(FakeConnection)
+        connection.info.transaction_status = 2
+        pool.putconn(connection)
+        assert pool.getconn(FakeConnection) is connection
+        assert connection.info.transaction_status == 0
+        stats = pool.stats()
+        assert (stats['connections_opened'], stats['checkouts'], stats['in_use']) == (1, 2, 1)
+
+    def test_wait_and_timeout(self):
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        connection = pool.getconn(FakeConnection)
+        with self.assertRaises(PoolTimeout):
+            pool.getconn(FakeConnection)
+        pool.timeout = 5
+        waiter = Thread(target=lambda: self.assertIs(pool.getconn(FakeConnection), connection))
+        waiter.start()
+        while not pool.stats()['waiting']:
+            sleep_sync(0.001)
+        pool.putconn(connection)
+        waiter.join()
+        assert pool.stats()['timeouts'] == 1 and pool.stats()['size'] == 1
+
+    def test_lifetime_and_health_check(self):
+        pool = ConnectionPool(max_lifetime=0)
+        connection = pool.getconn(FakeConnection)
+        pool.putconn(connection)
+        assert connection.closed and pool.stats()['size'] == 0
+        pool = ConnectionPool(check_interval=0)
+        connection = pool.getconn(lambda: FakeConnection(healthy=False))
+        pool.putconn(connection)
+        assert pool.getconn(FakeConnection) is not connection
+        assert pool.stats()['health_checks_failed'] == 1 and connection.closed
+
+
+class DatabasePoolViewTests(TestCase):
+    def test_stats(self):
+        user = get_user_model().objects.create_user(email="normal@user.com", password="foo")
+        self.client.force_login(user)
+        assert self.client.get('/api/pools/').status_code == 403
+        user.is_staff = True
+        user.save()
+        self.client.force_login(user)
+        data = self.client.get('/api/pools/').json()['data']
+        stats = [pool['attributes'] for pool in data
+                 if pool['attributes']['database'] == connection.settings_dict['NAME']]
+        assert stats[0]['in_use'] == 1 and stats[0]['max_size'] == 20
+
+
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/slow_queries.log'
+        self.user = get_user_model().objects.create_user(
+            email="staff@user.com", password="foo", is_staff=True
+        )
+        self.client.force_login(self.user)
+
+    def test_fingerprint(self):
+        assert normalize("SELECT * FROM t WHERE id IN (%s, %s, %s) AND title = 'a''b'") == \
+            'SELECT * FROM t WHERE id IN (...) AND title = ?'
+        assert get_fingerprint('SELECT 1 FROM t WHERE id IN (%s)') == \
+            get_fingerprint('SELECT  2 FROM t WHERE id IN (%s, %s)')
+        assert get_fingerprint('SELECT 1 FROM t') != get_fingerprint('SELECT 1 FROM u')
+
+    def test_disabled(self):
+        self.client.get('/api/accomplishments/tests/')
+        with override_settings(SLOW_QUERY_LOG={'path': self.path}):
+            assert self.client.get('/api/slow-queries/').json() == {'data': []}
+
+    def test_log_and_explain(self):
+        university = University.objects.create(title='test')
+        config = {'threshold_ms': 0, 'explain_rate': 1, 'path': self.path}
+        with override_settings(SLOW_QUERY_LOG=config):
+            self.client.get(f'/api/accomplishments/universities/{university.id}/')
+            data = self.client.get('/api/slow-queries/', {
+                'filter[route]': '/api/accomplishments/universities/(?P<pk>[^/.]+)/'
+            }).json()['data']
+        with open(self.path) as file:
+            entries = [json.loads(line) for line in file]
+        assert {entry['route'] for entry in entries} == \
+            {'/api/accomplishments/universities/(?P<pk>[^/.]+)/'}
+        attributes = [query['attributes'] for query in data]
+        selects = [query for query in attributes if '"accomplishments_university"' in query['sql']]
+        assert selects and all(query['count'] == 1 for query in attributes)
+        assert 'Shared Hit Blocks' in selects[0]['plan'][0]['Plan']
+        assert selects[0]['example']['params'] == [university.id]
+        assert self.client.get('/api/slow-queries/').status_code == 200
+        self.user.is_staff = False
+        self.user.save()
+        assert self.client.get('/api/slow-queries/').status_code == 403
+
+
+    def test_explain_side_effects(self):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TEMPORARY SEQUENCE explain_sequence')
+            plan = explain(connection, "SELECT nextval('explain_sequence')", None)
+            assert 'Actual Rows' not in plan[0]['Plan']
+            cursor.execute("SELECT nextval('explain_sequence')")
+            assert cursor.fetchone()[0] == 1
+        plan = explain(connection, 'SELECT id FROM accomplishments_test FOR UPDATE', None)
+        assert 'Actual Rows' not in plan[0]['Plan']
+        plan = explain(connection, 'SELECT id FROM accomplishments_test', None)
+        assert 'Actual Rows' in plan[0]['Plan']
+
+
+class LoadTestTests(TransactionTestCase):
+    # The requests run in their own threads and read committed data only
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email="normal@user.com", password="foo")
+        country = Country.objects.create(id=1, name='test_country_1')
+        self.tests = [Test.objects.create(title=f'test{i}') for i in range(3)]
+        self.tests[0].country.set([country])
+
+    def test_scenario(self):
+        from rozumity.asgi import application
+        scenario = Scenario([
+            Step('test-list', '/api/accomplishments/test/', weight=3,
+                 query={'page[offset]': '{randint:0:2}'}),
+            Step('test-detail', '/api/accomplishments/test/{id:accomplishments.Test}/'),
+            Step('test-create', '/api/accomplishments/test/', method='POST', bulk=3,
+                 body={'data': {'type': 'test', 'attributes': {'title': 'test'}}})
+        ], clients=3, requests=30)
+        ids = scenario.load_ids()
+        assert sorted(ids['accomplishments.Test']) == sorted(test.id for test in self.tests)
+        clients = [VirtualClient.login(self.user) for _ in range(scenario.clients)]
+        try:
+            report = async_to_sync(LoadTest(application, scenario, clients, ids).run)()
+        finally:
+            VirtualClient.logout(clients)
+        steps = report['steps']
+        assert report['total']['requests'] == 30
+        assert sum(row['requests'] for row in steps.values()) == 30
+        assert steps['test-list']['statuses'] == {200: steps['test-list']['requests']}
+        assert steps['test-detail']['error_rate'] == 0 and steps['test-detail']['queries'] > 0
+        # Only the staff may create tests, the CSRF check passed
+        assert steps['test-create']['statuses'] == {403: steps['test-create']['requests']}
+        assert report['total']['p50'] <= report['total']['p99']
+
+
+class GenerateDataTests(TestCase):
+    options = {'tests': 50, 'universities': 5, 'specialities': 4, 'educations': 10,
+               'clients': 6, 'experts': 3, 'seed': 7, 'stdout': StringIO()}
+
+    @classmethod
+    def setUpTestData(cls):
+        countries = [Country.objects.create(id=id, name=f'test_country_{id}')
+                     for id in range(1, 5)]
+        region = Region.objects.create(id=1, name='test_region', country=countries[0])
+        for id in range(1, 4):
+            City.objects.create(id=id, name=f'test_city_{id}', region=region,
+                                country=countries[0])
+
+    def snapshot(self):
+        def rows(queryset, *fields):
+            return [row[1:] for row in queryset.order_by('id').values_list('id', *fields)]
+        return [
+            rows(Test.objects, 'title', 'city_id'),
+            rows(Test.country.through.objects, 'country_id'),
+            rows(University.objects, 'title', 'country_id'),
+            rows(Speciality.objects, 'title', 'code_ua'),
+            rows(Education.objects, 'university_degree', 'date_start', 'date_end'),
+            rows(ClientProfile.objects, 'first_name', 'gender', 'city_id', 'region_id'),
+            rows(ExpertProfile.education.through.objects, 'education_id'),
+            rows(get_user_model().objects, 'email', 'is_client', 'is_expert')
+        ]
+
+    def delete(self):
+        for model in (Test, ClientProfile, ExpertProfile, get_user_model(),
+                      Education, University, Speciality):
+            model.objects.all().delete()
+
+    def test_seeded_and_deterministic(self):
+        call_command('generate_data', **self.options)
+        assert Test.objects.count() == 50 and ExpertProfile.objects.count() == 3
+        assert get_user_model().objects.filter(is_client=True).count() == 6
+        assert ClientProfile.objects.first().gender in ([0], [1], [2], [3], [4], [5])
+        snapshot = self.snapshot()
+        self.delete()
+        call_command('generate_data', copy=False, **self.options)
+        assert self.snapshot() == snapshot
+        # New rows get new ids, the sequences were moved past them
+        test = Test.objects.create(title='test')
+        assert test.id == Test.objects.order_by('id').values_list('id', flat=True)[49] + 1
+        self.delete()
+        call_command('generate_data', **{**self.options, 'seed': 8})
+        assert self.snapshot() != snapshot
+
+
+class ScalableAdminTests(TestCase):
+    url = '/admin/accomplishments/test/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser(
+            email='super@user.com', password='foo'
+        )
+        country = Country.objects.create(id=1, name='test_country')
+        cls.cities = [City.objects.create(id=id, name=name, country=country)
+                      for id, name in ((1, 'Kyiv'), (2, 'Kharkiv'), (3, 'Lviv'))]
+        Test.objects.bulk_create([Test(title=f'test{index}', city=cls.cities[index % 3])
+                                  for index in range(250)])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_keyset_pages(self):
+        ids = list(Test.objects.order_by('-pk').values_list('pk', flat=True))
+        response = self.client.get(self.url)
+        changelist = response.context['cl']
+        assert changelist.keyset and changelist.result_count == 250
+        assert [test.pk for test in changelist.result_list] == ids[:100]
+        assert changelist.next_url == f'?after={ids[99]}' and changelist.previous_url is None
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url + changelist.next_url)
+        changelist = response.context['cl']
+        assert [test.pk for test in changelist.result_list] == ids[100:200]
+        assert changelist.previous_url == changelist.first_url == '?'
+        # The cities are joined, the page is a range scan of the primary key
+        assert not any('FROM "cities_light_city"' in query['sql']
+                       for query in queries.captured_queries)
+        page = [query['sql'] for query in queries.captured_queries
+                if 'DESC LIMIT 101' in query['sql']]
+        assert len(page) == 1 and 'OFFSET' not in page[0]
+        assert f'"accomplishments_test"."id" < {ids[99]}' in page[0]
+        response = self.client.get(self.url + changelist.next_url)
+        changelist = response.context['cl']
+        assert [test.pk for test in changelist.result_list] == ids[200:]
+        assert changelist.next_url is None
+        assert changelist.previous_url == f'?after={ids[99]}'
+
+    def test_sorted_by_column(self):
+        response = self.client.get(self.url, {'o': '1', 'p': '2'})
+        changelist = response.context['cl']
+        assert not changelist.keyset and len(changelist.result_list) == 100
+
+    def test_estimated_count(self):
+        with patch.object(EstimatedCountPaginator, 'exact_count_limit', 10):
+            paginator = EstimatedCountPaginator(Test.objects.order_by('pk'), 100)
+            with CaptureQueriesContext(connection) as queries:
+                assert paginator.count > 10 and paginator.estimated
+        assert len(queries) == 1 and queries[0]['sql'].startswith('EXPLAIN')
+        paginator = EstimatedCountPaginator(Test.objects.filter(title='test1').order_by('pk'), 100)
+        assert paginator.count == 1 and not paginator.estimated
+
+    def test_autocomplete(self):
+        parameters = {'app_label': 'accomplishments', 'model_name': 'test',
+                      'field_name': 'city', 'term': 'k'}
+        response = self.client.get('/admin/autocomplete/', parameters)
+        assert response.status_code == 200
+        assert response.json() == {'results': [
+            {'id': '2', 'text': 'Kharkiv, test_country'},
+            {'id': '1', 'text': 'Kyiv, test_country'}
+        ], 'pagination': {'more': False}}
+        # A prefix, not a substring
+        response = self.client.get('/admin/autocomplete/', {**parameters, 'term': 'iv'})
+        assert response.json()['results'] == []
+        self.client.logout()
+        response = self.client.get('/admin/autocomplete/', parameters)
+        assert response.status_code == 403
+
+    def test_change_form(self):
+        response = self.client.get(f'{self.url}{Test.objects.first().pk}/change/')
+        assert response.status_code == 200
+        # The cities are not rendered as options of a select
+        assert b'Lviv' not in response.content
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_refill(self):
+        state, wait = refill(None, 100.0, 3, 1.0, 5)
+        assert state == (2, 100.0) and wait == 0
+        state, wait = refill(state, 100.5, 3, 1.0, 5)
+        assert state == (2.5, 100.5) and wait == 0.5
+        # Never above the capacity
+        state, wait = refill(state, 1000.0, 1, 1.0, 5)
+        assert state == (4, 1000.0) and wait == 0
+
+    def test_local_store(self):
+        store = LocalBucketStore(max_size=2)
+        now = [0.0]
+        store.timer = lambda: now[0]
+        assert store.consume('a', 2, 1.0, 2) == 0
+        assert store.consume('a', 1, 1.0, 2) == 1
+        now[0] = 1.0
+        assert store.consume('a', 1, 1.0, 2) == 0
+        store.consume('b', 1, 1.0, 2)
+        store.consume('c', 1, 1.0, 2)
+        # The least recently used bucket is evicted and starts full
+        assert len(store) == 2 and store.consume('a', 2, 1.0, 2) == 0
+
+
+@override_settings(REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'user': '3/min', 'route': '100/min'}
+})
+class ThrottlingTests(TestCase):
+    url = '/api/accomplishments/test/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='user@user.com', password='foo')
+        cls.other = get_user_model().objects.create_user(email='other@user.com', password='foo')
+        Test.objects.create(title='test')
+
+    def setUp(self):
+        local_bucket_store.clear()
+        self.client.force_login(self.user)
+
+    def test_large_page_costs_more(self):
+        assert self.client.get(self.url).status_code == 200
+        assert self.client.get(self.url, {'page[limit]': 200}).status_code == 200
+        # The session user is cached, the request is refused without a query
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        assert response.status_code == 429
+        assert int(response['Retry-After']) == 20
+        error = response.json()['errors'][0]
+        assert error['code'] == 429 and error['source'] == {'pointer': self.url}
+        # An other user has an own bucket
+        self.client.force_login(self.other)
+        assert self.client.get(self.url, {'page[limit]': 300}).status_code == 200
+        assert self.client.get(self.url).status_code == 429
+        # The whole route bucket for an unbounded page
+        local_bucket_store.clear()
+        with override_settings(REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK,
+            'DEFAULT_THROTTLE_RATES': {'user': '100000/min', 'route': '10/min'}
+        }):
+            assert self.client.get(self.url).status_code == 200
+            response = self.client.get(self.url, {'page[limit]': 100000})
+            assert response.status_code == 429 and response['Retry-After'] == '6'
+        # A page larger than the largest one costs the largest one
+        local_bucket_store.clear()
+        with override_settings(REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK,
+            'DEFAULT_THROTTLE_RATES': {'user': '100000/min', 'route': '20/min'}
+        }):
+            for status in (200, 200, 429):
+                response = self.client.get(self.url, {'page[limit]': 100000})
+                assert response.status_code == status
+
+    def test_route_bucket(self):
+        with override_settings(REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK,
+            'DEFAULT_THROTTLE_RATES': {'user': '100/min', 'route': '2/min'}
+        }):
+            assert self.client.get(self.url).status_code == 200
+            self.client.force_login(self.other)
+            assert self.client.get(self.url).status_code == 200
+            assert self.client.get(self.url).status_code == 429
+            # The detail route has an own bucket
+            response = self.client.get(f'{self.url}{Test.objects.get().id}/')
+            assert response.status_code == 200
+
+    @override_settings(
+        THROTTLE_CACHE='throttle',
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'throttle': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                             'LOCATION': 'throttle'}}
+    )
+    def test_cache_store(self):
+        for index in range(3):
+            assert self.client.get(self.url).status_code == 200
+        assert self.client.get(self.url).status_code == 429
+        assert len(local_bucket_store) == 0
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.flight = SingleFlight(timeout=1)
+        self.calls = 0
+
+    async def compute(self, delay=0.01, error=None):
+        self.calls += 1
+        call = self.calls
+        await sleep(delay)
+        if error is not None:
+            raise error
+        return HttpResponse(b'{"data":[]}', status=200, headers={'X-Call': call})
+
+    @async_to_sync
+    async def test_shared_response(self):
+        responses = await gather(*[self.flight.run('key', self.compute) for _ in range(5)])
+        assert self.calls == 1 and len(self.flight) == 0
+        assert {response.content for response in responses} == {b'{"data":[]}'}
+        assert all(response['X-Call'] == '1' for response in responses)
+        # Every request gets its own response object
+        assert len({id(response) for response in responses}) == 5
+        await self.flight.run('other', self.compute)
+        assert self.calls == 2 and self.flight.stats == {
+            'leaders': 2, 'followers': 4, 'timeouts': 0
+        }
+
+    @async_to_sync
+    async def test_error(self):
+        results = await gather(*[
+            self.flight.run('key', lambda: self.compute(error=ValueError('failed')))
+            for _ in range(3)
+        ], return_exceptions=True)
+        assert self.calls == 1 and all(type(result) == ValueError for result in results)
+
+    @async_to_sync
+    async def test_timeout(self):
+        self.flight.timeout = 0.01
+        responses = await gather(
+            self.flight.run('key', lambda: self.compute(delay=0.2)),
+            self.flight.run('key', lambda: self.compute(delay=0))
+        )
+        # The follower gave up waiting and computed its own response
+        assert self.calls == 2 and self.flight.stats['timeouts'] == 1
+        assert [response['X-Call'] for response in responses] == ['1', '2']
+
+    @async_to_sync
+    async def test_cancelled_leader(self):
+        leader = create_task(self.flight.run('key', lambda: self.compute(delay=0.2)))
+        await sleep(0)
+        follower = create_task(self.flight.run('key', self.compute))
+        await sleep(0.01)
+        leader.cancel()
+        response = await follower
+        assert self.calls == 2 and response.status_code == 200
+        with self.assertRaises(CancelledError):
+            await leader
+
+
+class CoalescingLoadTests(TransactionTestCase):
+    def setUp(self):
+        local_bucket_store.clear()
+        self.user = get_user_model().objects.create_user(email='normal@user.com', password='foo')
+        University.objects.bulk_create([University(title=f'university{i}') for i in range(50)])
+
+    def run_load_test(self):
+        from rozumity.asgi import application
+        scenario = Scenario([
+            Step('universities-list', '/api/accomplishments/universities/',
+                 query={'page[offset]': '0'})
+        ], clients=20, requests=200)
+        clients = [VirtualClient.login(self.user) for _ in range(scenario.clients)]
+        try:
+            with redirect_stdout(StringIO()):
+                return async_to_sync(LoadTest(application, scenario, clients, {}).run)()
+        finally:
+            VirtualClient.logout(clients)
+
+    def test_query_volume(self):
+        with patch.object(UniversityViewSet, 'coalesce_requests', False):
+            alone = self.run_load_test()['total']
+        local_bucket_store.clear()
+        coalesced = self.run_load_test()['total']
+        assert alone['statuses'] == coalesced['statuses'] == {200: 200}
+        # Most requests rode along with one in flight
+        assert coalesced['queries'] < alone['queries'] / 2, (alone, coalesced)
+
+
+class JobRunnerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.staff = user_model.objects.create_superuser(email='staff@user.com', password='foo')
+        cls.owner = user_model.objects.create_user(email='owner@user.com', password='foo')
+        cls.other = user_model.objects.create_user(email='other@user.com', password='foo')
+
+    def setUp(self):
+        self.running = self.max_running = 0
+
+        async def count(context, total):
+            for done in range(1, total + 1):
+                context.count('rows')
+                context.progress(done, total)
+            return {'meta': {'total': total}}
+
+        async def fail(context, reported):
+            if reported:
+                context.error('Reported.', '/data/1')
+                raise JobFailed
+            raise ValueError('Unexpected.')
+
+        async def slow(context):
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            await sleep(0.02)
+            self.running -= 1
+
+        types = {name: JobType(name, function, resumable, False) for name, function, resumable in (
+            ('tests.count', count, True), ('tests.fail', fail, True),
+            ('tests.slow', slow, True), ('tests.once', slow, False)
+        )}
+        patcher = patch.dict(registry, types)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.runner = JobRunner()
+
+    async def test_progress_and_result(self):
+        job = await self.runner.submit('tests.count', {'total': 3}, self.owner.id)
+        assert job.status == Job.QUEUED
+        await self.runner.wait()
+        await job.arefresh_from_db()
+        assert (job.status, job.done, job.total, job.attempts) == (Job.SUCCEEDED, 3, 3, 1)
+        assert job.counts == {'rows': 3} and job.errors == []
+        assert job.result == {'meta': {'total': 3}}
+        assert job.worker == self.runner.worker and job.finished >= job.started
+
+    async def test_failure(self):
+        reported = await self.runner.submit('tests.fail', {'reported': True})
+        unexpected = await self.runner.submit('tests.fail', {'reported': False})
+        with self.assertLogs('rozumity.jobs', 'ERROR'):
+            await self.runner.wait()
+        await reported.arefresh_from_db()
+        await unexpected.arefresh_from_db()
+        assert reported.status == unexpected.status == Job.FAILED
+        assert reported.errors == [{'detail': 'Reported.', 'source': {'pointer': '/data/1'}}]
+        assert unexpected.errors == [{'detail': 'Unexpected.'}]
+        with self.assertRaises(LookupError):
+            await self.runner.submit('tests.unknown')
+
+    async def test_concurrency(self):
+        for concurrency in (1, 2):
+            self.max_running = 0
+            with override_settings(JOB_CONCURRENCY={'tests.slow': concurrency}):
+                self.runner._semaphores.clear()
+                for _ in range(4):
+                    await self.runner.submit('tests.slow')
+                await self.runner.wait()
+            assert self.max_running == concurrency
+        assert await Job.objects.filter(status=Job.SUCCEEDED).acount() == 8
+
+    async def test_resume(self):
+        heartbeat = timezone.now() - timedelta(seconds=JobRunner.stale_after + 1)
+        resumable, once, alive = [await Job.objects.acreate(
+            type=type, status=Job.RUNNING, heartbeat=heartbeat, attempts=1
+        ) for type in ('tests.slow', 'tests.once', 'tests.slow')]
+        alive.heartbeat = timezone.now()
+        await alive.asave()
+        await self.runner.start()
+        await self.runner.wait()
+        for job in (resumable, once, alive):
+            await job.arefresh_from_db()
+        assert (resumable.status, resumable.attempts) == (Job.SUCCEEDED, 2)
+        assert once.status == Job.FAILED and once.errors
+        assert alive.status == Job.RUNNING
+
+    async def test_startup(self):
+        job = await Job.objects.acreate(type='tests.count', params={'total': 1})
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+        assert job_runner.start in startup_hooks
+        with patch('rozumity.lifespan.startup_hooks', [self.runner.start]):
+            await with_lifespan(None)({'type': 'lifespan'}, receive, send)
+        await self.runner.wait()
+        await job.arefresh_from_db()
+        assert job.status == Job.SUCCEEDED
+        assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+
+    async def test_context(self):
+        databases = []
+
+        async def record(context):
+            databases.append(read_database.get())
+        token = read_database.set('default')
+        try:
+            with patch.dict(registry, {'tests.record': JobType('tests.record', record, True, False)}):
+                await self.runner.submit('tests.record')
+                await self.runner.wait()
+        finally:
+            read_database.reset(token)
+        assert databases == [None]
+
+    async def test_views(self):
+        job = await Job.objects.acreate(type='tests.count', status=Job.SUCCEEDED,
+                                        user_id=self.owner.id, counts={'rows': 1})
+        url = f'/api/jobs/{job.id}/'
+        for user, status in ((self.owner, 200), (self.other, 404), (self.staff, 200)):
+            await sync_to_async(self.async_client.force_login)(user)
+            response = await self.async_client.get(url)
+            assert response.status_code == status
+        attributes = response.json()['data']['attributes']
+        assert (attributes['status'], attributes['counts']) == (Job.SUCCEEDED, {'rows': 1})
+        for job_type in ('tests.count', 'tests.unknown'):
+            response = await self.async_client.post('/api/jobs/', {'data': {
+                'type': 'job', 'attributes': {'type': job_type, 'params': {'total': 1}}
+            }}, content_type='application/vnd.api+json')
+            assert response.status_code == 400
+            assert response.json()['errors'][0]['source']['pointer'] == '/data/attributes/type'
+
+
+class CompactEncodingTests(SimpleTestCase):
+    document = {
+        'data': [
+            {'type': 'test', 'id': id, 'attributes': {'title': f'test{id}', 'tags': []},
+             'relationships': {'city': {'data': city}, 'country': {'data': [
+                 {'type': 'country', 'id': 1}, {'type': 'country', 'id': 2}
+             ], 'meta': {}}},
+             'links': {'self': f'http://testserver/api/accomplishments/test/{id}/'}}
+            for id, city in ((1, None), (2, {'type': 'city', 'id': 7}), (3, None))
+        ],
+        'meta': {'$t': 'escaped', 'items': [{'a': 1}, {'b': None}]},
+        'links': {'next': None}
+    }
+
+    def test_round_trip(self):
+        encoded = compact.encode(self.document)
+        assert compact.decode(json.loads(json.dumps(encoded))) == self.document
+        table = encoded['data']
+        columns = dict(zip(map(tuple, table['$t']), table['$c']))
+        assert table['$n'] == 3
+        assert columns[('type',)] == {'$k': 'test'}
+        assert columns[('attributes', 'title')] == {'$p': 'test', '$s': '', '$v': ['1', '2', '3']}
+        assert columns[('links', 'self')] == {
+            '$p': 'http://testserver/api/accomplishments/test/', '$s': '/', '$v': ['1', '2', '3']
+        }
+        assert columns[('relationships', 'city', 'data')] == {'$m': [1], '$c': {'$k': None}}
+        assert columns[('relationships', 'city', 'data', 'type')] == {'$m': [0, 2], '$c': ['city']}
+        assert encoded['meta']['$o']['items'] == {'$n': 2, '$t': [['a'], ['b']], '$c': [
+            {'$m': [1], '$c': [1]}, {'$m': [0], '$c': [None]}
+        ]}
+        assert compact.encode([{'a': 1}, {'a': True}, {'a': 1.0}])['$c'] == [[1, True, 1.0]]
+        assert encoded['meta']['$o']['$t'] == 'escaped'
+
+    def test_malformed(self):
+        parser = CompactJSONAPIParser()
+        for content in ('[', '{"$t": [["a"]], "$c": [[1]], "$n": 2}',
+                        '{"$t": [["a"]], "$c": [{"$m": [5], "$c": [1]}], "$n": 2}',
+                        '{"$t": [["a"]], "$c": [{"$d": ["x"], "$i": [3]}], "$n": 1}',
+                        '{"$o": 1}'):
+            with self.assertRaises(ParseError):
+                parser.parse(BytesIO(content.encode()))
+
+
+class BoundingBoxTests(SimpleTestCase):
+    def test_box(self):
+        (min_lat, max_lat), [(min_lon, max_lon)] = get_bounding_box(50, 30, 100)
+        assert (round(min_lat, 3), round(max_lat, 3)) == (49.101, 50.899)
+        # Wider than the latitude range away from the equator
+        assert (round(min_lon, 3), round(max_lon, 3)) == (28.601, 31.399)
+
+    def test_antimeridian_and_poles(self):
+        _, lon_ranges = get_bounding_box(0, 179.5, 100)
+        assert [(round(start, 3), round(end, 3)) for start, end in lon_ranges] == \
+            [(178.601, 180), (-180, -179.601)]
+        _, lon_ranges = get_bounding_box(0, -179.5, 100)
+        assert [(round(start, 3), round(end, 3)) for start, end in lon_ranges] == \
+            [(179.601, 180), (-180, -178.601)]
+        (_, max_lat), lon_ranges = get_bounding_box(89.5, 10, 100)
+        assert max_lat == 90 and lon_ranges == [(-180, 180)]
+
+
+class SortKeyTests(SimpleTestCase):
+    def test_order(self):
+        words = ['Zebra', 'apple', 'Äpfel', 'école', 'Ель', 'Єва', 'Ігор', 'Ґанок']
+        assert sorted(words, key=get_sort_key) == \
+            ['Äpfel', 'apple', 'école', 'Zebra', 'Ґанок', 'Ель', 'Єва', 'Ігор']
+        assert get_sort_key(None) == b''
+
+    def test_length(self):
+        assert len(get_sort_key('ж' * 1000)) == MAX_KEY_BYTES
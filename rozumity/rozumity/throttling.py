@@ -0,0 +1,186 @@
+"""
+Token bucket throttles. A bucket holds up to `num_requests` tokens of a
+'num_requests/period' rate and refills continuously, a request takes as
+many tokens as it costs: a large page or a large body costs more than
+a plain request. The buckets live in this process by default, with
+
+    THROTTLE_CACHE = 'default'
+
+they live in a Django cache shared by several worker processes.
+"""
+from collections import OrderedDict
+from math import ceil
+from threading import Lock
+from time import monotonic, time
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+
+def refill(state, now, cost, rate, capacity):
+    """
+    Takes `cost` tokens from a bucket state (tokens, updated),
+    returns the new state and the seconds to wait, 0 when admitted.
+    """
+    tokens, updated = state if state is not None else (capacity, now)
+    tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+    if tokens >= cost:
+        return (tokens - cost, now), 0.0
+    return (tokens, now), (cost - tokens) / rate
+
+
+class LocalBucketStore:
+    """
+    The buckets of this process, a bounded LRU map of key -> state.
+    An evicted bucket starts full again.
+    """
+    timer = staticmethod(monotonic)
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def consume(self, key, cost, rate, capacity):
+        with self._lock:
+            state, wait = refill(self._buckets.get(key), self.timer(), cost, rate, capacity)
+            self._buckets[key] = state
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+        return wait
+
+    async def aconsume(self, key, cost, rate, capacity):
+        # Nothing to wait for, the lock is only held for the arithmetic
+        return self.consume(key, cost, rate, capacity)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketStore:
+    """
+    The buckets in a shared cache. The read and the write of a bucket are
+    not atomic, concurrent requests of one client may both be admitted
+    with the last tokens, which is acceptable for load shedding.
+    """
+    timer = staticmethod(time)
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def consume(self, key, cost, rate, capacity):
+        state, wait = refill(self.cache.get(key), self.timer(), cost, rate, capacity)
+        self.cache.set(key, state, ceil(capacity / rate) + 1)
+        return wait
+
+    async def aconsume(self, key, cost, rate, capacity):
+        state, wait = refill(await self.cache.aget(key), self.timer(), cost, rate, capacity)
+        await self.cache.aset(key, state, ceil(capacity / rate) + 1)
+        return wait
+
+
+local_bucket_store = LocalBucketStore(getattr(settings, 'THROTTLE_LOCAL_BUCKETS', 10000))
+
+
+def get_bucket_store():
+    alias = getattr(settings, 'THROTTLE_CACHE', None)
+    return local_bucket_store if alias is None else CacheBucketStore(alias)
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    A token bucket per `get_cache_key`. The cost of a request is 1, times
+    the page limit, at most the `max_limit` of the paginator, over the
+    default one, plus 1 per `body_unit` bytes, an unpaginated list or an
+    export costs `unpaginated_cost`. A request
+    never costs more than a full bucket, so the most expensive one waits
+    for a full bucket instead of being refused forever.
+    """
+    body_unit = 16 * 1024
+    unpaginated_cost = 10
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def __init__(self):
+        super().__init__()
+        self.store = get_bucket_store()
+        self.wait_time = None
+
+    def get_rate(self):
+        self.THROTTLE_RATES = api_settings.DEFAULT_THROTTLE_RATES
+        return super().get_rate()
+
+    def get_cost(self, request, view):
+        cost = 1
+        if request.method == 'GET':
+            paginator = getattr(view, 'paginator', None)
+            limit_param = getattr(paginator, 'limit_query_param', None)
+            action = getattr(view, 'action', None)
+            if (paginator is None and action == 'list') or action == 'export':
+                cost = self.unpaginated_cost
+            elif limit_param and limit_param in request.query_params:
+                try:
+                    limit = int(request.query_params[limit_param])
+                except ValueError:
+                    limit = paginator.default_limit
+                # The page the paginator actually reads
+                if paginator.max_limit:
+                    limit = min(limit, paginator.max_limit)
+                cost = max(1, ceil(limit / paginator.default_limit))
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        return min(cost + length // self.body_unit, self.num_requests)
+
+    def get_bucket(self, request, view):
+        if self.rate is None:
+            return None
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return None
+        return key, self.get_cost(request, view), self.num_requests / self.duration
+
+    def allow_request(self, request, view):
+        bucket = self.get_bucket(request, view)
+        if bucket is None:
+            return True
+        key, cost, rate = bucket
+        self.wait_time = self.store.consume(key, cost, rate, self.num_requests)
+        return not self.wait_time
+
+    async def aallow_request(self, request, view):
+        bucket = self.get_bucket(request, view)
+        if bucket is None:
+            return True
+        key, cost, rate = bucket
+        self.wait_time = await self.store.aconsume(key, cost, rate, self.num_requests)
+        return not self.wait_time
+
+    def wait(self):
+        return ceil(self.wait_time) if self.wait_time else None
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """A bucket per user, or per client address of anonymous requests."""
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        user = request.user
+        ident = user.pk if user and user.is_authenticated else self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class RouteTokenBucketThrottle(TokenBucketThrottle):
+    """A bucket per view and action shared by all the clients."""
+    scope = 'route'
+
+    def get_cache_key(self, request, view):
+        action = getattr(view, 'action', None) or request.method.lower()
+        ident = f'{view.__class__.__qualname__}.{action}'
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
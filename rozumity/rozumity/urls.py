@@ -17,9 +17,20 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from rozumity.admin import AutocompleteView
+from rozumity.batch import BatchView
+from rozumity.views import DatabasePoolView, JobListView, JobView, SlowQueryView
+
 urlpatterns = [
+    path('admin/autocomplete/', AutocompleteView.as_view(), name='admin-autocomplete'),
     path('admin/', admin.site.urls),
     path('api/auth/', include('rest_framework.urls')),
     path('api/locations/', include('cities_light.contrib.restframework3')),
-    path('api/accomplishments/', include('accomplishments.urls'))
+    path('api/accomplishments/', include('accomplishments.urls')),
+    path('api/accounts/', include('accounts.urls')),
+    path('api/batch/', BatchView.as_view(), name='batch'),
+    path('api/jobs/', JobListView.as_view(), name='jobs'),
+    path('api/jobs/<int:pk>/', JobView.as_view(), name='job'),
+    path('api/pools/', DatabasePoolView.as_view(), name='pools'),
+    path('api/slow-queries/', SlowQueryView.as_view(), name='slow-queries')
 ]
@@ -0,0 +1,96 @@
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from asgiref.sync import sync_to_async
+
+from rozumity.authentication import AsyncSessionAuthentication
+from rozumity.backends.postgresql.base import get_pool_stats
+from rozumity.jobs import get_accepted_response, get_job_resource, job_runner, registry
+from rozumity.models import Job
+from rozumity.parsers import JSONAPIParser
+from rozumity.slowqueries import get_config, read_entries, summarize
+from rozumity.viewsets import AsyncAPIView
+
+
+class DatabasePoolView(AsyncAPIView):
+    """
+    Statistics of the database connection pools of this process.
+    """
+    authentication_classes = [AsyncSessionAuthentication]
+    permission_classes = [IsAdminUser]
+
+    async def get(self, request):
+        return Response({'data': [{
+            'type': 'pool', 'id': str(index), 'attributes': stats
+        } for index, stats in enumerate(await sync_to_async(get_pool_stats)())]})
+
+
+class SlowQueryView(AsyncAPIView):
+    """
+    The slow queries of the log grouped by fingerprint, the slowest
+    total first, filtered by `filter[route]` and `filter[fingerprint]`.
+    """
+    authentication_classes = [AsyncSessionAuthentication]
+    permission_classes = [IsAdminUser]
+
+    async def get(self, request):
+        config = get_config()
+        entries = await sync_to_async(read_entries)(config) if config is not None else []
+        route = request.query_params.get('filter[route]')
+        fingerprint = request.query_params.get('filter[fingerprint]')
+        entries = [entry for entry in entries
+                   if (route is None or entry['route'] == route) and
+                   (fingerprint is None or entry['fingerprint'] == fingerprint)]
+        return Response({'data': [{
+            'type': 'slow-query', 'id': key, 'attributes': group
+        } for key, group in summarize(entries)]})
+
+
+class JobView(AsyncAPIView):
+    """
+    A job with its progress, counts and errors, visible to the user who
+    queued it and to the staff.
+    """
+    authentication_classes = [AsyncSessionAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    async def get(self, request, pk):
+        jobs = Job.objects.all()
+        if not request.user.is_staff:
+            jobs = jobs.filter(user_id=request.user.id)
+        try:
+            job = await jobs.aget(pk=pk)
+        except Job.DoesNotExist:
+            return Response({'data': None}, status=404)
+        return Response({'data': get_job_resource(job, request.build_absolute_uri())})
+
+
+class JobListView(AsyncAPIView):
+    """
+    Queues a job of a type the staff may queue directly,
+    `{"data": {"type": "job", "attributes": {"type": ..., "params": {...}}}}`.
+    """
+    authentication_classes = [AsyncSessionAuthentication]
+    permission_classes = [IsAdminUser]
+    parser_classes = [JSONAPIParser, JSONParser]
+
+    async def post(self, request):
+        data = request.data.get('data') if type(request.data) == dict else None
+        attributes = data.get('attributes') if type(data) == dict else None
+        if data is None or data.get('type') != 'job' or type(attributes) != dict:
+            return self.error("A 'job' resource object is expected.", '/data')
+        job_type = registry.get(attributes.get('type'))
+        if job_type is None or not job_type.submittable:
+            return self.error('The job type can not be queued.', '/data/attributes/type')
+        params = attributes.get('params', {})
+        if type(params) != dict:
+            return self.error("The 'params' attribute must be an object.",
+                              '/data/attributes/params')
+        job = await job_runner.submit(job_type.name, params, request.user.id)
+        return get_accepted_response(job, request)
+
+    @staticmethod
+    def error(detail, pointer):
+        return Response(status=400, data={'jsonapi': {'version': '1.1'}, 'errors': [{
+            'status': 400, 'source': {'pointer': pointer}, 'detail': detail
+        }]})
@@ -0,0 +1,229 @@
+from asyncio import iscoroutinefunction
+from urllib.parse import urlencode
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.functional import classproperty
+from rest_framework import exceptions
+from rest_framework.exceptions import ParseError
+from adrf.views import APIView
+from adrf.viewsets import ViewSet
+from asgiref.sync import sync_to_async
+
+from rozumity.coalescing import single_flight
+from rozumity.geo import filter_near
+
+
+def filter_by_params(queryset, params, location=None):
+    """
+    The queryset filtered by the `filter[field]` and `filter[field__lookup]`
+    parameters, a parameter of an unknown field is ignored. With the path
+    of a city `location`, `filter[near]` selects the objects around a point.
+    """
+    filter_params = {}
+    for key, val in params.items():
+        if not key.startswith('filter['):
+            continue
+        key = key.split('[')[-1].replace(']', '')
+        if '__' in key:
+            split_key = key.split('__')
+            key, lookup = split_key[0], '__' + split_key[1]
+        else:
+            lookup = '__in'
+        try:
+            is_relation = bool(getattr(
+                queryset.model, key, None
+            ).field.remote_field)
+        except AttributeError:
+            continue
+        key = key + '__id' + lookup if is_relation else key + lookup
+        if ',' not in val and lookup != '__in' and val.isnumeric():
+            val = int(val)
+        elif lookup == '__range':
+            split = val.split(',')
+            val = [split[0], split[1]]
+        else:
+            val = val.split(',')
+        filter_params.update({key: val})
+    queryset = queryset.filter(**filter_params)
+    if location is not None:
+        queryset = filter_near(queryset, params, location)
+    return queryset
+
+
+def sort_by_params(queryset, params, fields):
+    """
+    The queryset ordered by the `sort` parameter, `-name` descending, then
+    by id. `fields` maps the names of the parameter to the columns or the
+    annotations of the queryset they sort by.
+    """
+    sort = params.get('sort')
+    ordering = []
+    for key in sort.split(',') if sort else []:
+        name = key.removeprefix('-')
+        column = fields.get(name)
+        if column is None or not (column in queryset.query.annotations
+                                  or hasattr(queryset.model, column)):
+            raise ParseError(f"The list can not be sorted by '{name}'.")
+        ordering.append(f'-{column}' if key.startswith('-') else column)
+    return queryset.order_by(*ordering, 'id')
+
+
+class AsyncInitialMixin:
+    """
+    Runs authentication, permissions and throttling on the event loop
+    instead of wrapping the whole `initial` into a single thread hop.
+    Authenticators may define `aauthenticate`, permissions may define
+    a coroutine `has_permission`, throttles may define `aallow_request`;
+    synchronous ones must not do any I/O.
+
+    With `coalesce_requests` the identical GET requests in flight at once
+    share one response, a view may only enable it when its responses
+    depend on the request alone, not on the user who passed the checks.
+    """
+    coalesce_requests = False
+
+    async def async_dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await self.ainitial(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        else:
+            if self.coalesce_requests and request.method in ('GET', 'HEAD'):
+                self.response = await single_flight.run(
+                    self.get_coalescing_key(request),
+                    lambda: self.arender(request, *args, **kwargs)
+                )
+                return self.response
+            response = await self.ahandle(request, *args, **kwargs)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def ahandle(self, request, *args, **kwargs):
+        if request.method.lower() in self.http_method_names:
+            handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+        else:
+            handler = self.http_method_not_allowed
+        try:
+            return await handler(request, *args, **kwargs)
+        except Exception as exc:
+            return self.handle_exception(exc)
+
+    async def arender(self, request, *args, **kwargs):
+        response = self.finalize_response(
+            request, await self.ahandle(request, *args, **kwargs), *args, **kwargs
+        )
+        if callable(getattr(response, 'render', None)):
+            await sync_to_async(response.render)()
+        return response
+
+    def get_coalescing_key(self, request):
+        # The links of the documents are absolute
+        return (
+            request.method, request.scheme, request._request.get_host(), request.path,
+            urlencode(sorted(request.query_params.lists()), doseq=True),
+            tuple(type(permission).__qualname__ for permission in self.get_permissions()),
+            request.accepted_media_type
+        )
+
+    async def ainitial(self, request, *args, **kwargs):
+        self.format_kwarg = self.get_format_suffix(**kwargs)
+        neg = self.perform_content_negotiation(request)
+        request.accepted_renderer, request.accepted_media_type = neg
+        version, scheme = self.determine_version(request, *args, **kwargs)
+        request.version, request.versioning_scheme = version, scheme
+        await self.aperform_authentication(request)
+        await self.acheck_permissions(request)
+        await self.acheck_throttles(request)
+
+    async def aperform_authentication(self, request):
+        for authenticator in request.authenticators:
+            authenticate = getattr(authenticator, 'aauthenticate', None)
+            if authenticate is None:
+                authenticate = sync_to_async(authenticator.authenticate)
+            try:
+                user_auth_tuple = await authenticate(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+        request._not_authenticated()
+
+    async def acheck_permissions(self, request):
+        for permission in self.get_permissions():
+            if iscoroutinefunction(permission.has_permission):
+                allowed = await permission.has_permission(request, self)
+            else:
+                allowed = permission.has_permission(request, self)
+            if not allowed:
+                self.permission_denied(
+                    request,
+                    message=getattr(permission, 'message', None),
+                    code=getattr(permission, 'code', None)
+                )
+
+    async def acheck_throttles(self, request):
+        # The first refusal stops, a refused request doesn't take the
+        # tokens of the following buckets
+        for throttle in self.get_throttles():
+            allow_request = getattr(throttle, 'aallow_request', None)
+            if allow_request is None:
+                allow_request = sync_to_async(throttle.allow_request)
+            if not await allow_request(request, self):
+                self.throttled(request, throttle.wait())
+
+
+class AsyncViewSet(AsyncInitialMixin, ViewSet):
+    # The path of the city of the resources for `filter[near]`
+    location_field = None
+    sort_fields = {'id': 'id'}
+
+    @classproperty
+    def view_is_async(cls):
+        # Classes such as `pagination_class` are attributes, not handlers
+        result = [
+            iscoroutinefunction(function)
+            for name, function in cls.__dict__.items()
+            if callable(function) and not isinstance(function, type)
+            and not name.startswith("__")
+        ]
+        is_async = any(result)
+        if is_async and not all(result):
+            raise ImproperlyConfigured(
+                f"{cls.__qualname__} action handlers must either be all sync "
+                "or all async."
+            )
+        return is_async
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            pagination_class = getattr(self, 'pagination_class', None)
+            self._paginator = pagination_class() if pagination_class else None
+        return self._paginator
+
+    async def get_object(self, pk):
+        batch = getattr(self.request._request, 'batch', None)
+        if batch is None:
+            return await self.queryset.aget(id=pk)
+        return await batch.get_or_set(
+            (self.__class__, str(pk)), lambda: self.queryset.aget(id=pk)
+        )
+
+    async def filter_queryset(self, queryset, request):
+        # The related resources are not located
+        location = self.location_field if queryset.model is self.queryset.model else None
+        return filter_by_params(queryset, request.query_params, location)
+
+    async def sort_queryset(self, queryset, request):
+        return sort_by_params(queryset, request.query_params, self.sort_fields)
+
+
+class AsyncAPIView(AsyncInitialMixin, APIView):
+    pass